@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "basic_crm.settings")
+# Serve the async view variants; see CRM_ASYNC_VIEWS in settings
+os.environ.setdefault("CRM_ASYNC_VIEWS", "True")
 
 application = get_asgi_application()
@@ -1,5 +1,5 @@
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -32,6 +32,10 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack; unused unless CRM_PROFILING is set
+    "crm.middleware.ProfilingMiddleware",
+    # Read replica routing for read-only views; see crm.routers
+    "crm.middleware.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -47,23 +51,51 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [CRM_DIR / 'templates'],
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "crm.context_processors.fragment_cache",
+            ],
+            "loaders": [
+                "django.template.loaders.filesystem.Loader",
+                "django.template.loaders.app_directories.Loader",
             ],
         },
     },
 ]
 
+# Compile each template once per process in production. In development the
+# plain loaders re-read templates so edits show up without a restart.
+if not DEBUG:
+    TEMPLATES[0]["OPTIONS"]["loaders"] = [
+        ("django.template.loaders.cached.Loader", TEMPLATES[0]["OPTIONS"]["loaders"]),
+    ]
+
 WSGI_APPLICATION = "basic_crm.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds and checked before
+# they are reused. DB_POOL switches to psycopg 3's connection pool instead
+# (Django does not combine the two), with DB_POOL_MIN_SIZE to
+# DB_POOL_MAX_SIZE connections per process and alias.
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+
+
+def database_connection_settings():
+    if DB_POOL:
+        pool = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+        }
+        return {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True, 'OPTIONS': {'pool': pool}}
+    return {'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int), 'CONN_HEALTH_CHECKS': True}
+
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -72,9 +104,99 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT'),
+        **database_connection_settings(),
+    },
+    # Read replica, see crm.routers. Points at the primary's server unless
+    # DB_REPLICA_HOST/DB_REPLICA_PORT are set, so both aliases work locally
+    # without a replica; tests mirror it onto the primary's test database.
+    'replica': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': config('DB_REPLICA_NAME', default=config('DB_NAME')),
+        'USER': config('DB_REPLICA_USER', default=config('DB_USER')),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', default=config('DB_PASSWORD')),
+        'HOST': config('DB_REPLICA_HOST', default=config('DB_HOST')),
+        'PORT': config('DB_REPLICA_PORT', default=config('DB_PORT')),
+        **database_connection_settings(),
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['crm.routers.PrimaryReplicaRouter']
+
+# Send reads of the views marked read-only (lists, detail pages, reports,
+# exports) to the replica. After a user's write, their reads stay on the
+# primary for CRM_REPLICA_STICKY_SECONDS so they see their own changes.
+CRM_READ_REPLICA = config('CRM_READ_REPLICA', default=False, cast=bool)
+CRM_REPLICA_STICKY_SECONDS = config('CRM_REPLICA_STICKY_SECONDS', default=10, cast=int)
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Use a shared backend (database, file or memcached) when running more than one
+# worker process, otherwise cache invalidation only reaches the local process.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='crm-default'),
     }
 }
 
+# Seconds a precomputed dashboard section may be served before it is rebuilt
+DASHBOARD_SNAPSHOT_TIMEOUT = config('DASHBOARD_SNAPSHOT_TIMEOUT', default=300, cast=int)
+
+# Seconds a rendered table row or page fragment is kept. Fragment keys carry
+# per-model version counters, so writes never serve stale HTML; this only
+# bounds how long unused fragments occupy the cache. 0 disables them.
+CRM_FRAGMENT_CACHE_TIMEOUT = config('CRM_FRAGMENT_CACHE_TIMEOUT', default=600, cast=int)
+
+# Seconds the customer detail aggregates (revenue, churn, lifetime value) are
+# cached. Keys carry per-customer versions bumped on every related write.
+CRM_DETAIL_CACHE_TIMEOUT = config('CRM_DETAIL_CACHE_TIMEOUT', default=600, cast=int)
+
+# Seconds a lead funnel report is cached. Keys carry the stage history
+# version, bumped by every new stage transition.
+CRM_FUNNEL_CACHE_TIMEOUT = config('CRM_FUNNEL_CACHE_TIMEOUT', default=600, cast=int)
+
+# Keyset pagination for list views and dashboard sections. Skips COUNT(*) and
+# OFFSET scans; page links carry opaque cursor tokens instead of page numbers.
+CRM_CURSOR_PAGINATION = config('CRM_CURSOR_PAGINATION', default=False, cast=bool)
+
+# Request profiling. A CRM_PROFILING_SAMPLE_RATE share of requests get a
+# Server-Timing header and a JSON line on the crm.profiling logger with
+# query count, SQL, template, Python and total time.
+CRM_PROFILING = config('CRM_PROFILING', default=False, cast=bool)
+CRM_PROFILING_SAMPLE_RATE = config('CRM_PROFILING_SAMPLE_RATE', default=0.01, cast=float)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'crm.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'crm.ingest': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+# Batch JSON API (api/v1/). Clients send "Authorization: Bearer <token>" with
+# one of these comma-separated tokens; logged-in sessions work as well.
+CRM_API_TOKENS = config('CRM_API_TOKENS', default='', cast=Csv())
+CRM_API_MAX_BATCH = config('CRM_API_MAX_BATCH', default=1000, cast=int)
+
+# Engagement ingestion (api/v1/ingest/engagements/). Each worker buffers up to
+# CRM_INGEST_BUFFER_SIZE events and answers 429 beyond that; the buffer is
+# written out CRM_INGEST_BATCH_SIZE rows at a time, at least every
+# CRM_INGEST_FLUSH_SECONDS.
+CRM_INGEST_BUFFER_SIZE = config('CRM_INGEST_BUFFER_SIZE', default=20000, cast=int)
+CRM_INGEST_BATCH_SIZE = config('CRM_INGEST_BATCH_SIZE', default=1000, cast=int)
+CRM_INGEST_FLUSH_SECONDS = config('CRM_INGEST_FLUSH_SECONDS', default=1.0, cast=float)
+
+# Route the dashboard, customer detail and autocomplete to their async
+# variants, which run independent queries concurrently. basic_crm.asgi turns
+# this on; under WSGI every async view would need its own event loop.
+CRM_ASYNC_VIEWS = config('CRM_ASYNC_VIEWS', default=False, cast=bool)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
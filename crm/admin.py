@@ -1,6 +1,6 @@
 from django.contrib import admin
 from .models import (
-    CustomerInformation, CustomDescriptionField, Product, ProductsPurchased, CustomerLead, Engagement, LifetimeValue, InternalServices
+    CustomerInformation, CustomerChurnScore, CustomDescriptionField, Product, ProductsPurchased, ProductSalesSummary, CustomerLead, Engagement, LifetimeValue, InternalServices, MetricCounter, JobCheckpoint
 )
 
 @admin.register(CustomerInformation)
@@ -18,6 +18,12 @@ class CustomerInformationAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(CustomerChurnScore)
+class CustomerChurnScoreAdmin(admin.ModelAdmin):
+    list_display = ['customer', 'score', 'engagement_count', 'average_engagement', 'last_engagement', 'computed_at']
+    search_fields = ['customer__name']
+    readonly_fields = ['computed_at']
+
 @admin.register(CustomDescriptionField)
 class CustomDescriptionFieldAdmin(admin.ModelAdmin):
     list_display = ['customer', 'description']
@@ -36,6 +42,11 @@ class ProductsPurchasedAdmin(admin.ModelAdmin):
     search_fields = ['customer__name', 'product__name']
     list_filter = ['date_of_sale', 'product']
 
+@admin.register(ProductSalesSummary)
+class ProductSalesSummaryAdmin(admin.ModelAdmin):
+    list_display = ['product', 'units_sold', 'revenue', 'distinct_buyers', 'last_sale_date']
+    search_fields = ['product__name']
+
 @admin.register(CustomerLead)
 class CustomerLeadAdmin(admin.ModelAdmin):
     list_display = ['customer', 'status', 'likelihood_to_convert', 'lead_stage']
@@ -59,3 +70,13 @@ class InternalServicesAdmin(admin.ModelAdmin):
     list_display = ['current_revenue', 'projected_revenue', 'current_growth_rate', 'internal_churn_rate']
     list_filter = ['current_growth_rate', 'internal_churn_rate']
     search_fields = ['current_revenue', 'projected_revenue']
+
+@admin.register(MetricCounter)
+class MetricCounterAdmin(admin.ModelAdmin):
+    list_display = ['name', 'value', 'updated_at']
+    search_fields = ['name']
+
+@admin.register(JobCheckpoint)
+class JobCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['name', 'last_id', 'last_run_at']
+    search_fields = ['name']
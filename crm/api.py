@@ -0,0 +1,244 @@
+"""
+Batch JSON API for leads, engagements and purchases (``api/v1/``).
+
+``POST api/v1/<resource>/`` takes a JSON array of records. Records with an
+``id`` update that row (fields left out keep their stored values), the rest
+are created. Every record is validated with the resource's form from
+``crm.forms``. If any record fails, nothing is written and the response
+lists the errors per record. Otherwise creates go through one
+``bulk_create`` and updates through one ``bulk_update``, in one
+transaction. Customers, products and the rows being updated are loaded
+with one query each for the whole batch, not one per record.
+
+Bulk writes skip the model signals, so each batch sends
+``crm.signals.bulk_saved``, with the stored rows of updated records passed
+as ``previous``.
+
+``GET api/v1/<resource>/?after=<id>&limit=<n>`` lists records in id order,
+for clients that page through everything changed since their last sync.
+
+Requests authenticate with ``Authorization: Bearer <token>`` for one of
+``CRM_API_TOKENS``, or with a logged-in session, which must also pass the
+CSRF check for writes.
+"""
+import hmac
+import json
+from collections import namedtuple
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.forms.models import model_to_dict
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils import timezone
+
+from .forms import LeadForm, EngagementForm, ProductsPurchasedForm
+from .models import CustomerInformation, CustomerLead, Engagement, Product, ProductsPurchased
+from .signals import bulk_saved
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# ``relations`` maps each foreign key field on the form to the model it points at
+Resource = namedtuple('Resource', 'model form relations')
+
+RESOURCES = {
+    'leads': Resource(CustomerLead, LeadForm, {'customer': CustomerInformation}),
+    'engagements': Resource(Engagement, EngagementForm, {'customer': CustomerInformation}),
+    'purchases': Resource(ProductsPurchased, ProductsPurchasedForm, {'customer': CustomerInformation, 'product': Product}),
+}
+
+
+class ApiError(Exception):
+    """A request-level problem, reported with ``status``."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def authenticate(request):
+    """Raises ApiError unless the request carries an API token or a valid session."""
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        token = header[len('Bearer '):].strip()
+        if not any(hmac.compare_digest(token, allowed) for allowed in settings.CRM_API_TOKENS if allowed):
+            raise ApiError("Invalid API token.", status=401)
+        return
+    if not request.user.is_authenticated:
+        raise ApiError("Authentication required.", status=401)
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        # The view is CSRF exempt for token clients; sessions still need the check
+        rejection = CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+        if rejection is not None:
+            raise ApiError("CSRF check failed.", status=403)
+
+
+def list_records(resource, after=None, limit=None):
+    """Returns one page of records after the id ``after``, in id order."""
+    resource = RESOURCES[resource]
+    try:
+        after = int(after) if after else 0
+        limit = min(int(limit), MAX_LIMIT) if limit else DEFAULT_LIMIT
+    except ValueError:
+        raise ApiError("after and limit must be integers.")
+    if limit < 1:
+        raise ApiError("limit must be positive.")
+    fields = ['id'] + list(resource.form._meta.fields)
+    records = list(resource.model.objects.filter(id__gt=after).order_by('id').values(*fields)[:limit])
+    return {
+        'results': records,
+        'next_after': records[-1]['id'] if len(records) == limit else None,
+    }
+
+
+def parse_batch(body):
+    """Decodes a request body into a list of record dicts."""
+    try:
+        records = json.loads(body)
+    except ValueError as exc:
+        raise ApiError(f"Invalid JSON: {exc}")
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise ApiError("Expected a JSON array of objects.")
+    if not records:
+        raise ApiError("The batch is empty.")
+    if len(records) > settings.CRM_API_MAX_BATCH:
+        raise ApiError(f"Batches are limited to {settings.CRM_API_MAX_BATCH} records.", status=413)
+    return records
+
+
+class PrefetchedModelChoiceField(forms.ModelChoiceField):
+    """Resolves primary keys against objects loaded once for the whole batch."""
+
+    def __init__(self, objects, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.objects = objects
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.objects[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
+def _batch_form(resource, related):
+    """Subclasses the resource's form to use the prefetched related objects."""
+
+    class BatchForm(resource.form):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            for name in resource.relations:
+                field = self.fields[name]
+                self.fields[name] = PrefetchedModelChoiceField(
+                    related[name], queryset=field.queryset, required=field.required
+                )
+
+        def _get_validation_exclusions(self):
+            # Already checked against the prefetched rows; model validation would query each one again
+            return super()._get_validation_exclusions() | set(resource.relations)
+
+    return BatchForm
+
+
+def _referenced_ids(records, name):
+    ids = set()
+    for record in records:
+        try:
+            ids.add(int(record[name]))
+        except (KeyError, TypeError, ValueError):
+            pass
+    return ids
+
+
+def save_batch(resource, records):
+    """
+    Validates and writes a batch. Returns ``(ok, results)``, with one result
+    per record in request order.
+    """
+    resource = RESOURCES[resource]
+    model = resource.model
+    fields = list(resource.form._meta.fields)
+
+    existing = model.objects.in_bulk(_referenced_ids(records, 'id'))
+    related = {}
+    for name, related_model in resource.relations.items():
+        ids = _referenced_ids(records, name) | {getattr(obj, f'{name}_id') for obj in existing.values()}
+        related[name] = related_model.objects.in_bulk(ids - {None})
+    form_class = _batch_form(resource, related)
+
+    results, to_create, to_update, previous = [], [], [], []
+    seen_ids = set()
+    for index, record in enumerate(records):
+        instance = None
+        if record.get('id') is not None:
+            instance = existing.get(_as_int(record['id']))
+            if instance is None:
+                results.append(_invalid(index, {'id': [f"No {model._meta.verbose_name} with id {record['id']}."]}))
+                continue
+            if instance.pk in seen_ids:
+                results.append(_invalid(index, {'id': ["The same id appears more than once in the batch."]}))
+                continue
+            seen_ids.add(instance.pk)
+            # Fields left out of an update keep their stored values
+            data = {**model_to_dict(instance, fields=fields), **record}
+            previous.append(_copy(instance))
+        else:
+            data = record
+
+        form = form_class(data=data, instance=instance)
+        if not form.is_valid():
+            results.append(_invalid(index, form.errors))
+            continue
+        obj = form.save(commit=False)
+        (to_update if instance is not None else to_create).append(obj)
+        results.append({'index': index, 'status': 'updated' if instance is not None else 'created', 'object': obj})
+
+    if any(result['status'] == 'invalid' for result in results):
+        for result in results:
+            if result['status'] != 'invalid':
+                result.pop('object')
+                result['status'] = 'not_written'
+        return False, results
+
+    with transaction.atomic():
+        if to_create:
+            model.objects.bulk_create(to_create)
+            bulk_saved.send(sender=model, objects=to_create, created=True, using='default')
+        if to_update:
+            update_fields = list(fields)
+            now = timezone.now()
+            for field in model._meta.concrete_fields:
+                # bulk_update does not run pre_save, so auto_now columns are set here
+                if getattr(field, 'auto_now', False):
+                    for obj in to_update:
+                        setattr(obj, field.attname, now)
+                    update_fields.append(field.name)
+            model.objects.bulk_update(to_update, update_fields)
+            bulk_saved.send(sender=model, objects=to_update, created=False, using='default', previous=previous)
+
+    for result in results:
+        result['id'] = result.pop('object').pk
+    return True, results
+
+
+def _copy(instance):
+    """A detached copy of a row as stored, before the form changes it."""
+    return instance.__class__(**{field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields})
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _invalid(index, errors):
+    return {
+        'index': index,
+        'status': 'invalid',
+        'errors': {field: [str(message) for message in messages] for field, messages in errors.items()},
+    }
@@ -0,0 +1,246 @@
+"""
+Per-process prefix index for the customer autocomplete endpoint.
+
+Customer names, name words, emails and companies are kept in sorted arrays,
+so a prefix lookup is a binary search followed by a short forward scan. When
+the prefix tiers do not fill the result list, a substring pass runs over a
+single newline-joined copy of every customer's fields using ``str.find``.
+
+The index is built lazily on first use and kept current in the writing
+process by the ``CustomerInformation`` signal receivers in ``crm.signals``.
+Other processes learn about writes through the ``CustomerInformation``
+version in ``crm.versions``, read at most once every
+``VERSION_CHECK_INTERVAL`` seconds so keystrokes do not each cost a cache
+round trip. A version this process produced itself needs nothing, since
+its writes were applied in place. Any other new version triggers a sync:
+customers whose ``updated_at`` is past the last sync (less
+``SYNC_OVERLAP``, for transactions that committed late) are re-read, and
+when the row count does not add up, the id list drops deleted customers
+and fills in any still missing. Only a sync touching a large part of the
+table rebuilds the index.
+
+Versions are plain ``set``s, so a concurrent write can be overwritten by
+this process's own bump before it is seen; a sync every
+``SYNC_INTERVAL`` seconds bounds how long such a write stays missing.
+"""
+import datetime
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.utils import timezone
+
+from . import versions
+from .models import CustomerInformation
+from .routers import primary_reads
+
+# Seconds between checks of the shared customer version
+VERSION_CHECK_INTERVAL = 1.0
+# Seconds between syncs even without a foreign version
+SYNC_INTERVAL = 60.0
+# Changes stamped this long before the last sync are read again
+SYNC_OVERLAP = datetime.timedelta(seconds=60)
+# A sync changing more than this share of the index (and over 1,000 customers) rebuilds it instead
+REBUILD_FRACTION = 0.1
+
+FIELDS = ('id', 'name', 'email', 'company')
+
+# Prefix tiers searched in order, best match first
+TIERS = ('name', 'word', 'email', 'company')
+
+
+def _normalize(value):
+    return (value or '').strip().casefold()
+
+
+class CustomerAutocompleteIndex:
+    """Sorted-array index over customer name, email and company."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._stale = False
+        self._version = None
+        self._checked_at = None
+        self._synced_at = None
+        self._synced_at_clock = None
+        self._records = {}
+        self._keys = {tier: [] for tier in TIERS}
+        self._haystack = None
+        self._offsets = []
+        self._haystack_ids = []
+
+    # --- Lookups ---
+    def search(self, term, limit=10):
+        """Returns up to ``limit`` customers, prefix matches before substring matches."""
+        term = _normalize(term)
+        if not term:
+            return []
+
+        with self._lock:
+            self._ensure_current()
+            seen = {}
+            for tier in TIERS:
+                self._collect_prefix(self._keys[tier], term, seen, limit)
+                if len(seen) >= limit:
+                    break
+            else:
+                self._collect_substring(term, seen, limit)
+            return [self._public(self._records[customer_id]) for customer_id in seen]
+
+    def _collect_prefix(self, keys, term, seen, limit):
+        position = bisect_left(keys, (term,))
+        while position < len(keys) and len(seen) < limit:
+            key, customer_id = keys[position]
+            if not key.startswith(term):
+                break
+            seen.setdefault(customer_id, None)
+            position += 1
+
+    def _collect_substring(self, term, seen, limit):
+        if self._haystack is None:
+            self._build_haystack()
+        position = self._haystack.find(term)
+        while position != -1 and len(seen) < limit:
+            row = bisect_left(self._offsets, position + 1) - 1
+            seen.setdefault(self._haystack_ids[row], None)
+            # Continue from the start of the next name
+            next_row = row + 1
+            if next_row >= len(self._offsets):
+                break
+            position = self._haystack.find(term, self._offsets[next_row])
+
+    def _public(self, record):
+        return {key: record[key] for key in FIELDS}
+
+    # --- Maintenance ---
+    def update(self, customer):
+        """Adds or replaces ``customer`` in the index."""
+        with self._lock:
+            if self._built:
+                self._replace({field: getattr(customer, 'pk' if field == 'id' else field) for field in FIELDS})
+
+    def remove(self, customer_id):
+        """Drops ``customer_id`` from the index."""
+        with self._lock:
+            if self._built:
+                self._remove(customer_id)
+
+    def invalidate(self):
+        """Syncs on the next lookup, e.g. after a bulk write; the version bump reaches the other processes."""
+        with self._lock:
+            self._stale = True
+
+    def clear(self):
+        """Discards the index so the next lookup rebuilds it."""
+        with self._lock:
+            self._built = False
+            self._records = {}
+            self._keys = {tier: [] for tier in TIERS}
+            self._haystack = None
+
+    def _ensure_current(self):
+        now = time.monotonic()
+        if self._built and not self._stale and now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        # Read before the rows, so a write that lands while they load triggers another sync
+        version, = versions.get_versions(CustomerInformation)
+        self._checked_at = now
+        # The index is tagged with the primary's version, so it must not load rows from a lagging replica
+        with primary_reads():
+            if not self._built:
+                self._rebuild(version)
+            elif self._stale or now - self._synced_at_clock >= SYNC_INTERVAL:
+                self._sync(version)
+            elif version != self._version:
+                if version == versions.bumped_here(CustomerInformation):
+                    # Our own write, already applied by update() or remove()
+                    self._version = version
+                else:
+                    self._sync(version)
+
+    def _rebuild(self, version):
+        started = timezone.now()
+        self.clear()
+        for record in CustomerInformation.objects.values(*FIELDS).iterator(chunk_size=5000):
+            self._records[record['id']] = record
+            for tier, key in self._record_keys(record):
+                self._keys[tier].append((key, record['id']))
+        for keys in self._keys.values():
+            keys.sort()
+        self._finish_sync(version, started)
+        self._built = True
+
+    def _sync(self, version):
+        """Applies the customers changed, added or deleted since the last sync."""
+        started = timezone.now()
+        customers = CustomerInformation.objects.values(*FIELDS)
+        changed = list(customers.filter(updated_at__gte=self._synced_at - SYNC_OVERLAP))
+        added = {record['id'] for record in changed} - self._records.keys()
+        deleted = missing = ()
+        # The id list is only read when the row count shows deletes or inserts that were not stamped
+        if CustomerInformation.objects.count() != len(self._records) + len(added):
+            ids = set(CustomerInformation.objects.values_list('id', flat=True))
+            deleted = self._records.keys() - ids
+            missing = ids - self._records.keys() - added
+        if len(changed) + len(deleted) + len(missing) > max(REBUILD_FRACTION * len(self._records), 1000):
+            return self._rebuild(version)
+        if missing:
+            changed += customers.filter(id__in=missing)
+        for customer_id in deleted:
+            self._remove(customer_id)
+        for record in changed:
+            self._replace(record)
+        self._finish_sync(version, started)
+
+    def _finish_sync(self, version, started):
+        self._version = version
+        self._synced_at = started
+        self._synced_at_clock = time.monotonic()
+        self._stale = False
+
+    def _record_keys(self, record):
+        name = _normalize(record['name'])
+        keys = [('name', name), ('email', _normalize(record['email']))]
+        keys += [('word', word) for word in name.split()[1:]]
+        if record['company']:
+            keys.append(('company', _normalize(record['company'])))
+        return keys
+
+    def _replace(self, record):
+        if self._records.get(record['id']) != record:
+            self._remove(record['id'])
+            self._add(record)
+
+    def _add(self, record):
+        self._records[record['id']] = record
+        for tier, key in self._record_keys(record):
+            insort(self._keys[tier], (key, record['id']))
+        self._haystack = None
+
+    def _remove(self, customer_id):
+        record = self._records.pop(customer_id, None)
+        if record is None:
+            return
+        for tier, key in self._record_keys(record):
+            keys = self._keys[tier]
+            position = bisect_left(keys, (key, customer_id))
+            if position < len(keys) and keys[position] == (key, customer_id):
+                del keys[position]
+        self._haystack = None
+
+    def _build_haystack(self):
+        names, offsets, ids = [], [], []
+        position = 0
+        for customer_id, record in self._records.items():
+            line = '\t'.join(_normalize(record[field]) for field in ('name', 'email', 'company'))
+            offsets.append(position)
+            ids.append(customer_id)
+            names.append(line)
+            position += len(line) + 1
+        self._haystack = '\n'.join(names)
+        self._offsets = offsets
+        self._haystack_ids = ids
+
+
+customer_index = CustomerAutocompleteIndex()
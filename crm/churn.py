@@ -0,0 +1,79 @@
+"""
+Batch churn scoring.
+
+Engagement aggregates for every customer come from one grouped query, the
+Low/Medium/High levels are mapped to ``Engagement.LEVEL_SCORES`` in SQL, and
+the scores are computed in a single NumPy pass per batch before being
+upserted into ``CustomerChurnScore``. Views read the stored score instead of
+calling ``CustomerInformation.likelihood_to_churn``.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Avg, Count, Max
+from django.utils import timezone
+
+from . import versions
+from .models import CustomerInformation, CustomerChurnScore, Engagement, InternalServices
+
+SCORE_FIELDS = ['score', 'engagement_count', 'average_engagement', 'last_engagement', 'computed_at']
+
+
+def compute_scores(churn_rate, average_engagement):
+    """
+    Vectorized form of ``likelihood_to_churn``: ``churn_rate * (1 - engagement)``.
+    Customers with no engagement (NaN) score 0, as the per-customer method does.
+    """
+    scores = churn_rate * (1.0 - average_engagement)
+    return np.where(np.isnan(average_engagement), 0.0, scores)
+
+
+def score_customers(batch_size=5000):
+    """Scores every customer and stores the results. Returns the number of customers scored."""
+    churn_rate = float(InternalServices.get_internal_churn_rate())
+    computed_at = timezone.now()
+    aggregates = (
+        CustomerInformation.objects
+        .annotate(
+            engagement_count=Count('engagement'),
+            average_engagement=Avg(Engagement.level_score('engagement__')),
+            last_engagement=Max('engagement__engagement_date'),
+        )
+        .order_by()
+        .values_list('id', 'engagement_count', 'average_engagement', 'last_engagement')
+    )
+
+    scored = 0
+    batch = []
+    for row in aggregates.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            scored += _write_batch(batch, churn_rate, computed_at)
+            batch = []
+    if batch:
+        scored += _write_batch(batch, churn_rate, computed_at)
+    transaction.on_commit(lambda: versions.bump(CustomerChurnScore))
+    return scored
+
+
+def _write_batch(rows, churn_rate, computed_at):
+    customer_ids, counts, averages, last_dates = zip(*rows)
+    average_engagement = np.array([np.nan if value is None else value for value in averages], dtype=float)
+    scores = compute_scores(churn_rate, average_engagement)
+
+    CustomerChurnScore.objects.bulk_create(
+        [
+            CustomerChurnScore(
+                customer_id=customer_id,
+                score=float(score),
+                engagement_count=count,
+                average_engagement=average,
+                last_engagement=last_engagement,
+                computed_at=computed_at,
+            )
+            for customer_id, score, count, average, last_engagement in zip(customer_ids, scores, counts, averages, last_dates)
+        ],
+        update_conflicts=True,
+        unique_fields=['customer'],
+        update_fields=SCORE_FIELDS,
+    )
+    return len(rows)
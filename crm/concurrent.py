@@ -0,0 +1,37 @@
+"""
+Concurrent ORM work for async views.
+
+The ORM is synchronous, so async views hand each independent piece of work
+to ``run_query``, which runs it in a worker thread (``sync_to_async`` with
+``thread_sensitive=False``). Every worker thread has its own database
+connection, so several queries awaited together with ``asyncio.gather`` run
+at the same time instead of one after another.
+
+Worker threads outlive the request and are not covered by the
+``request_finished`` handler that closes stale connections, so each call
+applies ``CONN_MAX_AGE`` to its thread's connections itself when it ends.
+"""
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def _run_and_release(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_query(func, *args, **kwargs):
+    """Returns an awaitable running ``func(*args, **kwargs)`` in a worker thread."""
+    return sync_to_async(_run_and_release, thread_sensitive=False)(func, *args, **kwargs)
+
+
+async def render_concurrently(response):
+    """
+    Renders a template response in a worker thread. Django would otherwise
+    render it on the one thread it shares between all sync code of async
+    requests, so concurrent requests would render one at a time.
+    """
+    await run_query(response.render)
+    return response
@@ -0,0 +1,130 @@
+"""
+Conditional GET for pages and API responses.
+
+``conditional(state)`` wraps a view. Before the view runs, ``state(request,
+*args, **kwargs)`` names what the response is rendered from: version
+counters from ``crm.versions`` (cache reads) and, for detail pages, the
+row's ``updated_at`` (one primary key lookup). These become an ETag and,
+for pages rendered from nothing but the row, a Last-Modified date. When the
+client's ``If-None-Match`` or ``If-Modified-Since`` still matches, the view
+is skipped and a 304 is returned, so none of its aggregation or rendering
+runs.
+
+The ETag also covers the full path, the user and the CSRF cookie, because
+pages differ by query string and embed the user's CSRF token. Responses
+are marked ``private, no-cache`` so browsers keep them but revalidate
+every time, and shared caches do not store them.
+
+A page rendered from the replica may be older than the versions in its
+state, so it is sent without validators; a 304 is still answered when the
+client's copy matches.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import versions
+from .concurrent import run_query
+from .routers import reading_replica
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def conditional(state):
+    """
+    Decorates a view with ETag/Last-Modified handling. ``state`` returns
+    ``(parts, last_modified)``, or None to skip it (e.g. the row is missing).
+    Async views are supported; ``state`` then runs in a worker thread.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in SAFE_METHODS:
+                    return await view(request, *args, **kwargs)
+                validators, response = await run_query(_evaluate, state, request, args, kwargs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(response, validators)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return view(request, *args, **kwargs)
+            validators, response = _evaluate(state, request, args, kwargs)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(response, validators)
+        return wrapper
+    return decorator
+
+
+def _evaluate(state, request, args, kwargs):
+    """Returns the ETag and timestamp, plus a 304 response when the client's copy is current."""
+    current = state(request, *args, **kwargs)
+    if current is None:
+        return None, None
+    parts, last_modified = current
+    etag = quote_etag(_digest(request, parts))
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return (etag, timestamp), get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def _finish(response, validators):
+    if validators is None or response.status_code not in (200, 304):
+        return response
+    if response.status_code == 200 and reading_replica():
+        return response
+    etag, timestamp = validators
+    response.headers.setdefault('ETag', etag)
+    if timestamp is not None:
+        response.headers.setdefault('Last-Modified', http_date(timestamp))
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _digest(request, parts):
+    digest = hashlib.md5(usedforsecurity=False)
+    user = getattr(request, 'user', None)
+    for part in (request.get_full_path(), getattr(user, 'pk', None), request.COOKIES.get(settings.CSRF_COOKIE_NAME), *parts):
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def model_state(*targets):
+    """State for pages rendered from whole tables: their versions, no Last-Modified."""
+    def state(request, *args, **kwargs):
+        return versions.get_versions(*targets), None
+    return state
+
+
+def row_state(model, *targets, url_kwarg='pk', daily=False):
+    """
+    State for a detail page: the row's ``updated_at`` plus the versions of
+    ``targets``, where ``'self'`` stands for the row's own version. With
+    ``daily`` the current date is included too, for pages that show an age
+    in days.
+
+    Writes to other targets do not move ``updated_at``, so Last-Modified is
+    only sent for pages that depend on nothing but the row.
+    """
+    row_only = not daily and all(target == 'self' for target in targets)
+
+    def state(request, *args, **kwargs):
+        pk = kwargs[url_kwarg]
+        updated_at = model.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return None
+        resolved = [(model, pk) if target == 'self' else target for target in targets]
+        parts = [updated_at, *versions.get_versions(*resolved)]
+        if daily:
+            parts.append(timezone.now().date())
+        return parts, updated_at if row_only else None
+    return state
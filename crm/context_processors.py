@@ -0,0 +1,14 @@
+from django.conf import settings
+
+from .routers import reading_replica
+
+
+def fragment_cache(request):
+    """
+    Exposes the fragment cache timeout to the {% cache %} tags in templates.
+    Pages rendered from the replica still read cached fragments but store
+    none (timeout 0): their rows may be older than the versions in the keys.
+    """
+    if reading_replica():
+        return {'fragment_cache_timeout': 0}
+    return {'fragment_cache_timeout': settings.CRM_FRAGMENT_CACHE_TIMEOUT}
@@ -0,0 +1,117 @@
+"""
+Precomputed dashboard snapshot.
+
+The unfiltered first page of each dashboard section and the KPI block are
+cached under their own key, so a write only invalidates the sections it
+touches and the common dashboard hit is served from a single cache read.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+from .models import CustomerInformation, CustomerLead, Product, Engagement, InternalServices, MetricCounter
+from .routers import primary_reads
+from .search import search_customers
+
+PAGE_SIZE = 10
+CACHE_PREFIX = 'crm:dashboard:'
+
+PAGED_SECTIONS = ('customers', 'leads', 'products', 'engagements')
+SECTIONS = PAGED_SECTIONS + ('kpis',)
+
+# Sections rendered from each model. Leads show the linked customer's name,
+# so customer writes invalidate them as well, and the churn KPI is derived
+# from customers and lost leads.
+SECTION_DEPENDENCIES = {
+    CustomerInformation: ('customers', 'leads', 'kpis'),
+    CustomerLead: ('leads', 'kpis'),
+    Product: ('products',),
+    Engagement: ('engagements',),
+    InternalServices: ('kpis',),
+}
+
+
+def section_queryset(section, search='', segment=''):
+    """Returns the queryset backing a paged dashboard section; ``segment`` filters customers by RFM segment."""
+    if section == 'customers':
+        # Already ordered, by relevance when searching
+        customers = search_customers(search)
+        if segment:
+            customers = customers.filter(rfm__segment=segment)
+        return customers
+    if section == 'leads':
+        queryset = CustomerLead.objects.select_related('customer')
+        if search:
+            queryset = queryset.filter(
+                Q(customer__name__icontains=search) |
+                Q(status__icontains=search)
+            )
+    elif section == 'products':
+        queryset = Product.objects.all()
+        if search:
+            queryset = queryset.filter(name__icontains=search)
+    elif section == 'engagements':
+        queryset = Engagement.objects.all()
+        if search:
+            queryset = queryset.filter(
+                Q(customer__name__icontains=search) |
+                Q(type_of_engagement__icontains=search)
+            )
+    else:
+        raise ValueError(f"Unknown dashboard section: {section}")
+    return queryset.order_by('pk')
+
+
+def kpi_context():
+    """Returns the KPI block shown at the top of the dashboard."""
+    internal_services = InternalServices.objects.first()
+    churn_rate = MetricCounter.kpis()['internal_churn_rate']
+    if internal_services:
+        return {
+            'growth_rate': internal_services.current_growth_rate or "N/A",
+            'projected_revenue': internal_services.projected_revenue or 0,
+            'churn_rate': churn_rate,
+        }
+    return {'growth_rate': "N/A", 'projected_revenue': 0, 'churn_rate': churn_rate}
+
+
+def build_section(section):
+    """Computes the snapshot entry for a single section."""
+    if section == 'kpis':
+        return kpi_context()
+    queryset = section_queryset(section)
+    # One extra row tells a cursor paginator whether there is a next page
+    return {'rows': list(queryset[:PAGE_SIZE + 1]), 'count': queryset.count()}
+
+
+def get_snapshot(sections=SECTIONS):
+    """Returns the snapshot entries for ``sections``, rebuilding any that are missing."""
+    keys = {section: CACHE_PREFIX + section for section in sections}
+    cached = cache.get_many(keys.values())
+
+    snapshot, missing = {}, {}
+    # A section stays cached until a write invalidates it, so it is built from the primary, which has every write
+    with primary_reads():
+        for section, key in keys.items():
+            if key in cached:
+                snapshot[section] = cached[key]
+            else:
+                snapshot[section] = missing[key] = build_section(section)
+
+    if missing:
+        cache.set_many(missing, settings.DASHBOARD_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def invalidate(*sections):
+    """Drops the cached snapshot for ``sections`` (all sections by default)."""
+    cache.delete_many([CACHE_PREFIX + section for section in sections or SECTIONS])
+
+
+class SnapshotPaginator(Paginator):
+    """Paginator over a cached first page whose total count is already known."""
+
+    def __init__(self, rows, count, per_page=PAGE_SIZE):
+        super().__init__(rows, per_page)
+        self.count = count
@@ -0,0 +1,65 @@
+"""
+Read-through cache for the aggregates on customer detail pages.
+
+Total revenue, churn likelihood and lifetime value are computed on the
+first view and cached under the customer's id plus the versions (see
+``crm.versions``) of what they are derived from:
+
+- the customer's own version, bumped by the receivers in ``crm.signals``
+  whenever one of their purchases, engagements, lifetime values or
+  descriptions is written, and by the lifetime value pipeline for the
+  customers it updates;
+- the ``CustomerChurnScore`` and ``InternalServices`` versions, bumped by
+  the churn scoring job and by edits of the internal churn rate.
+
+Only ``get``, ``set`` and ``add`` are used, so the local-memory, file-based
+and database cache backends all work.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+from . import versions
+from .models import (
+    CustomerInformation, CustomerChurnScore, CustomDescriptionField, Engagement, InternalServices, LifetimeValue,
+    ProductsPurchased
+)
+from .routers import primary_reads, reading_replica
+
+CACHE_PREFIX = 'crm:detail:customer:'
+
+# Rows whose writes change a customer's aggregates or detail page
+CUSTOMER_DEPENDENCIES = (ProductsPurchased, Engagement, LifetimeValue, CustomDescriptionField)
+
+
+def customer_aggregates(customer):
+    """Returns the customer's detail aggregates, computing them on a cache miss."""
+    version = versions.version_key(CustomerChurnScore, InternalServices, (CustomerInformation, customer.pk))
+    key = f'{CACHE_PREFIX}{customer.pk}:{version}'
+    aggregates = cache.get(key)
+    if aggregates is None:
+        if reading_replica():
+            # The churn score the view loaded with the customer came from the replica
+            customer = CustomerInformation(pk=customer.pk)
+        # The versions in the key come from the primary, so the aggregates must too
+        with primary_reads():
+            aggregates = compute_customer_aggregates(customer)
+        cache.set(key, aggregates, settings.CRM_DETAIL_CACHE_TIMEOUT)
+    return aggregates
+
+
+def compute_customer_aggregates(customer):
+    churn_score = getattr(customer, 'churn_score', None)
+    # Stored by crm_recompute_lifetime_value rather than computed per request
+    lifetime_value = LifetimeValue.objects.filter(customer=customer).values_list('lifetime_value', flat=True).first()
+    return {
+        'total_revenue': ProductsPurchased.objects.filter(customer=customer).aggregate(total=Sum('amount_spent'))['total'] or 0,
+        'likelihood_to_churn': churn_score.score if churn_score else customer.likelihood_to_churn(),
+        'lifetime_value': lifetime_value or 0,
+    }
+
+
+def invalidate_customers(customer_ids):
+    """Moves the cached aggregates of ``customer_ids`` to fresh keys."""
+    if customer_ids:
+        versions.bump(*[(CustomerInformation, customer_id) for customer_id in customer_ids])
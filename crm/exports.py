@@ -0,0 +1,146 @@
+"""
+Constant-memory exports of customers, purchases and engagements.
+
+Rows are read with ``values_list`` projections through
+``QuerySet.iterator(chunk_size=...)`` (a server-side cursor on Postgres),
+encoded as CSV or JSONL and handed out in chunks of roughly
+``BUFFER_SIZE`` bytes, optionally gzipped on the fly. Memory use depends
+on the chunk size, not on the number of rows exported, so the same code
+path serves the export views and ``manage.py crm_export``.
+
+Exports are ordered by id. ``after_id`` resumes after the last row of a
+previous export, and ``since``/``until`` select an inclusive range of the
+dataset's date column. Column names match what ``crm_import`` reads.
+"""
+import csv
+import datetime
+import json
+import zlib
+from collections import namedtuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import CustomerInformation, ProductsPurchased, Engagement
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+# ``columns`` pairs each exported column name with the lookup it is read from
+Dataset = namedtuple('Dataset', 'model columns date_field')
+
+DATASETS = {
+    'customers': Dataset(CustomerInformation, (
+        ('id', 'id'), ('name', 'name'), ('email', 'email'), ('phone', 'phone'), ('industry', 'industry'),
+        ('company', 'company'), ('education', 'education'), ('income', 'income'), ('created_at', 'created_at'),
+    ), 'created_at'),
+    'purchases': Dataset(ProductsPurchased, (
+        ('id', 'id'), ('customer_email', 'customer__email'), ('product', 'product_id'),
+        ('product_name', 'product__name'), ('number_of_products_purchased', 'number_of_products_purchased'),
+        ('date_of_sale', 'date_of_sale'), ('amount_spent', 'amount_spent'),
+    ), 'date_of_sale'),
+    'engagements': Dataset(Engagement, (
+        ('id', 'id'), ('customer_email', 'customer__email'), ('level_of_engagement', 'level_of_engagement'),
+        ('type_of_engagement', 'type_of_engagement'), ('engagement_date', 'engagement_date'),
+    ), 'engagement_date'),
+}
+
+
+def parse_filters(since=None, until=None, after_id=None):
+    """Validates raw filter values from a query string or the command line."""
+    filters = {}
+    for name, value in (('since', since), ('until', until)):
+        if value:
+            parsed = parse_date(value)
+            if parsed is None:
+                raise ValueError(f"{name} must be a date (YYYY-MM-DD), got {value!r}")
+            filters[name] = parsed
+    if after_id:
+        try:
+            filters['after_id'] = int(after_id)
+        except ValueError:
+            raise ValueError(f"after_id must be an integer, got {after_id!r}")
+    return filters
+
+
+def export_queryset(name, since=None, until=None, after_id=None):
+    """Returns the ordered ``values_list`` queryset for a dataset export."""
+    dataset = DATASETS[name]
+    queryset = dataset.model.objects.all()
+    date_field = dataset.model._meta.get_field(dataset.date_field)
+    if date_field.get_internal_type() == 'DateTimeField':
+        # Whole days in the current time zone, compared as datetimes so the column index is usable
+        if since:
+            queryset = queryset.filter(**{f'{dataset.date_field}__gte': _start_of_day(since)})
+        if until:
+            queryset = queryset.filter(**{f'{dataset.date_field}__lt': _start_of_day(until + datetime.timedelta(days=1))})
+    else:
+        if since:
+            queryset = queryset.filter(**{f'{dataset.date_field}__gte': since})
+        if until:
+            queryset = queryset.filter(**{f'{dataset.date_field}__lte': until})
+    if after_id is not None:
+        queryset = queryset.filter(id__gt=after_id)
+    return queryset.order_by('id').values_list(*[lookup for _, lookup in dataset.columns])
+
+
+def _start_of_day(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def stream_export(name, file_format='csv', compress=False, chunk_size=CHUNK_SIZE, **filters):
+    """Yields the encoded (and optionally gzipped) export as byte chunks."""
+    rows = export_queryset(name, **filters).iterator(chunk_size=chunk_size)
+    lines = _encode(DATASETS[name], rows, file_format)
+    chunks = _buffer(lines)
+    return _gzip(chunks) if compress else chunks
+
+
+def _encode(dataset, rows, file_format):
+    headers = [column for column, _ in dataset.columns]
+    if file_format == 'jsonl':
+        encoder = DjangoJSONEncoder(separators=(',', ':'))
+        for row in rows:
+            yield encoder.encode(dict(zip(headers, row))) + '\n'
+        return
+
+    class Line:
+        """File-like target that hands back what csv.writer writes."""
+        def write(self, value):
+            return value
+
+    writer = csv.writer(Line())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _buffer(lines):
+    """Joins small encoded lines into chunks of about BUFFER_SIZE bytes."""
+    pending, size = [], 0
+    for line in lines:
+        data = line.encode()
+        pending.append(data)
+        size += len(data)
+        if size >= BUFFER_SIZE:
+            yield b''.join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_filename(name, file_format, compress=False):
+    filename = f"{name}-{timezone.localdate().isoformat()}.{file_format}"
+    return filename + '.gz' if compress else filename
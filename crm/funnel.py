@@ -0,0 +1,176 @@
+"""
+Lead stage history and funnel analytics.
+
+``record_stage_changes`` appends a ``LeadStageTransition`` for every lead
+that is new or whose stage differs from its stored one. The receivers in
+``crm.signals`` call it for lead saves and bulk writes, so the history
+grows with every stage change and is never rewritten.
+
+``funnel_report`` takes the leads created in a date range (the cohort) and
+returns per stage how many leads entered it, how many of those went on to a
+later funnel stage, and the median time spent in it. There is no portable
+SQL median, so the cohort's transitions are read in one query, each with
+the time of the lead's next transition (a ``LEAD()`` window), and grouped in
+Python. Reports are cached under the ``LeadStageTransition`` version, which
+new transitions and lead deletes bump.
+"""
+import datetime
+import statistics
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import Lead
+from django.utils import timezone
+
+from . import versions
+from .models import CustomerLead, LeadStageTransition
+from .routers import primary_reads
+
+CACHE_PREFIX = 'crm:funnel:'
+
+# The stages a lead moves through in order; Lost is an exit from any of them
+FUNNEL_STAGES = ['Initial Contact', 'Qualified', 'Negotiation', 'Won']
+EXIT_STAGES = ['Lost']
+
+
+# --- History ---
+def record_stage_changes(leads, stored_stages=None):
+    """
+    Appends a transition for each of ``leads`` whose stage is not the one in
+    ``stored_stages`` (``{pk: stage}``; leads missing from it are new). When
+    None, the last recorded stage of each lead is looked up instead.
+    """
+    if stored_stages is None:
+        stored_stages = last_recorded_stages([lead.pk for lead in leads])
+    now = timezone.now()
+    transitions = [
+        LeadStageTransition(
+            lead_id=lead.pk, from_stage=stored_stages.get(lead.pk) or '', to_stage=lead.lead_stage,
+            changed_at=lead.updated_at or now,
+        )
+        for lead in leads
+        if lead.lead_stage != stored_stages.get(lead.pk)
+    ]
+    if transitions:
+        LeadStageTransition.objects.bulk_create(transitions)
+        transaction.on_commit(invalidate)
+    return len(transitions)
+
+
+def last_recorded_stages(lead_ids):
+    """Maps each of ``lead_ids`` with any history to the stage it last entered."""
+    stages = {}
+    rows = LeadStageTransition.objects.filter(lead_id__in=lead_ids).order_by('lead_id', 'changed_at', 'id')
+    for lead_id, stage in rows.values_list('lead_id', 'to_stage'):
+        stages[lead_id] = stage
+    return stages
+
+
+def backfill_transitions(batch_size=2000):
+    """Records the current stage of leads without any history, as entered when they were created."""
+    now = timezone.now()
+    leads = CustomerLead.objects.filter(stage_transitions__isnull=True).values_list('pk', 'lead_stage', 'created_at')
+    created = LeadStageTransition.objects.bulk_create(
+        (LeadStageTransition(lead_id=pk, to_stage=stage, changed_at=created_at or now) for pk, stage, created_at in leads),
+        batch_size=batch_size,
+    )
+    if created:
+        transaction.on_commit(invalidate)
+    return len(created)
+
+
+def invalidate():
+    versions.bump(LeadStageTransition)
+
+
+def stage_history(lead):
+    """The lead's transitions, oldest first, each with ``days`` spent in the stage (up to now for the current one)."""
+    transitions = list(lead.stage_transitions.order_by('changed_at', 'id'))
+    now = timezone.now()
+    for transition, following in zip(transitions, transitions[1:] + [None]):
+        left_at = following.changed_at if following else now
+        transition.days = round((left_at - transition.changed_at).total_seconds() / 86400, 1)
+    return transitions
+
+
+# --- Reports ---
+def funnel_report(start=None, end=None):
+    """The funnel for leads created from ``start`` to ``end`` (inclusive dates, open-ended when None), cached."""
+    key = f'{CACHE_PREFIX}{start}:{end}:{versions.version_key(LeadStageTransition)}'
+    report = cache.get(key)
+    if report is None:
+        # Computed from the same primary that the version in the key comes from
+        with primary_reads():
+            report = compute_funnel(start, end)
+        cache.set(key, report, settings.CRM_FUNNEL_CACHE_TIMEOUT)
+    return report
+
+
+def compute_funnel(start=None, end=None):
+    transitions = LeadStageTransition.objects.all()
+    if start is not None:
+        transitions = transitions.filter(lead__created_at__date__gte=start)
+    if end is not None:
+        transitions = transitions.filter(lead__created_at__date__lte=end)
+    # Whole leads are selected, so each lead's next transition is always in the result
+    rows = transitions.annotate(
+        left_at=Window(Lead('changed_at'), partition_by=[F('lead_id')], order_by=[F('changed_at').asc(), F('id').asc()]),
+    ).values_list('lead_id', 'to_stage', 'changed_at', 'left_at')
+
+    entered = {stage: set() for stage in FUNNEL_STAGES + EXIT_STAGES}
+    current = dict.fromkeys(entered, 0)
+    dwell = {stage: [] for stage in entered}
+    furthest = {}
+    for lead_id, stage, changed_at, left_at in rows:
+        if stage not in entered:
+            continue
+        entered[stage].add(lead_id)
+        if left_at is None:
+            current[stage] += 1
+        else:
+            dwell[stage].append((left_at - changed_at).total_seconds() / 86400)
+        if stage in FUNNEL_STAGES:
+            furthest[lead_id] = max(furthest.get(lead_id, 0), FUNNEL_STAGES.index(stage))
+
+    stages = []
+    for stage, leads in entered.items():
+        row = {
+            'stage': stage,
+            'entered': len(leads),
+            'current': current[stage],
+            'median_days': round(statistics.median(dwell[stage]), 1) if dwell[stage] else None,
+            'advanced': None,
+            'conversion_rate': None,
+        }
+        if stage in FUNNEL_STAGES[:-1]:
+            index = FUNNEL_STAGES.index(stage)
+            row['advanced'] = sum(1 for lead_id in leads if furthest[lead_id] > index)
+            row['conversion_rate'] = round(100 * row['advanced'] / len(leads), 1) if leads else None
+        stages.append(row)
+
+    cohort = len({lead_id for leads in entered.values() for lead_id in leads})
+    won = len(entered['Won'])
+    return {
+        'start': start,
+        'end': end,
+        'leads': cohort,
+        'won': won,
+        'win_rate': round(100 * won / cohort, 1) if cohort else None,
+        'stages': stages,
+    }
+
+
+def parse_funnel_params(data):
+    """Reads the cohort's ``start`` and ``end`` dates from a query dict. Raises ValueError for invalid values."""
+    params = {}
+    for name in ('start', 'end'):
+        value = data.get(name)
+        try:
+            params[name] = datetime.date.fromisoformat(value) if value else None
+        except ValueError:
+            raise ValueError(f"{name} must be a date (YYYY-MM-DD).")
+    if params['start'] and params['end'] and params['start'] > params['end']:
+        raise ValueError("start must not be after end.")
+    return params
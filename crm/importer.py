@@ -0,0 +1,271 @@
+"""
+Streaming bulk import of customers, purchases and engagements.
+
+Rows are read lazily from CSV (with a header row) or JSONL files and
+processed in batches. Each row is validated with the model's own field
+validation. Customer and product references are resolved through
+in-memory lookup maps rather than a query per row, and each batch is
+written in one transaction:
+
+- customers are upserted on ``email`` with ``bulk_create``, after one query
+  for the stored rows of the batch's emails, which tells inserts from
+  updates;
+- purchases and engagements are inserted with ``COPY`` on Postgres when the
+  psycopg 3 driver is in use, and with ``bulk_create`` otherwise.
+
+The model signals do not fire for these writes, so every batch sends
+``crm.signals.bulk_saved`` to refresh the sales summaries, KPI counters,
+dashboard snapshot and autocomplete index.
+
+Columns are the model field names, except that purchases and engagements
+name their customer with ``customer_email`` and purchases name their
+product with ``product``, either its id or its exact name.
+"""
+import csv
+import json
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+from .models import CustomerInformation, Product, ProductsPurchased, Engagement, normalize_phone
+from .signals import bulk_saved
+
+FORMATS = ('csv', 'jsonl')
+
+BatchResult = namedtuple('BatchResult', 'number rows written errors seconds')
+
+
+def detect_format(path):
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension == 'ndjson':
+        return 'jsonl'
+    if extension not in FORMATS:
+        raise ValueError(f"Cannot tell the format of {path}; pass one of {', '.join(FORMATS)}")
+    return extension
+
+
+def read_rows(path, file_format=None):
+    """Yields ``(line_number, row, error)`` for each record in the file, reading it lazily."""
+    file_format = file_format or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as handle:
+        if file_format == 'csv':
+            # Line numbers count the header, matching what a spreadsheet shows
+            for line_number, row in enumerate(csv.DictReader(handle), start=2):
+                yield line_number, row, None
+            return
+        for line_number, line in enumerate(handle, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_number, None, f"invalid JSON: {exc}"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, None, "expected a JSON object"
+                continue
+            yield line_number, row, None
+
+
+def copy_available(using='default'):
+    """True when rows can be streamed with COPY, i.e. Postgres through psycopg 3."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        return hasattr(cursor.cursor, 'copy')
+
+
+def copy_insert(model, objects, using='default'):
+    """Inserts ``objects`` with a single COPY; primary keys are not returned."""
+    connection = connections[using]
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        with cursor.cursor.copy(f'COPY {table} ({columns}) FROM STDIN') as copy:
+            for obj in objects:
+                copy.write_row([field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields])
+
+
+class Importer:
+    """Validates and writes one kind of record; subclasses describe the model and columns."""
+    model = None
+    fields = ()
+    customer_column = None
+
+    def __init__(self, batch_size=2000, use_copy=None, using='default'):
+        self.batch_size = batch_size
+        self.using = using
+        self.use_copy = copy_available(using) if use_copy is None else use_copy
+        self.customer_ids = {}
+
+    def run(self, records):
+        """Consumes ``(line_number, row, error)`` records, yielding a BatchResult per batch."""
+        batch = []
+        number = 0
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                number += 1
+                yield self.import_batch(number, batch)
+                batch = []
+        if batch:
+            yield self.import_batch(number + 1, batch)
+
+    def import_batch(self, number, records):
+        started = time.perf_counter()
+        errors = [(line_number, error) for line_number, row, error in records if error]
+        rows = [(line_number, row) for line_number, row, error in records if not error]
+        if self.customer_column:
+            self.load_customer_ids(row.get(self.customer_column) for _, row in rows)
+
+        objects = []
+        for line_number, row in rows:
+            try:
+                objects.append(self.build(row))
+            except ValidationError as exc:
+                errors.append((line_number, '; '.join(exc.messages)))
+
+        written = 0
+        if objects:
+            try:
+                with transaction.atomic(using=self.using):
+                    written = self.write(objects)
+            except DatabaseError as exc:
+                errors.append((None, f"batch {number} was not written: {exc}"))
+        errors.sort(key=lambda error: error[0] or 0)
+        return BatchResult(number, len(records), written, errors, time.perf_counter() - started)
+
+    def build(self, row):
+        """Builds a validated, unsaved instance from a row."""
+        values = {}
+        for name in self.fields:
+            value = row.get(name)
+            if value is None or value == '':
+                continue
+            values[name] = value
+        instance = self.model(**values, **self.resolve(row))
+        instance.clean_fields(exclude=self.unvalidated_fields())
+        if settings.USE_TZ:
+            for field in self.model._meta.concrete_fields:
+                value = getattr(instance, field.attname)
+                if field.get_internal_type() == 'DateTimeField' and value and timezone.is_naive(value):
+                    setattr(instance, field.attname, timezone.make_aware(value))
+        return instance
+
+    def resolve(self, row):
+        """Returns foreign key values for a row, looked up in the in-memory maps."""
+        if not self.customer_column:
+            return {}
+        email = (row.get(self.customer_column) or '').strip()
+        if email not in self.customer_ids:
+            raise ValidationError(f"Unknown customer email {email!r}.")
+        return {'customer_id': self.customer_ids[email]}
+
+    def unvalidated_fields(self):
+        # Foreign keys come from the lookup maps; validating them would cost a query per row
+        return [field.name for field in self.model._meta.concrete_fields if field.is_relation]
+
+    def load_customer_ids(self, emails):
+        """Adds the batch's customers to the email map with one query."""
+        missing = {email.strip() for email in emails if email} - set(self.customer_ids)
+        if missing:
+            self.customer_ids.update(
+                CustomerInformation.objects.using(self.using).filter(email__in=missing).values_list('email', 'id')
+            )
+
+    def write(self, objects):
+        if self.use_copy:
+            copy_insert(self.model, objects, self.using)
+        else:
+            self.model.objects.using(self.using).bulk_create(objects, batch_size=self.batch_size)
+        bulk_saved.send(sender=self.model, objects=objects, created=True, using=self.using)
+        return len(objects)
+
+
+class CustomerImporter(Importer):
+    model = CustomerInformation
+    fields = ('name', 'email', 'phone', 'industry', 'company', 'education', 'income')
+
+    def build(self, row):
+        customer = super().build(row)
+        customer.phone_digits = normalize_phone(customer.phone)
+        return customer
+
+    def write(self, objects):
+        # Later rows win when the same email appears twice in a batch
+        customers = list({customer.email: customer for customer in objects}.values())
+        # The stored rows tell inserts from updates, so signal receivers can apply deltas instead of
+        # recounting; an email inserted concurrently by another writer drifts until the next reconcile
+        stored = {
+            customer.email: customer
+            for customer in CustomerInformation.objects.using(self.using).filter(
+                email__in=[customer.email for customer in customers]
+            )
+        }
+        CustomerInformation.objects.using(self.using).bulk_create(
+            customers,
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=['email'],
+            update_fields=[field for field in self.fields if field != 'email'] + ['phone_digits', 'updated_at'],
+        )
+        for customer in customers:
+            if customer.pk is None and customer.email in stored:
+                customer.pk = stored[customer.email].pk
+            if customer.pk is not None:
+                self.customer_ids[customer.email] = customer.pk
+        inserted = [customer for customer in customers if customer.email not in stored]
+        updated = [customer for customer in customers if customer.email in stored]
+        if inserted:
+            bulk_saved.send(sender=CustomerInformation, objects=inserted, created=True, using=self.using)
+        if updated:
+            bulk_saved.send(
+                sender=CustomerInformation, objects=updated, created=False, using=self.using,
+                previous=[stored[customer.email] for customer in updated],
+            )
+        return len(customers)
+
+
+class PurchaseImporter(Importer):
+    model = ProductsPurchased
+    fields = ('number_of_products_purchased', 'date_of_sale', 'amount_spent')
+    customer_column = 'customer_email'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.product_ids = set()
+        self.product_names = {}
+        for product_id, name in Product.objects.using(self.using).order_by('-id').values_list('id', 'name'):
+            self.product_ids.add(product_id)
+            # Names are not unique; the oldest product with a name wins
+            self.product_names[name] = product_id
+
+    def resolve(self, row):
+        values = super().resolve(row)
+        product = str(row.get('product') or '').strip()
+        if product.isdigit() and int(product) in self.product_ids:
+            values['product_id'] = int(product)
+        elif product in self.product_names:
+            values['product_id'] = self.product_names[product]
+        else:
+            raise ValidationError(f"Unknown product {product!r}.")
+        return values
+
+
+class EngagementImporter(Importer):
+    model = Engagement
+    fields = ('level_of_engagement', 'type_of_engagement', 'engagement_date')
+    customer_column = 'customer_email'
+
+
+IMPORTERS = {
+    'customers': CustomerImporter,
+    'purchases': PurchaseImporter,
+    'engagements': EngagementImporter,
+}
@@ -0,0 +1,237 @@
+"""
+Buffered ingestion of engagement events (``api/v1/ingest/engagements/``).
+
+Storefront traffic produces website visits far faster than one form post
+and one INSERT per event can store them. The ingest endpoint only checks
+that each event is well formed (no queries) and appends it to an in-process
+``EngagementBuffer``; a background thread writes the buffer out with
+``bulk_create`` once ``CRM_INGEST_BATCH_SIZE`` events are waiting or
+``CRM_INGEST_FLUSH_SECONDS`` have passed, whichever comes first.
+
+The buffer holds at most ``CRM_INGEST_BUFFER_SIZE`` events, counting the
+batch being written. A request whose events do not fit is refused as a
+whole with 429 and ``Retry-After``, so a slow database pushes back on
+clients instead of growing the worker's memory. On interpreter exit (e.g. a
+graceful worker restart) the buffer stops accepting events and writes out
+what it still holds.
+
+A batch that fails to write goes back to the head of the buffer and is
+retried with exponential backoff; only after ``WRITE_ATTEMPTS`` failures in
+a row is it dropped and counted as ``failed``.
+
+Customers are checked once per batch when it is written; events for
+customers that do not exist are dropped and counted. Each batch sends
+``crm.signals.bulk_saved``, so caches and counters follow as for the batch
+API.
+
+Events are acknowledged (202) before they are stored, and a worker that is
+killed outright loses what it still buffers. Use the batch API for records
+that must not be lost.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import CustomerInformation, Engagement
+from .signals import bulk_saved
+
+logger = logging.getLogger('crm.ingest')
+
+LEVELS = {level for level, _ in Engagement._meta.get_field('level_of_engagement').choices}
+TYPES = {engagement_type for engagement_type, _ in Engagement.ENGAGEMENT_TYPE}
+
+WRITE_ATTEMPTS = 5
+# Seconds before the first retry of a failed batch, doubling per attempt up to MAX_RETRY_BACKOFF
+RETRY_BACKOFF = 0.5
+MAX_RETRY_BACKOFF = 30
+
+
+class BufferFull(Exception):
+    """The buffer cannot take the events without exceeding its size."""
+
+
+def parse_event(data):
+    """
+    Turns one event (``customer``, optional ``type``, ``level`` and ``date``)
+    into Engagement field values. Raises ValueError for malformed events.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Expected an object.")
+    customer = data.get('customer')
+    if isinstance(customer, bool) or not isinstance(customer, (int, str)):
+        raise ValueError("customer must be an id.")
+    try:
+        customer_id = int(customer)
+    except ValueError:
+        raise ValueError("customer must be an id.")
+    engagement_type = data.get('type') or 'Website Visit'
+    if engagement_type not in TYPES:
+        raise ValueError(f"type must be one of {', '.join(sorted(TYPES))}.")
+    level = data.get('level') or 'Low'
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of {', '.join(sorted(LEVELS))}.")
+    date = data.get('date')
+    if date:
+        try:
+            date = parse_datetime(date) if isinstance(date, str) else None
+        except ValueError:
+            date = None
+        if date is None:
+            raise ValueError("date must be an ISO 8601 timestamp.")
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date)
+    return {
+        'customer_id': customer_id,
+        'type_of_engagement': engagement_type,
+        'level_of_engagement': level,
+        'engagement_date': date or timezone.now(),
+    }
+
+
+class EngagementBuffer:
+    """
+    A bounded queue of engagement events written out in batches. The flush
+    thread starts with the first accepted event; ``flush`` can also be
+    called directly to write everything out in the calling thread.
+    """
+
+    def __init__(self, max_size, batch_size, flush_interval, write_attempts=WRITE_ATTEMPTS, retry_backoff=RETRY_BACKOFF):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.write_attempts = write_attempts
+        self.retry_backoff = retry_backoff
+        self._events = deque()
+        # Events taken out for the batch being written, which may yet be put back
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.stats = {'accepted': 0, 'rejected': 0, 'written': 0, 'dropped': 0, 'failed': 0}
+
+    def __len__(self):
+        return len(self._events)
+
+    def offer(self, events):
+        """Queues all of ``events`` or, if they do not fit, none of them (raises BufferFull)."""
+        with self._condition:
+            if self._closed or len(self._events) + self._in_flight + len(events) > self.max_size:
+                self.stats['rejected'] += len(events)
+                raise BufferFull()
+            self._events.extend(events)
+            self.stats['accepted'] += len(events)
+            if self._thread is None:
+                self._start()
+            if len(self._events) >= self.batch_size:
+                self._condition.notify()
+
+    def flush(self):
+        """Writes out every queued event in batches, retrying failed ones; returns how many were stored."""
+        written = 0
+        attempts = 0
+        while True:
+            with self._condition:
+                batch = [self._events.popleft() for _ in range(min(self.batch_size, len(self._events)))]
+                self._in_flight = len(batch)
+            if not batch:
+                return written
+            stored = self._write(batch)
+            if stored is not None:
+                written += stored
+                attempts = 0
+                continue
+            attempts += 1
+            if attempts >= self.write_attempts:
+                logger.error("Dropping %d buffered engagement events after %d failed writes", len(batch), attempts)
+                self.stats['failed'] += len(batch)
+                attempts = 0
+                continue
+            with self._condition:
+                self._events.extendleft(reversed(batch))
+                self._in_flight = 0
+            time.sleep(min(self.retry_backoff * 2 ** (attempts - 1), MAX_RETRY_BACKOFF))
+
+    def close(self, timeout=30):
+        """Stops accepting events and waits for the queued ones to be written."""
+        with self._condition:
+            self._closed = True
+            thread = self._thread
+            self._condition.notify()
+        if thread is not None:
+            thread.join(timeout)
+        else:
+            self.flush()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='crm-engagement-ingest', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        try:
+            while True:
+                deadline = time.monotonic() + self.flush_interval
+                with self._condition:
+                    while not self._closed and len(self._events) < self.batch_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    closed = self._closed
+                self.flush()
+                if closed:
+                    return
+        finally:
+            close_old_connections()
+
+    def _write(self, batch):
+        """Stores one batch; events for unknown customers are dropped. Returns None if the write failed."""
+        customer_ids = {event['customer_id'] for event in batch}
+        try:
+            with transaction.atomic():
+                known = set(CustomerInformation.objects.filter(pk__in=customer_ids).values_list('pk', flat=True))
+                objects = [Engagement(**event) for event in batch if event['customer_id'] in known]
+                if objects:
+                    Engagement.objects.bulk_create(objects)
+                    bulk_saved.send(sender=Engagement, objects=objects, created=True, using='default')
+        except Exception:
+            # Logged rather than raised, so the flush thread keeps running
+            logger.exception("Could not write %d buffered engagement events", len(batch))
+            return None
+        finally:
+            if threading.current_thread() is self._thread:
+                # The flush thread is not covered by the request handlers that recycle connections
+                close_old_connections()
+        self.stats['written'] += len(objects)
+        self.stats['dropped'] += len(batch) - len(objects)
+        return len(objects)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """The worker's engagement buffer, created on first use from the CRM_INGEST_* settings."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = EngagementBuffer(
+                settings.CRM_INGEST_BUFFER_SIZE, settings.CRM_INGEST_BATCH_SIZE, settings.CRM_INGEST_FLUSH_SECONDS
+            )
+        return _buffer
+
+
+def replace_buffer(buffer):
+    """Installs ``buffer`` as the worker's buffer (None for a fresh one on next use); returns the previous one."""
+    global _buffer
+    with _buffer_lock:
+        previous, _buffer = _buffer, buffer
+        return previous
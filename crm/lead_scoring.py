@@ -0,0 +1,288 @@
+"""
+Batch lead scoring.
+
+Fills ``CustomerLead.likelihood_to_convert`` for open leads from a logistic
+regression trained on the leads already Won or Lost. Features come from a
+handful of grouped queries over the whole table:
+
+- engagement count, days since the last engagement and average level of
+  the linked customer;
+- purchase count and revenue of the linked customer;
+- whether the lead has a customer and a company;
+- the stage the lead is in (the stage it closed from, for training) and
+  how long it has been there, from ``LeadStageTransition``.
+
+Per-customer aggregates are joined onto the leads with ``searchsorted``
+rather than per-lead lookups, the model is fitted with a few Newton steps
+in NumPy, and only scores that changed are written back, grouped by score
+(see ``write_scores``).
+
+The trained model is kept on the job's ``JobCheckpoint``. Incremental runs
+reuse it and only rescore leads whose own row, or whose customer's
+engagements or purchases, were saved since the last run started, by
+``updated_at`` reaching ``WATERMARK_OVERLAP`` further back for transactions
+that commit late. Deleted engagements and purchases leave nothing to find
+and stage age keeps growing in between, so an incremental run turns into a
+full run, which also retrains, once the last full run is
+``FULL_RUN_INTERVAL`` old.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Avg, BooleanField, Count, ExpressionWrapper, F, Max, Q, Sum, Window
+from django.db.models.functions import Lag, RowNumber
+from django.utils import timezone
+
+from . import dashboard, versions
+from .models import CustomerLead, Engagement, JobCheckpoint, LeadStageTransition, ProductsPurchased
+
+CHECKPOINT_NAME = 'lead_scoring'
+CLOSED_STAGES = ('Won', 'Lost')
+
+FEATURES = [
+    'engagements', 'days_since_engagement', 'engagement_level', 'purchases', 'revenue',
+    'has_customer', 'has_company', 'days_in_stage', 'qualified', 'negotiation',
+]
+# Customers never engaged count as this many days since their last engagement
+RECENCY_CAP_DAYS = 365
+# How long after being stamped a row may still commit and be seen by the next incremental run
+WATERMARK_OVERLAP = timedelta(minutes=10)
+FULL_RUN_INTERVAL = timedelta(days=1)
+
+
+def score_leads(incremental=False, batch_size=2000, full_run_interval=FULL_RUN_INTERVAL):
+    """
+    Scores open leads and stores the changed scores. Returns the number of
+    leads scored, the number updated and the number of closed leads the
+    model was trained on (0 when an incremental run reused the stored model).
+    An incremental run without a stored model, or whose last full run is
+    older than ``full_run_interval``, runs in full.
+    """
+    started = timezone.now()
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=CHECKPOINT_NAME)
+
+    model = checkpoint.state.get('model') if incremental else None
+    full_run_at = checkpoint.state.get('full_run_at')
+    if full_run_at is None or datetime.fromisoformat(full_run_at) <= started - full_run_interval:
+        model = None
+    trained_on = 0
+    if model is None:
+        _, stages, features, _ = build_features(CustomerLead.objects.filter(lead_stage__in=CLOSED_STAGES), started)
+        won = stages == 'Won'
+        if won.all() or not won.any():
+            raise ValueError("Training needs both Won and Lost leads.")
+        model = train_model(features, won.astype(float))
+        trained_on = len(won)
+
+    leads = CustomerLead.objects.exclude(lead_stage__in=CLOSED_STAGES)
+    if not trained_on and checkpoint.last_run_at is not None:
+        since = checkpoint.last_run_at - WATERMARK_OVERLAP
+        leads = leads.filter(
+            Q(updated_at__gte=since)
+            | Q(customer__in=Engagement.objects.filter(updated_at__gte=since).values('customer_id'))
+            | Q(customer__in=ProductsPurchased.objects.filter(updated_at__gte=since).values('customer_id'))
+        )
+    lead_ids, _, features, current = build_features(leads, started)
+    scores = np.round(predict(model, features) * 100, 2)
+    changed = scores != current
+
+    with transaction.atomic():
+        updated = write_scores(lead_ids[changed], scores[changed], batch_size)
+        checkpoint.last_run_at = started
+        checkpoint.state = {**checkpoint.state, 'model': model}
+        if trained_on:
+            checkpoint.state['full_run_at'] = started.isoformat()
+        checkpoint.save()
+        if updated:
+            transaction.on_commit(_invalidate)
+    return {'scored': len(lead_ids), 'updated': updated, 'trained_on': trained_on}
+
+
+def write_scores(lead_ids, scores, batch_size=2000):
+    """
+    Stores ``scores`` (percentages, two decimals) for ``lead_ids``. Scores
+    take at most 10,001 values, so leads are updated per distinct score with
+    ``UPDATE ... WHERE id IN (...)``, which costs far less per row than
+    ``bulk_update``'s CASE expressions. ``updated_at`` is left alone, so
+    scoring does not count as an edit for the next incremental run.
+    """
+    # Each id is a query parameter; SQLite caps them per statement
+    batch_size = min(batch_size, connection.features.max_query_params or batch_size)
+    order = np.argsort(scores, kind='stable')
+    lead_ids, scores = lead_ids[order], scores[order]
+    values, starts = np.unique(scores, return_index=True)
+    bounds = [*starts, len(scores)]
+    for value, start, end in zip(values, bounds, bounds[1:]):
+        score = Decimal(f'{value:.2f}')
+        for low in range(start, end, batch_size):
+            ids = lead_ids[low:min(low + batch_size, end)].tolist()
+            CustomerLead.objects.filter(pk__in=ids).update(likelihood_to_convert=score)
+    return len(lead_ids)
+
+
+def _invalidate():
+    versions.bump(CustomerLead)
+    dashboard.invalidate('leads')
+
+
+# --- Features ---
+def build_features(leads, now):
+    """
+    Returns ``(lead_ids, stages, features, current_scores)`` for the
+    ``leads`` queryset, as arrays in lead id order.
+    """
+    rows = leads.annotate(
+        has_company=ExpressionWrapper(Q(company__gt='') | Q(customer__company__gt=''), output_field=BooleanField()),
+    ).order_by('id').values_list('id', 'customer_id', 'lead_stage', 'created_at', 'has_company', 'likelihood_to_convert')
+    lead_ids, customer_ids, stages, created, has_company, current = _columns(rows, 6)
+    count = len(lead_ids)
+    lead_ids = np.array(lead_ids, dtype=np.int64)
+    customer_ids = np.array([customer_id or 0 for customer_id in customer_ids], dtype=np.int64)
+    stages = np.array(stages, dtype=object)
+    now_ts = now.timestamp()
+    created = np.array([value.timestamp() if value else now_ts for value in created], dtype=float)
+    current = np.array([float(value) if value is not None else np.nan for value in current], dtype=float)
+
+    customers = leads.values('customer_id')
+    engagements = _columns(
+        Engagement.objects.filter(customer__in=customers).values('customer_id').annotate(
+            count=Count('id'), last=Max('engagement_date'), level=Avg(Engagement.level_score()),
+        ).order_by('customer_id').values_list('customer_id', 'count', 'last', 'level'),
+        4,
+    )
+    purchases = _columns(
+        ProductsPurchased.objects.filter(customer__in=customers).values('customer_id').annotate(
+            count=Count('id'), revenue=Sum('amount_spent'),
+        ).order_by('customer_id').values_list('customer_id', 'count', 'revenue'),
+        3,
+    )
+    engagement_ids = np.array(engagements[0], dtype=np.int64)
+    last_engaged = np.array([value.timestamp() for value in engagements[2]], dtype=float)
+    purchase_ids = np.array(purchases[0], dtype=np.int64)
+
+    # Each lead's latest transition, and when it entered the stage before that
+    transitions = _columns(
+        LeadStageTransition.objects.filter(lead__in=leads).annotate(
+            entered_previous=Window(Lag('changed_at'), partition_by=[F('lead_id')], order_by=[F('changed_at'), F('id')]),
+            latest=Window(RowNumber(), partition_by=[F('lead_id')], order_by=[F('changed_at').desc(), F('id').desc()]),
+        ).filter(latest=1).order_by('lead_id').values_list('lead_id', 'from_stage', 'changed_at', 'entered_previous'),
+        4,
+    )
+    transition_ids = np.array(transitions[0], dtype=np.int64)
+    changed_at = np.array([value.timestamp() for value in transitions[2]], dtype=float)
+    entered_previous = np.array([value.timestamp() if value else np.nan for value in transitions[3]], dtype=float)
+    from_stages = np.array(transitions[1], dtype=object)
+
+    closed = np.isin(stages, CLOSED_STAGES)
+    has_transition, last_changed = _lookup(lead_ids, transition_ids, changed_at, np.nan)
+    _, previous_entered = _lookup(lead_ids, transition_ids, entered_previous, np.nan)
+    _, closed_from = _lookup(lead_ids, transition_ids, from_stages, '')
+    # Open leads have been in their stage since the latest transition; closed ones spent the time before it
+    stage_entered = np.where(has_transition, last_changed, created)
+    stage_left = np.full(count, now_ts)
+    closed_with_history = closed & has_transition
+    stage_left[closed_with_history] = last_changed[closed_with_history]
+    stage_entered[closed_with_history] = np.where(
+        np.isnan(previous_entered), created, previous_entered
+    )[closed_with_history]
+    stage = np.where(closed, closed_from, stages)
+
+    _, engagement_count = _lookup(customer_ids, engagement_ids, np.array(engagements[1], dtype=float), 0.0)
+    _, last_engagement = _lookup(customer_ids, engagement_ids, last_engaged, np.nan)
+    _, engagement_level = _lookup(
+        customer_ids, engagement_ids, np.array([value or 0.0 for value in engagements[3]], dtype=float), 0.0
+    )
+    _, purchase_count = _lookup(customer_ids, purchase_ids, np.array(purchases[1], dtype=float), 0.0)
+    _, revenue = _lookup(customer_ids, purchase_ids, np.array([float(value) for value in purchases[2]], dtype=float), 0.0)
+    days_since = np.where(np.isnan(last_engagement), RECENCY_CAP_DAYS, (now_ts - last_engagement) / 86400)
+
+    columns = {
+        'engagements': np.log1p(engagement_count),
+        'days_since_engagement': np.log1p(np.clip(days_since, 0, RECENCY_CAP_DAYS)),
+        'engagement_level': engagement_level,
+        'purchases': np.log1p(purchase_count),
+        'revenue': np.log1p(np.maximum(revenue, 0)),
+        'has_customer': (customer_ids > 0).astype(float),
+        # NULL companies compare as NULL rather than False
+        'has_company': np.array([bool(value) for value in has_company], dtype=float),
+        'days_in_stage': np.log1p(np.maximum(stage_left - stage_entered, 0) / 86400),
+        'qualified': (stage == 'Qualified').astype(float),
+        'negotiation': (stage == 'Negotiation').astype(float),
+    }
+    features = np.column_stack([columns[name] for name in FEATURES]) if count else np.empty((0, len(FEATURES)))
+    return lead_ids, stages, features, current
+
+
+def _columns(rows, width):
+    """Transposes query rows into ``width`` lists."""
+    columns = tuple(zip(*rows.iterator(chunk_size=10000)))
+    return columns or ((),) * width
+
+
+def _lookup(keys, table_keys, values, default):
+    """
+    Joins ``values`` (aligned with the sorted ``table_keys``) onto ``keys``.
+    Returns a found mask and the joined values, ``default`` where missing.
+    """
+    if not len(table_keys):
+        return np.zeros(len(keys), dtype=bool), np.full(len(keys), default, dtype=values.dtype)
+    index = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+    found = table_keys[index] == keys
+    joined = values[index].copy()
+    joined[~found] = default
+    return found, joined
+
+
+# --- Model ---
+def train_model(features, outcomes, l2=1.0, iterations=25):
+    """
+    Fits an L2-regularised logistic regression with Newton's method on
+    standardised features. Returns the model as a JSON-serialisable dict.
+    """
+    mean = features.mean(axis=0)
+    scale = features.std(axis=0)
+    # Features (near) constant in training carry no signal; standardising them would only amplify noise
+    scale[scale < 1e-3] = 1.0
+    design = np.hstack([np.ones((len(features), 1)), (features - mean) / scale])
+    penalty = l2 * np.eye(design.shape[1])
+    penalty[0, 0] = 0.0  # the intercept is not regularised
+    weights = np.zeros(design.shape[1])
+    for _ in range(iterations):
+        probabilities = _sigmoid(design @ weights)
+        gradient = design.T @ (probabilities - outcomes) + penalty @ weights
+        hessian = (design.T * (probabilities * (1 - probabilities))) @ design + penalty
+        step = np.linalg.solve(hessian, gradient)
+        weights -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return {
+        'features': FEATURES,
+        'mean': mean.tolist(),
+        'scale': scale.tolist(),
+        'weights': weights.tolist(),
+        'base_rate': float(outcomes.mean()),
+        'trained_at': timezone.now().isoformat(),
+    }
+
+
+def predict(model, features):
+    """Probability of each row converting under ``model``."""
+    if model['features'] != FEATURES:
+        raise ValueError("The stored model was trained on different features; run a full scoring first.")
+    if not len(features):
+        return np.empty(0)
+    standardised = (features - np.array(model['mean'])) / np.array(model['scale'])
+    weights = np.array(model['weights'])
+    return _sigmoid(weights[0] + standardised @ weights[1:])
+
+
+def _sigmoid(values):
+    return 1.0 / (1.0 + np.exp(-np.clip(values, -35, 35)))
+
+
+def model_summary(model):
+    """The model's weights per feature, largest effect first, for reporting."""
+    weights = dict(zip(model['features'], model['weights'][1:]))
+    return sorted(weights.items(), key=lambda item: -abs(item[1]))
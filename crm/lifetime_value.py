@@ -0,0 +1,123 @@
+"""
+Bulk lifetime value recomputation.
+
+Applies the same formula as ``LifetimeValue.calculate_lifetime_value``
+(average purchase value x number of purchases x average customer length) to
+every customer. Purchases are aggregated with one GROUP BY per shard of
+customer ids, shards can be spread over a process pool, and results are
+written back with ``bulk_update`` / ``bulk_create``.
+
+Incremental runs only revisit customers with ``ProductsPurchased`` rows
+saved since the previous run started, by ``updated_at``. The window reaches
+``WATERMARK_OVERLAP`` further back, since a purchase is stamped when it is
+saved but only becomes visible when its transaction commits; customers in
+the overlap are simply recomputed again. Deleted purchases leave nothing to
+find and are picked up by the next full run.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.db.models import Avg, Count, Max
+from django.utils import timezone
+
+from . import detail_cache
+from .metrics import reconcile
+from .models import CustomerInformation, ProductsPurchased, LifetimeValue, InternalServices, JobCheckpoint, MetricCounter
+
+CHECKPOINT_NAME = 'lifetime_value'
+LIFETIME_VALUE_COUNTERS = (MetricCounter.LIFETIME_VALUE_TOTAL, MetricCounter.LIFETIME_VALUE_COUNT)
+CENTS = Decimal('0.01')
+# How long after being stamped a purchase may still commit and be seen by the next run
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+
+def recompute_lifetime_values(incremental=False, workers=1, shard_size=50000, batch_size=2000):
+    """Recomputes stored lifetime values. Returns the number of customers updated."""
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=CHECKPOINT_NAME)
+    started = timezone.now()
+
+    if incremental:
+        purchases = ProductsPurchased.objects.all()
+        if checkpoint.last_run_at is not None:
+            purchases = purchases.filter(updated_at__gte=checkpoint.last_run_at - WATERMARK_OVERLAP)
+        customer_ids = sorted(set(purchases.values_list('customer_id', flat=True)))
+        shards = [
+            (customer_ids[start], customer_ids[min(start + shard_size, len(customer_ids)) - 1] + 1,
+             customer_ids[start:start + shard_size])
+            for start in range(0, len(customer_ids), shard_size)
+        ]
+    else:
+        bounds = CustomerInformation.objects.aggregate(last_id=Max('id'))
+        last_customer = bounds['last_id'] or 0
+        shards = [(low, low + shard_size, None) for low in range(0, last_customer + 1, shard_size)]
+
+    settings = _pipeline_settings()
+    jobs = [(low, high, ids, settings, batch_size) for low, high, ids in shards]
+    if workers > 1 and len(jobs) > 1:
+        # Children must open their own connections rather than share ours
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            updated = sum(executor.map(_recompute_shard, jobs))
+    else:
+        updated = sum(map(_recompute_shard, jobs))
+
+    # bulk_update bypasses the signals that keep the lifetime value counters current
+    reconcile(LIFETIME_VALUE_COUNTERS, persist=False)
+
+    checkpoint.last_run_at = started
+    checkpoint.save()
+    return updated
+
+
+def _pipeline_settings():
+    customer_length = Decimal(InternalServices.get_average_customer_length())
+    default_cost = InternalServices.objects.exclude(average_cost_to_acquire=None).values_list(
+        'average_cost_to_acquire', flat=True
+    ).first()
+    return {'customer_length': customer_length, 'default_cost': default_cost}
+
+
+def _recompute_shard(job):
+    low, high, customer_ids, settings, batch_size = job
+    customers = CustomerInformation.objects.filter(id__gte=low, id__lt=high)
+    purchases = ProductsPurchased.objects.filter(customer_id__gte=low, customer_id__lt=high)
+    if customer_ids is not None:
+        customers = customers.filter(id__in=customer_ids)
+        purchases = purchases.filter(customer_id__in=customer_ids)
+
+    totals = {
+        row['customer_id']: row
+        for row in purchases.values('customer_id').annotate(avg_value=Avg('amount_spent'), purchases=Count('id')).order_by()
+    }
+    # Views read each customer's first LifetimeValue row, so that is the one kept current
+    existing = {}
+    for lifetime_value in LifetimeValue.objects.filter(customer__in=customers).order_by('-id'):
+        existing[lifetime_value.customer_id] = lifetime_value
+
+    to_update, to_create = [], []
+    for customer_id in customers.values_list('id', flat=True):
+        lifetime_value = existing.get(customer_id)
+        if lifetime_value is None:
+            lifetime_value = LifetimeValue(customer_id=customer_id, cost_to_acquire=settings['default_cost'])
+            to_create.append(lifetime_value)
+        else:
+            to_update.append(lifetime_value)
+
+        total = totals.get(customer_id)
+        value = Decimal(0)
+        if total:
+            value = Decimal(total['avg_value']) * total['purchases'] * settings['customer_length']
+        lifetime_value.lifetime_value = value.quantize(CENTS)
+        lifetime_value.worth_acquisition_cost = (
+            lifetime_value.lifetime_value - lifetime_value.cost_to_acquire
+            if lifetime_value.cost_to_acquire is not None else None
+        )
+
+    with transaction.atomic():
+        LifetimeValue.objects.bulk_update(to_update, ['lifetime_value', 'worth_acquisition_cost'], batch_size=batch_size)
+        LifetimeValue.objects.bulk_create(to_create, batch_size=batch_size)
+        changed = [lifetime_value.customer_id for lifetime_value in to_update + to_create]
+        transaction.on_commit(lambda: detail_cache.invalidate_customers(changed))
+    return len(to_update) + len(to_create)
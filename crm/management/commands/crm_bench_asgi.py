@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.urls import reverse
+
+from crm import seed
+from crm.models import CustomerInformation, User
+
+BENCH_DOMAIN = 'bench-asgi.invalid'
+BENCH_USER = 'crm-bench-asgi'
+
+# Each deployment runs in its own process, with the views it would serve
+DEPLOYMENTS = {
+    'wsgi': {'CRM_ASYNC_VIEWS': 'False'},
+    'asgi': {'CRM_ASYNC_VIEWS': 'True'},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares latency (p50, p99) and throughput of the dashboard, customer detail and autocomplete "
+        "under concurrent load, served through the WSGI handler with the sync views and through the ASGI "
+        "handler with the async views. Requests are passed to the handlers in-process, so the numbers "
+        "exclude the web server itself."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=2000, help='Customers to generate.')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per deployment.')
+        parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight at once.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows afterwards.')
+        # Set on the worker processes started for each deployment
+        parser.add_argument('--serve', choices=list(DEPLOYMENTS), help=argparse.SUPPRESS)
+        parser.add_argument('--session', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self._serve(options)
+
+        if CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).exists():
+            raise CommandError(f"Benchmark customers (@{BENCH_DOMAIN}) already exist; remove them first.")
+        if User.objects.filter(username=BENCH_USER).exists():
+            raise CommandError(f"The benchmark user {BENCH_USER} already exists; remove it first.")
+        customers = options['customers']
+        seed.seed_dataset(
+            customers, products=100, purchases=customers * 5, engagements=customers * 5, leads=customers // 4,
+            seed=options['seed'], domain=BENCH_DOMAIN,
+        )
+        user = User.objects.create_user(username=BENCH_USER)
+        client = Client()
+        client.force_login(user)
+        session = client.cookies[settings.SESSION_COOKIE_NAME].value
+        try:
+            results = {deployment: self._run_deployment(deployment, session, options) for deployment in DEPLOYMENTS}
+        finally:
+            client.logout()
+            user.delete()
+            if not options['keep']:
+                seed.clear(BENCH_DOMAIN)
+
+        self.stdout.write(
+            f"\n{options['requests']} requests per deployment, {options['concurrency']} at a time; latencies in ms"
+        )
+        self.stdout.write(f"{'deployment':<12}{'route':<18}{'req/s':>10}{'p50':>10}{'p99':>10}{'errors':>8}")
+        for deployment, samples in results.items():
+            for route in ['all'] + sorted({route for route, _, _ in samples['requests']}):
+                rows = [row for row in samples['requests'] if route in ('all', row[0])]
+                latencies = sorted(latency for _, latency, _ in rows)
+                errors = sum(1 for _, _, status in rows if status >= 400)
+                throughput = f"{len(rows) / samples['elapsed']:.1f}" if route == 'all' else ''
+                self.stdout.write(
+                    f"{deployment:<12}{route:<18}{throughput:>10}{_percentile(latencies, 50):>10.2f}"
+                    f"{_percentile(latencies, 99):>10.2f}{errors:>8}"
+                )
+
+    def _run_deployment(self, deployment, session, options):
+        command = [
+            sys.executable, '-m', 'django', 'crm_bench_asgi', '--serve', deployment, '--session', session,
+            '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+            '--seed', str(options['seed']),
+        ]
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE, **DEPLOYMENTS[deployment]}
+        self.stdout.write(f"Running the {deployment} deployment...")
+        finished = subprocess.run(command, env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if finished.returncode:
+            raise CommandError(f"The {deployment} run failed:\n{finished.stderr}")
+        return json.loads(finished.stdout.strip().splitlines()[-1])
+
+    # --- Worker process ---
+    def _serve(self, options):
+        rng = random.Random(options['seed'])
+        customers = list(
+            CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).values_list('pk', 'name')
+        )
+        if not customers:
+            raise CommandError("No benchmark customers found.")
+        requests = [self._request(rng, customers) for _ in range(options['requests'])]
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        headers = {'Host': host, 'Cookie': f"{settings.SESSION_COOKIE_NAME}={options['session']}"}
+        run = _run_wsgi if options['serve'] == 'wsgi' else _run_asgi
+
+        # Warm caches, the autocomplete index and connections before measuring
+        run(requests[:options['concurrency'] * 2], headers, options['concurrency'])
+        started = time.perf_counter()
+        measured = run(requests, headers, options['concurrency'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(json.dumps({
+            'elapsed': elapsed,
+            'requests': [[route, latency, status] for (route, _), (latency, status) in zip(requests, measured)],
+        }))
+
+    def _request(self, rng, customers):
+        """A random request from the mix: ``(route, path)``."""
+        pk, name = rng.choice(customers)
+        route = rng.choice(['dashboard', 'dashboard search', 'customer detail', 'autocomplete'])
+        if route == 'dashboard':
+            path = reverse('dashboard')
+        elif route == 'dashboard search':
+            # Searches skip the snapshot, so all four sections are queried
+            term = name.split()[0][:4]
+            path = f"{reverse('dashboard')}?customer_search={term}&lead_search={term}&product_search={term}&engagement_search=Call"
+        elif route == 'customer detail':
+            path = reverse('customer_detail', args=[pk])
+        else:
+            path = f"{reverse('customer_autocomplete')}?term={name[:3]}"
+        return route, path
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def _run_wsgi(requests, headers, concurrency):
+    """Runs the requests through the WSGI handler from a thread pool, like a threaded WSGI server."""
+    application = get_wsgi_application()
+
+    def call(request):
+        path, _, query = request[1].partition('?')
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query}
+        environ.update({f"HTTP_{name.upper()}": value for name, value in headers.items()})
+        setup_testing_defaults(environ)
+        statuses = []
+        started = time.perf_counter()
+        body = application(environ, lambda status, response_headers, exc_info=None: statuses.append(status))
+        try:
+            for _ in body:
+                pass
+        finally:
+            body.close()
+        return (time.perf_counter() - started) * 1000, int(statuses[0].split()[0])
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(call, requests))
+
+
+def _run_asgi(requests, headers, concurrency):
+    """Runs the requests through the ASGI handler on one event loop, like a single ASGI server worker."""
+    application = get_asgi_application()
+    raw_headers = [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+
+    async def call(request):
+        path, _, query = request[1].partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+            'headers': raw_headers, 'client': ('127.0.0.1', 0), 'server': (headers['Host'], 80),
+        }
+        body_sent, finished, statuses = False, asyncio.Event(), []
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # The client stays connected until the response is complete
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                finished.set()
+
+        started = time.perf_counter()
+        await application(scope, receive, send)
+        return (time.perf_counter() - started) * 1000, statuses[0]
+
+    async def run():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def limited(request):
+            async with slots:
+                return await call(request)
+
+        return await asyncio.gather(*[limited(request) for request in requests])
+
+    return asyncio.run(run())
@@ -0,0 +1,155 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models
+
+from crm import seed
+from crm.models import CustomerInformation, Product, ProductsPurchased, Engagement, CustomerLead
+
+BENCH_DOMAIN = 'bench-index.invalid'
+
+# Single-column FK indexes from before the composite indexes replaced them
+LEGACY_INDEXES = {
+    ProductsPurchased: [
+        models.Index(fields=['customer'], name='crm_bench_purchase_customer'),
+        models.Index(fields=['product'], name='crm_bench_purchase_product'),
+    ],
+    Engagement: [models.Index(fields=['customer'], name='crm_bench_engagement_customer')],
+}
+INDEXED_MODELS = (ProductsPurchased, Engagement, CustomerLead)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a large dataset and compares EXPLAIN plans and latencies of the hot CRM queries "
+        "without and with the access-pattern indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=100000)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--purchases-per-customer', type=int, default=10)
+        parser.add_argument('--engagements-per-customer', type=int, default=5)
+        parser.add_argument('--leads', type=int, default=50000)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query in each phase.')
+        parser.add_argument('--phase', choices=['before', 'after', 'both'], default='both')
+        parser.add_argument('--analyze', action='store_true', help='Use EXPLAIN ANALYZE on Postgres.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=1, help='Processes generating the data (Postgres only).')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows afterwards.')
+
+    def handle(self, *args, **options):
+        if CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).exists():
+            raise CommandError(f"Benchmark customers (@{BENCH_DOMAIN}) already exist; remove them first.")
+        rng = random.Random(options['seed'])
+        phases = ['before', 'after'] if options['phase'] == 'both' else [options['phase']]
+
+        started = time.perf_counter()
+        samples = self._generate(options)
+        self.stdout.write(f"Generated benchmark data in {time.perf_counter() - started:.1f}s")
+        results = {}
+        try:
+            for phase in phases:
+                self._set_indexes(enabled=phase == 'after')
+                self._analyze()
+                results[phase] = self._run_queries(phase, samples, rng, options)
+        finally:
+            # Always leave the schema as the migrations define it
+            self._set_indexes(enabled=True)
+            if not options['keep']:
+                self._cleanup()
+
+        self.stdout.write(f"\n{'query':<24}" + ''.join(f"{phase + ' p50 ms':>16}{phase + ' p95 ms':>16}" for phase in phases))
+        for name in results[phases[0]]:
+            line = f"{name:<24}"
+            for phase in phases:
+                p50, p95 = results[phase][name]
+                line += f"{p50:>16.2f}{p95:>16.2f}"
+            self.stdout.write(line)
+
+    def queries(self, samples, rng):
+        """The hot queries from the views and models, with a random customer or product each run."""
+        customer_id = rng.choice(samples['customers'])
+        product_id = rng.choice(samples['products'])
+        return {
+            'customer revenue': ProductsPurchased.objects.filter(customer_id=customer_id).values('customer_id').annotate(
+                total=models.Sum('amount_spent')
+            ),
+            'product last sale': ProductsPurchased.objects.filter(product_id=product_id).order_by(
+                '-date_of_sale'
+            ).values('date_of_sale')[:1],
+            'purchase list page': ProductsPurchased.objects.order_by('-date_of_sale', '-pk')[:11],
+            'customer engagements': Engagement.objects.filter(customer_id=customer_id).order_by('-engagement_date')[:10],
+            'engagement list page': Engagement.objects.order_by('-engagement_date', '-pk')[:11],
+            'leads by stage': CustomerLead.objects.filter(lead_stage='Negotiation', status='Open').order_by('pk')[:10],
+            'lost customers': CustomerLead.objects.filter(lead_stage='Lost', customer__isnull=False).values('lead_stage').annotate(
+                total=models.Count('id')
+            ),
+            'unassigned leads': CustomerLead.objects.filter(customer__isnull=True).order_by('-created_at')[:10],
+        }
+
+    def _run_queries(self, phase, samples, rng, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== {phase} ==="))
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        timings = {}
+        for name, queryset in self.queries(samples, rng).items():
+            self.stdout.write(self.style.MIGRATE_LABEL(name))
+            self.stdout.write(queryset.explain(**explain_options))
+            timings[name] = []
+        for _ in range(options['repeat']):
+            for name, queryset in self.queries(samples, rng).items():
+                query_started = time.perf_counter()
+                list(queryset)
+                timings[name].append((time.perf_counter() - query_started) * 1000)
+        return {
+            name: (statistics.median(values), statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0])
+            for name, values in timings.items()
+        }
+
+    def _set_indexes(self, enabled):
+        """Switches between the access-pattern indexes (after) and plain FK indexes (before)."""
+        existing = self._existing_indexes()
+        with connection.schema_editor() as editor:
+            for model in INDEXED_MODELS:
+                add, remove = (model._meta.indexes, LEGACY_INDEXES.get(model, [])) if enabled else \
+                    (LEGACY_INDEXES.get(model, []), model._meta.indexes)
+                for index in remove:
+                    if index.name in existing:
+                        editor.remove_index(model, index)
+                for index in add:
+                    if index.name not in existing:
+                        editor.add_index(model, index)
+
+    def _existing_indexes(self):
+        with connection.cursor() as cursor:
+            names = set()
+            for model in INDEXED_MODELS:
+                names.update(connection.introspection.get_constraints(cursor, model._meta.db_table))
+        return names
+
+    def _analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def _generate(self, options):
+        # The same generator as crm_seed, so every benchmark runs against the same shape of data
+        customers = options['customers']
+        seed.seed_dataset(
+            customers, products=options['products'], purchases=customers * options['purchases_per_customer'],
+            engagements=customers * options['engagements_per_customer'], leads=options['leads'],
+            seed=options['seed'], workers=options['workers'], batch_size=options['batch_size'], domain=BENCH_DOMAIN,
+        )
+        return {
+            'customers': list(
+                CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).values_list('id', flat=True)
+            ),
+            'products': list(
+                Product.objects.filter(name__startswith=seed.product_prefix(BENCH_DOMAIN)).values_list('id', flat=True)
+            ),
+        }
+
+    def _cleanup(self):
+        seed.clear(BENCH_DOMAIN)
@@ -0,0 +1,99 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import QuerySet
+
+from crm.models import CustomerInformation
+from crm.search import search_customers
+
+BENCH_DOMAIN = 'bench.invalid'
+FIRST_NAMES = ['Ava', 'Liam', 'Mia', 'Noah', 'Zoe', 'Ethan', 'Ivy', 'Lucas', 'Nora', 'Owen']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Patel', 'Okafor', 'Novak', 'Rossi', 'Kim', 'Silva', 'Berg']
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks first-page customer search latency as the customer table grows, for terms matching "
+        "from one customer to nearly all of them. The tiered column is what the views run; the ranked column "
+        "sorts every match before slicing, for comparison. Flat tiered latency across match counts is the goal."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Comma separated table sizes to measure at.')
+        parser.add_argument('--repeat', type=int, default=50, help='Searches per term at each size.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated customers afterwards.')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        rng = random.Random(options['seed'])
+        if CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).exists():
+            raise CommandError(f"Benchmark customers (@{BENCH_DOMAIN}) already exist; remove them first.")
+
+        self.stdout.write(
+            f"{'rows':>10} {'term':>14} {'matches':>9} {'tiered p50':>11} {'tiered p95':>11} {'ranked p50':>11}"
+        )
+        created = 0
+        try:
+            for size in sizes:
+                created = self._grow(created, size, rng, options['batch_size'])
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE crm_customerinformation')
+                for term in self._terms():
+                    matches = search_customers(term).count()
+                    tiered = self._measure(lambda: search_customers(term)[:10], options['repeat'])
+                    ranked = self._measure(
+                        lambda: QuerySet.__getitem__(search_customers(term), slice(0, 10)), options['repeat']
+                    )
+                    self.stdout.write(
+                        f"{size:>10} {term:>14} {matches:>9} {statistics.median(tiered):>11.2f} "
+                        f"{_p95(tiered):>11.2f} {statistics.median(ranked):>11.2f}"
+                    )
+        finally:
+            if not options['keep']:
+                CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).delete()
+
+    def _grow(self, start, target, rng, batch_size):
+        for offset in range(start, target, batch_size):
+            batch = []
+            for i in range(offset, min(offset + batch_size, target)):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                phone = f"555-{rng.randrange(100):02d}-{rng.randrange(10000):04d}"
+                batch.append(CustomerInformation(
+                    name=f"{first} {last} {i}",
+                    email=f"{first}.{last}.{i}@{BENCH_DOMAIN}".lower(),
+                    phone=phone,
+                    phone_digits=phone.replace('-', ''),
+                ))
+            CustomerInformation.objects.bulk_create(batch)
+        return target
+
+    def _terms(self):
+        """Terms from about one match up to nearly every row, smallest bucket first."""
+        newest = CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).latest('pk').name
+        return [
+            newest,  # one customer
+            newest.rsplit(' ', 1)[0] + ' 1',  # about 0.1%
+            'Ava Chen',  # about 1%
+            'Chen',  # about 10%
+            'a',  # nearly all, mostly substring matches
+            'nomatchxyz',
+        ]
+
+    def _measure(self, search, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(search())
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+
+def _p95(timings):
+    return statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
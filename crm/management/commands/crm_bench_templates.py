@@ -0,0 +1,75 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+
+from crm import seed, versions
+from crm.models import CustomerInformation, User
+from crm.views import CustomerListView, ProductListView
+
+BENCH_DOMAIN = 'bench-templates.invalid'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures page render time for the customer and product lists without fragment caching, "
+        "with a cold fragment cache (fresh versions) and with a warm one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100, help='Rows per page, and customers/products to generate.')
+        parser.add_argument('--repeat', type=int, default=20, help='Renders per page in each mode.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows afterwards.')
+
+    def handle(self, *args, **options):
+        if CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).exists():
+            raise CommandError(f"Benchmark customers (@{BENCH_DOMAIN}) already exist; remove them first.")
+        rows = options['rows']
+        seed.seed_dataset(
+            rows, products=rows, purchases=rows * 5, engagements=rows, leads=rows // 4,
+            seed=options['seed'], domain=BENCH_DOMAIN,
+        )
+        pages = {
+            'customer list': CustomerListView.as_view(paginate_by=rows),
+            'product list': ProductListView.as_view(paginate_by=rows),
+        }
+        try:
+            results = {name: self._measure(view, options['repeat']) for name, view in pages.items()}
+        finally:
+            if not options['keep']:
+                seed.clear(BENCH_DOMAIN)
+
+        self.stdout.write(f"\nMedian render time of a {rows}-row page, in ms")
+        self.stdout.write(f"{'page':<16}{'uncached':>12}{'cold':>12}{'warm':>12}{'saved':>10}")
+        for name, timings in results.items():
+            saved = 1 - timings['warm'] / timings['uncached'] if timings['uncached'] else 0
+            self.stdout.write(
+                f"{name:<16}{timings['uncached']:>12.2f}{timings['cold']:>12.2f}{timings['warm']:>12.2f}{saved:>10.0%}"
+            )
+
+    def _measure(self, view, repeat):
+        def render(before=None):
+            request = RequestFactory().get('/')
+            # The pages only render for signed-in users; an unsaved user is enough
+            request.user = User(username='bench')
+            response = view(request)
+            if before:
+                before()
+            # Querysets are lazy, so rendering includes the queries the page needs
+            started = time.perf_counter()
+            response.render()
+            return (time.perf_counter() - started) * 1000
+
+        with override_settings(CRM_FRAGMENT_CACHE_TIMEOUT=0):
+            uncached = [render() for _ in range(repeat)]
+        # New versions make every fragment miss, as after a write
+        cold = [render(before=versions.bump) for _ in range(repeat)]
+        render()
+        warm = [render() for _ in range(repeat)]
+        return {
+            'uncached': statistics.median(uncached),
+            'cold': statistics.median(cold),
+            'warm': statistics.median(warm),
+        }
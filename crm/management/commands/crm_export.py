@@ -0,0 +1,48 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.exports import CHUNK_SIZE, DATASETS, FORMATS, parse_filters, stream_export
+
+
+class Command(BaseCommand):
+    help = "Streams a customers, purchases or engagements export to a file or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--since', help="First date to include (YYYY-MM-DD).")
+        parser.add_argument('--until', help="Last date to include (YYYY-MM-DD).")
+        parser.add_argument('--after-id', help="Only rows with a higher id, to resume a previous export.")
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--output', '-o', default='-', help="Output file; '-' writes to stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_filters(options['since'], options['until'], options['after_id'])
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        started = time.perf_counter()
+        chunks = stream_export(
+            options['dataset'], options['format'], options['gzip'], chunk_size=options['chunk_size'], **filters
+        )
+        written = 0
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+            else:
+                output.flush()
+
+        if options['output'] != '-':
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"Exported {options['dataset']} to {options['output']} ({written:,} bytes) in {elapsed:.1f}s"
+            ))
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.importer import FORMATS, IMPORTERS, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = "Streams customers, purchases or engagements from a CSV or JSONL file into the CRM."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--no-copy', action='store_true', help="Use bulk_create even where COPY is available.")
+
+    def handle(self, *args, **options):
+        try:
+            file_format = options['format'] or detect_format(options['path'])
+        except ValueError as exc:
+            raise CommandError(exc)
+        importer = IMPORTERS[options['kind']](
+            batch_size=options['batch_size'], use_copy=False if options['no_copy'] else None
+        )
+
+        started = time.perf_counter()
+        total_rows = total_written = total_errors = 0
+        try:
+            for result in importer.run(read_rows(options['path'], file_format)):
+                total_rows += result.rows
+                total_written += result.written
+                total_errors += len(result.errors)
+                rate = result.rows / result.seconds if result.seconds else 0
+                self.stdout.write(
+                    f"Batch {result.number}: {result.written}/{result.rows} rows written, "
+                    f"{len(result.errors)} errors, {rate:,.0f} rows/s"
+                )
+                for line_number, message in result.errors:
+                    location = f"line {line_number}" if line_number else "batch"
+                    self.stderr.write(f"  {location}: {message}")
+        except OSError as exc:
+            raise CommandError(exc)
+
+        elapsed = time.perf_counter() - started
+        style = self.style.SUCCESS if not total_errors else self.style.WARNING
+        self.stdout.write(style(
+            f"Imported {total_written} of {total_rows} {options['kind']} rows in {elapsed:.1f}s "
+            f"({total_rows / elapsed if elapsed else 0:,.0f} rows/s), {total_errors} errors"
+        ))
@@ -0,0 +1,169 @@
+import io
+import json
+import logging
+import random
+import secrets
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import close_old_connections
+from django.test import override_settings
+from django.urls import reverse
+
+from crm import ingest, seed
+from crm.models import CustomerInformation, Engagement
+
+BENCH_DOMAIN = 'loadtest-ingest.invalid'
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests the engagement ingest endpoint: posts website visits through the WSGI handler from "
+        "several threads, drains the buffer and reports accepted and stored events per second, 429 "
+        "responses and request latency. --baseline writes the given number of events one INSERT at a time "
+        "for comparison."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000, help='Customers to generate.')
+        parser.add_argument('--events', type=int, default=200000, help='Events to post.')
+        parser.add_argument('--events-per-request', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once.')
+        parser.add_argument('--buffer-size', type=int, default=settings.CRM_INGEST_BUFFER_SIZE)
+        parser.add_argument('--batch-size', type=int, default=settings.CRM_INGEST_BATCH_SIZE)
+        parser.add_argument('--flush-seconds', type=float, default=settings.CRM_INGEST_FLUSH_SECONDS)
+        parser.add_argument('--baseline', type=int, default=2000, help='Events to write one row at a time (0 skips).')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows afterwards.')
+
+    def handle(self, *args, **options):
+        if CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).exists():
+            raise CommandError(f"Load test customers (@{BENCH_DOMAIN}) already exist; remove them first.")
+        seed.seed_dataset(
+            options['customers'], products=1, purchases=0, engagements=0, leads=0, seed=options['seed'],
+            domain=BENCH_DOMAIN,
+        )
+        customer_ids = list(
+            CustomerInformation.objects.filter(email__endswith='@' + BENCH_DOMAIN).values_list('pk', flat=True)
+        )
+        rng = random.Random(options['seed'])
+        try:
+            if options['baseline']:
+                self._report_baseline(rng, customer_ids, options)
+            self._run(rng, customer_ids, options)
+        finally:
+            if not options['keep']:
+                seed.clear(BENCH_DOMAIN)
+
+    def _run(self, rng, customer_ids, options):
+        per_request = options['events_per_request']
+        bodies = [
+            json.dumps([
+                {'customer': rng.choice(customer_ids), 'level': rng.choice(['Low', 'Medium', 'High'])}
+                for _ in range(min(per_request, options['events'] - start))
+            ]).encode()
+            for start in range(0, options['events'], per_request)
+        ]
+        token = secrets.token_urlsafe()
+        buffer = ingest.EngagementBuffer(options['buffer_size'], options['batch_size'], options['flush_seconds'])
+        application = get_wsgi_application()
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        path = reverse('engagement_ingest')
+        peak = [0]
+        sending = threading.Event()
+
+        def sample_queue():
+            while not sending.wait(0.01):
+                peak[0] = max(peak[0], len(buffer))
+
+        def post(body):
+            """Posts one request until it is accepted; returns its latency in ms and the 429s it received."""
+            throttled = 0
+            started = time.perf_counter()
+            while True:
+                environ = {
+                    'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'CONTENT_TYPE': 'application/json',
+                    'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body), 'HTTP_HOST': host,
+                    'HTTP_AUTHORIZATION': f'Bearer {token}',
+                }
+                setup_testing_defaults(environ)
+                statuses = []
+                response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+                response.close()
+                status = int(statuses[0].split()[0])
+                if status != 429:
+                    break
+                # A real client would wait for Retry-After; a short pause keeps the buffer saturated
+                throttled += 1
+                time.sleep(0.005)
+            if status != 202:
+                raise CommandError(f"The ingest endpoint answered {status}.")
+            return (time.perf_counter() - started) * 1000, throttled
+
+        self.stdout.write(f"Posting {options['events']} events in {len(bodies)} requests...")
+        sampler = threading.Thread(target=sample_queue, daemon=True)
+        # Every 429 would otherwise be logged as a warning
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        with override_settings(CRM_API_TOKENS=[token]):
+            previous = ingest.replace_buffer(buffer)
+            try:
+                sampler.start()
+                started = time.perf_counter()
+                with ThreadPoolExecutor(options['concurrency']) as executor:
+                    results = list(executor.map(lambda body: _closing(post, body), bodies))
+                accepted_at = time.perf_counter()
+                buffer.close(timeout=None)
+                stored_at = time.perf_counter()
+            finally:
+                sending.set()
+                ingest.replace_buffer(previous)
+
+        stored = Engagement.objects.filter(customer__email__endswith='@' + BENCH_DOMAIN, type_of_engagement='Website Visit').count()
+        latencies = sorted(latency for latency, _ in results)
+        self.stdout.write(
+            f"accepted      {options['events'] / (accepted_at - started):>12.0f} events/s\n"
+            f"stored        {buffer.stats['written'] / (stored_at - started):>12.0f} events/s "
+            f"({buffer.stats['written']} events in {stored_at - started:.2f}s, {stored} rows in the table)\n"
+            f"drain         {stored_at - accepted_at:>12.2f} s after the last request\n"
+            f"429 responses {sum(throttled for _, throttled in results):>12}\n"
+            f"peak queued   {peak[0]:>12} of {options['buffer_size']}\n"
+            f"latency p50   {_percentile(latencies, 50):>12.2f} ms\n"
+            f"latency p99   {_percentile(latencies, 99):>12.2f} ms"
+        )
+        if buffer.stats['failed'] or buffer.stats['dropped']:
+            raise CommandError(f"Events were lost: {buffer.stats}")
+
+    def _report_baseline(self, rng, customer_ids, options):
+        """Writes events one Engagement.objects.create at a time, as the form view does."""
+        def create(_):
+            Engagement.objects.create(
+                customer_id=rng.choice(customer_ids), level_of_engagement='Low', type_of_engagement='Email'
+            )
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            list(executor.map(lambda index: _closing(create, index), range(options['baseline'])))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"baseline      {options['baseline'] / elapsed:>12.0f} events/s (one INSERT per event)")
+
+
+def _closing(func, *args):
+    """Runs ``func`` in a pool thread and releases that thread's connections afterwards."""
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crm.sales import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Recomputes product sales summaries from the purchase table, repairing any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int, help="Only rebuild these products.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with transaction.atomic():
+            rebuilt = rebuild_summaries(options['product_ids'] or None, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} product summaries in {elapsed:.1f}s"))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.lifetime_value import recompute_lifetime_values
+
+
+class Command(BaseCommand):
+    help = "Recomputes lifetime_value and worth_acquisition_cost for every customer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only customers with purchases saved since the last run.')
+        parser.add_argument('--workers', type=int, default=1, help='Processes to spread customer shards over.')
+        parser.add_argument('--shard-size', type=int, default=50000, help='Customer ids per shard.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = recompute_lifetime_values(
+            incremental=options['incremental'],
+            workers=options['workers'],
+            shard_size=options['shard_size'],
+            batch_size=options['batch_size'],
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} lifetime values in {elapsed:.1f}s"))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.metrics import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recounts the KPI counters from the source tables and stores the derived KPIs on InternalServices."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-persist', action='store_true', help="Only reset the counters.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        kpis = reconcile(persist=not options['no_persist'])
+        elapsed = time.perf_counter() - started
+        for name, value in kpis.items():
+            self.stdout.write(f"{name}: {value}")
+        self.stdout.write(self.style.SUCCESS(f"Reconciled KPI counters in {elapsed:.1f}s"))
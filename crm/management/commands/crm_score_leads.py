@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.lead_scoring import CHECKPOINT_NAME, FULL_RUN_INTERVAL, model_summary, score_leads
+from crm.models import JobCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Trains the lead conversion model on Won and Lost leads and stores likelihood_to_convert for every "
+        "open lead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Reuse the last trained model and only rescore leads whose inputs changed since the last run.')
+        parser.add_argument('--full-run-hours', type=float, default=FULL_RUN_INTERVAL.total_seconds() / 3600,
+                            help='Run in full, retraining, when the last full run is this many hours old.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            result = score_leads(
+                incremental=options['incremental'],
+                batch_size=options['batch_size'],
+                full_run_interval=timedelta(hours=options['full_run_hours']),
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+
+        if result['trained_on'] and options['verbosity'] > 1:
+            model = JobCheckpoint.objects.get(name=CHECKPOINT_NAME).state['model']
+            self.stdout.write(f"Trained on {result['trained_on']} closed leads; weights per feature (standardised):")
+            for feature, weight in model_summary(model):
+                self.stdout.write(f"  {feature:<24}{weight:>8.3f}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {result['scored']} leads ({result['updated']} changed) in {elapsed:.1f}s"
+        ))
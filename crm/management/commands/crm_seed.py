@@ -0,0 +1,60 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm import seed
+
+
+class Command(BaseCommand):
+    help = "Generates a seeded, realistically skewed CRM dataset at the requested scale."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=10000)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--purchases', type=int, help="Total purchases (default 20 per customer).")
+        parser.add_argument('--engagements', type=int, help="Total engagements (default 50 per customer).")
+        parser.add_argument('--leads', type=int, help="Total leads (default one per four customers).")
+        parser.add_argument('--years', type=int, default=3, help="Years of history to spread sales over.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, 8))
+        parser.add_argument('--shard-size', type=int, default=20000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--domain', default=seed.DEFAULT_DOMAIN, help="Email domain that tags the generated rows.")
+        parser.add_argument('--no-copy', action='store_true', help="Use bulk_create even where COPY is available.")
+        parser.add_argument('--clear', action='store_true', help="Remove a previous dataset for the domain first.")
+        parser.add_argument('--clear-only', action='store_true', help="Remove the dataset for the domain and exit.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['clear'] or options['clear_only']:
+            seed.clear(options['domain'])
+            self.stdout.write(f"Cleared @{options['domain']} data in {time.perf_counter() - started:.1f}s")
+            if options['clear_only']:
+                return
+
+        def progress(counts):
+            elapsed = time.perf_counter() - started
+            rows = sum(counts.values())
+            self.stdout.write(
+                f"Shard done: {counts['customers']} customers, {counts['purchases']} purchases, "
+                f"{counts['engagements']} engagements, {counts['leads']} leads ({rows:,} rows, {elapsed:.1f}s elapsed)"
+            )
+
+        try:
+            totals = seed.seed_dataset(
+                options['customers'], products=options['products'], purchases=options['purchases'],
+                engagements=options['engagements'], leads=options['leads'], seed=options['seed'],
+                years=options['years'], workers=options['workers'], shard_size=options['shard_size'],
+                batch_size=options['batch_size'], domain=options['domain'],
+                use_copy=False if options['no_copy'] else None, progress=progress,
+            )
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        elapsed = time.perf_counter() - started
+        rows = sum(totals.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {', '.join(f'{count:,} {name}' for name, count in totals.items())} "
+            f"in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s)"
+        ))
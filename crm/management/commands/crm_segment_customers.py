@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.models import CustomerSegment
+from crm.rfm import segment_customers
+
+
+class Command(BaseCommand):
+    help = "Recomputes the RFM scores and segment of every customer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = segment_customers(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        for segment, _ in CustomerSegment.SEGMENTS:
+            self.stdout.write(f"{segment:<14} {counts.get(segment, 0):>10}")
+        self.stdout.write(self.style.SUCCESS(f"Segmented {sum(counts.values())} customers in {elapsed:.1f}s"))
@@ -0,0 +1,146 @@
+"""
+Derived KPI counters.
+
+Revenue, customer count, lost customers and the lifetime value total/count
+are kept as ``MetricCounter`` rows. The signal receivers in ``crm.signals``
+apply the difference each saved or deleted row makes as an ``F()`` delta in
+the writer's transaction, so ``MetricCounter.kpis()`` reads every KPI with
+one query. Bulk writers apply their batch the same way, less the stored
+rows they overwrote. ``reconcile`` recounts them from the source tables, for
+bulk updates that cannot name the rows they replaced and as a periodic drift
+check, and persists the derived values onto ``InternalServices``.
+
+A lost customer is a ``CustomerLead`` in the Lost stage that is linked to a
+customer.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import (
+    CustomerInformation, ProductsPurchased, CustomerLead, LifetimeValue, InternalServices, MetricCounter
+)
+
+
+def _customer_contribution(customer):
+    return {MetricCounter.CUSTOMERS: 1}
+
+
+def _purchase_contribution(purchase):
+    amount = ProductsPurchased._meta.get_field('amount_spent').to_python(purchase.amount_spent)
+    return {MetricCounter.REVENUE: amount or 0}
+
+
+def _lead_contribution(lead):
+    lost = lead.lead_stage == 'Lost' and lead.customer_id is not None
+    return {MetricCounter.LOST_CUSTOMERS: 1 if lost else 0}
+
+
+def _lifetime_value_contribution(lifetime_value):
+    value = LifetimeValue._meta.get_field('lifetime_value').to_python(lifetime_value.lifetime_value)
+    if value is None:
+        return {}
+    return {MetricCounter.LIFETIME_VALUE_TOTAL: value, MetricCounter.LIFETIME_VALUE_COUNT: 1}
+
+
+CONTRIBUTIONS = {
+    CustomerInformation: _customer_contribution,
+    ProductsPurchased: _purchase_contribution,
+    CustomerLead: _lead_contribution,
+    LifetimeValue: _lifetime_value_contribution,
+}
+
+# Counters each model feeds, for recounting after writes that cannot be applied as deltas
+COUNTERS_BY_MODEL = {
+    CustomerInformation: (MetricCounter.CUSTOMERS,),
+    ProductsPurchased: (MetricCounter.REVENUE,),
+    CustomerLead: (MetricCounter.LOST_CUSTOMERS,),
+    LifetimeValue: (MetricCounter.LIFETIME_VALUE_TOTAL, MetricCounter.LIFETIME_VALUE_COUNT),
+}
+
+
+def record_change(model, previous=None, current=None):
+    """Applies the counter difference between two versions of a row; either may be None."""
+    contribution = CONTRIBUTIONS[model]
+    deltas = {}
+    for sign, instance in ((-1, previous), (1, current)):
+        if instance is not None:
+            for name, value in contribution(instance).items():
+                deltas[name] = deltas.get(name, 0) + sign * value
+    increment(deltas)
+
+
+def record_bulk_inserts(model, instances):
+    """Adds the contribution of a batch of newly inserted rows with one update per counter."""
+    record_bulk_changes(model, instances)
+
+
+def record_bulk_changes(model, instances, previous=()):
+    """Applies a batch of written rows, less the stored rows they replaced, with one update per counter."""
+    contribution = CONTRIBUTIONS[model]
+    deltas = {}
+    for sign, batch in ((-1, previous), (1, instances)):
+        for instance in batch:
+            for name, value in contribution(instance).items():
+                deltas[name] = deltas.get(name, 0) + sign * value
+    increment(deltas)
+
+
+def increment(deltas):
+    """Adds each ``{name: delta}`` to its counter, creating missing counters at zero."""
+    now = timezone.now()
+    # Counters are always locked in name order, so concurrent writers cannot deadlock on them
+    for name in sorted(deltas):
+        delta = deltas[name]
+        if not delta:
+            continue
+        counter = MetricCounter.objects.filter(name=name)
+        if not counter.update(value=F('value') + delta, updated_at=now):
+            MetricCounter.objects.bulk_create([MetricCounter(name=name)], ignore_conflicts=True)
+            counter.update(value=F('value') + delta, updated_at=now)
+
+
+def count_totals(names=MetricCounter.NAMES):
+    """Recounts the requested counters from the source tables."""
+    totals = {}
+    if MetricCounter.CUSTOMERS in names:
+        totals[MetricCounter.CUSTOMERS] = CustomerInformation.objects.count()
+    if MetricCounter.REVENUE in names:
+        totals[MetricCounter.REVENUE] = ProductsPurchased.objects.aggregate(total=Sum('amount_spent'))['total'] or 0
+    if MetricCounter.LOST_CUSTOMERS in names:
+        totals[MetricCounter.LOST_CUSTOMERS] = CustomerLead.objects.filter(
+            lead_stage='Lost', customer__isnull=False
+        ).count()
+    if {MetricCounter.LIFETIME_VALUE_TOTAL, MetricCounter.LIFETIME_VALUE_COUNT} & set(names):
+        lifetime_values = LifetimeValue.objects.aggregate(total=Sum('lifetime_value'), count=Count('lifetime_value'))
+        totals[MetricCounter.LIFETIME_VALUE_TOTAL] = lifetime_values['total'] or 0
+        totals[MetricCounter.LIFETIME_VALUE_COUNT] = lifetime_values['count']
+    return {name: Decimal(totals[name]) for name in names}
+
+
+def reconcile(names=MetricCounter.NAMES, persist=True):
+    """
+    Resets counters to freshly counted totals and returns the derived KPIs.
+    With ``persist`` the KPIs are also written onto the InternalServices row.
+    """
+    with transaction.atomic():
+        MetricCounter.objects.bulk_create([MetricCounter(name=name) for name in sorted(names)], ignore_conflicts=True)
+        # Writers block on these rows until we commit, so no delta lands between the count and the reset;
+        # they are locked in the same name order as ``increment`` takes them
+        counters = list(MetricCounter.objects.select_for_update().filter(name__in=names).order_by('name'))
+        totals = count_totals(names)
+        now = timezone.now()
+        for counter in counters:
+            counter.value = totals[counter.name]
+            counter.updated_at = now
+        MetricCounter.objects.bulk_update(counters, ['value', 'updated_at'])
+
+    kpis = MetricCounter.kpis()
+    if persist:
+        internal_services = InternalServices.objects.first() or InternalServices()
+        for field in InternalServices.DERIVED_FIELDS:
+            setattr(internal_services, field, kpis[field])
+        internal_services.save()
+    return kpis
@@ -0,0 +1,169 @@
+"""
+Request profiling and read replica routing.
+
+``ProfilingMiddleware`` measures a sample of requests: the number and
+duration of SQL queries on every database connection, the time spent
+rendering templates, and the total time through the view and middleware
+stack. Whatever is left is Python time in views, forms and middleware.
+
+Each sampled request gets a ``Server-Timing`` header, which browser dev
+tools show next to the request, and one JSON line on the ``crm.profiling``
+logger naming the view, so slow pages can be broken down per view from the
+logs.
+
+Set ``CRM_PROFILING`` to enable it and ``CRM_PROFILING_SAMPLE_RATE`` to the
+share of requests to measure. Requests that are not sampled only pay for
+one random number, so a low rate can be left on in production.
+
+``ReplicaRoutingMiddleware`` applies ``crm.routers`` to each request when
+``CRM_READ_REPLICA`` is set.
+"""
+import functools
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+
+from . import routers
+
+logger = logging.getLogger('crm.profiling')
+
+# The profile of the request being handled, if it was sampled
+_current_profile = ContextVar('crm_current_profile', default=None)
+
+
+class RequestProfile:
+    """Query and template timings for one request, in seconds."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def execute(self, execute, sql, params, many, context):
+        """Database execute wrapper counting and timing every query."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+def _profiled_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context):
+        profile = _current_profile.get()
+        # Included templates render inside their parent and are already timed
+        if profile is None or profile.template_depth:
+            return render(self, context)
+        profile.template_depth += 1
+        started = time.perf_counter()
+        db_time = profile.db_time
+        try:
+            return render(self, context)
+        finally:
+            profile.template_depth -= 1
+            # Queries evaluated lazily by the template count as database time only
+            profile.template_time += time.perf_counter() - started - (profile.db_time - db_time)
+    wrapper.profiled = True
+    return wrapper
+
+
+def instrument_templates():
+    """Wraps Template.render once so sampled requests can time their rendering."""
+    if not getattr(Template.render, 'profiled', False):
+        Template.render = _profiled_render(Template.render)
+
+
+class ProfilingMiddleware:
+    """Adds a Server-Timing header and a log line to a sample of requests."""
+
+    def __init__(self, get_response):
+        if not settings.CRM_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        if random.random() >= settings.CRM_PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.execute))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        # Streaming responses are timed up to their first byte
+        total = time.perf_counter() - started
+
+        timings = {
+            'queries': profile.queries,
+            'db_ms': _ms(profile.db_time),
+            'template_ms': _ms(profile.template_time),
+            'python_ms': _ms(max(total - profile.db_time - profile.template_time, 0)),
+            'total_ms': _ms(total),
+        }
+        server_timing = ', '.join([
+            f'db;dur={timings["db_ms"]};desc="{profile.queries} queries"',
+            f'tpl;dur={timings["template_ms"]};desc="Templates"',
+            f'app;dur={timings["python_ms"]};desc="Python"',
+            f'total;dur={timings["total_ms"]}',
+        ])
+        if response.has_header('Server-Timing'):
+            server_timing = f"{response['Server-Timing']}, {server_timing}"
+        response['Server-Timing'] = server_timing
+
+        match = request.resolver_match
+        logger.info(json.dumps({
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            **timings,
+        }))
+        return response
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class ReplicaRoutingMiddleware:
+    """Lets read-only views read from the replica and makes users who write sticky to the primary."""
+
+    def __init__(self, get_response):
+        if not settings.CRM_READ_REPLICA:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state, token = routers.begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.end_request(token)
+        if state.replica and response.streaming and not response.is_async:
+            # Exports are streamed after this returns; keep their reads on the replica
+            response.streaming_content = routers.with_state(response.streaming_content, state)
+        if state.wrote:
+            response.set_cookie(
+                routers.STICKY_COOKIE, '1', max_age=settings.CRM_REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routers.route_view(request, view_func)
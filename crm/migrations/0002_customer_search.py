@@ -0,0 +1,59 @@
+import re
+
+from django.db import migrations, models
+
+TRIGRAM_INDEXES = {
+    'crm_customer_name_trgm': 'UPPER("name"::text) gin_trgm_ops',
+    'crm_customer_email_trgm': 'UPPER("email"::text) gin_trgm_ops',
+    'crm_customer_phone_digits_trgm': '"phone_digits" gin_trgm_ops',
+}
+
+
+def backfill_phone_digits(apps, schema_editor):
+    CustomerInformation = apps.get_model('crm', 'CustomerInformation')
+    manager = CustomerInformation.objects.db_manager(schema_editor.connection.alias)
+    customers = manager.exclude(phone=None)
+    batch = []
+    for customer in customers.only('id', 'phone').iterator(chunk_size=2000):
+        customer.phone_digits = re.sub(r'\D', '', customer.phone)
+        batch.append(customer)
+        if len(batch) >= 2000:
+            manager.bulk_update(batch, ['phone_digits'])
+            batch = []
+    if batch:
+        manager.bulk_update(batch, ['phone_digits'])
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Trigram indexes are Postgres only; other backends keep the plain scan.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, expression in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON crm_customerinformation USING gin ({expression})'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customerinformation",
+            name="phone_digits",
+            field=models.CharField(blank=True, default="", editable=False, max_length=20),
+        ),
+        migrations.RunPython(backfill_phone_digits, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0002_customer_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerChurnScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(db_index=True)),
+                ('engagement_count', models.PositiveIntegerField(default=0)),
+                ('average_engagement', models.FloatField(blank=True, null=True)),
+                ('last_engagement', models.DateTimeField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='churn_score', to='crm.customerinformation')),
+            ],
+        ),
+    ]
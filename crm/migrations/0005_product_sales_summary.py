@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def backfill_sales_summaries(apps, schema_editor):
+    Product = apps.get_model('crm', 'Product')
+    ProductsPurchased = apps.get_model('crm', 'ProductsPurchased')
+    ProductSalesSummary = apps.get_model('crm', 'ProductSalesSummary')
+    alias = schema_editor.connection.alias
+    totals = {
+        row['product_id']: row
+        for row in ProductsPurchased.objects.using(alias).values('product_id').annotate(
+            units_sold=Sum('number_of_products_purchased'),
+            revenue=Sum('amount_spent'),
+            first_sale_date=Min('date_of_sale'),
+            last_sale_date=Max('date_of_sale'),
+            distinct_buyers=Count('customer_id', distinct=True),
+        ).order_by()
+    }
+    summaries = []
+    for product_id in Product.objects.using(alias).values_list('id', flat=True).iterator(chunk_size=2000):
+        total = totals.get(product_id, {})
+        summaries.append(ProductSalesSummary(
+            product_id=product_id,
+            units_sold=total.get('units_sold') or 0,
+            revenue=total.get('revenue') or 0,
+            first_sale_date=total.get('first_sale_date'),
+            last_sale_date=total.get('last_sale_date'),
+            distinct_buyers=total.get('distinct_buyers') or 0,
+        ))
+    ProductSalesSummary.objects.using(alias).bulk_create(summaries, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0004_job_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_summary', serialize=False, to='crm.product')),
+                ('units_sold', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('first_sale_date', models.DateField(blank=True, null=True)),
+                ('last_sale_date', models.DateField(blank=True, null=True)),
+                ('distinct_buyers', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_sales_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:05
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_counters(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    models_ = {name: apps.get_model('crm', name).objects.using(alias) for name in (
+        'CustomerInformation', 'ProductsPurchased', 'CustomerLead', 'LifetimeValue', 'MetricCounter'
+    )}
+    lifetime_values = models_['LifetimeValue'].aggregate(total=Sum('lifetime_value'), count=Count('lifetime_value'))
+    totals = {
+        'customers': models_['CustomerInformation'].count(),
+        'revenue': models_['ProductsPurchased'].aggregate(total=Sum('amount_spent'))['total'] or 0,
+        'lost_customers': models_['CustomerLead'].filter(lead_stage='Lost', customer__isnull=False).count(),
+        'lifetime_value_total': lifetime_values['total'] or 0,
+        'lifetime_value_count': lifetime_values['count'],
+    }
+    MetricCounter = apps.get_model('crm', 'MetricCounter')
+    models_['MetricCounter'].bulk_create(MetricCounter(name=name, value=value) for name, value in totals.items())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0005_product_sales_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
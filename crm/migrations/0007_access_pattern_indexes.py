@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_metric_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerlead',
+            index=models.Index(fields=['lead_stage', 'status'], name='crm_lead_stage_status'),
+        ),
+        migrations.AddIndex(
+            model_name='customerlead',
+            index=models.Index(condition=models.Q(('customer__isnull', True)), fields=['created_at'], name='crm_lead_unassigned'),
+        ),
+        migrations.AddIndex(
+            model_name='engagement',
+            index=models.Index(fields=['customer', 'engagement_date'], name='crm_engagement_customer_date'),
+        ),
+        migrations.AddIndex(
+            model_name='engagement',
+            index=models.Index(fields=['engagement_date', 'id'], name='crm_engagement_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='productspurchased',
+            index=models.Index(fields=['customer', 'date_of_sale'], include=('amount_spent',), name='crm_purchase_customer_date'),
+        ),
+        migrations.AddIndex(
+            model_name='productspurchased',
+            index=models.Index(fields=['product', 'date_of_sale'], name='crm_purchase_product_date'),
+        ),
+        migrations.AddIndex(
+            model_name='productspurchased',
+            index=models.Index(fields=['date_of_sale', 'id'], name='crm_purchase_recent'),
+        ),
+        # Drop the single-column FK indexes only once the composites that replace them exist
+        migrations.AlterField(
+            model_name='engagement',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='crm.customerinformation'),
+        ),
+        migrations.AlterField(
+            model_name='productspurchased',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='crm.customerinformation'),
+        ),
+        migrations.AlterField(
+            model_name='productspurchased',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='crm.product'),
+        ),
+    ]
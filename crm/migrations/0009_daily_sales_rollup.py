@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_rollups(apps, schema_editor):
+    ProductsPurchased = apps.get_model('crm', 'ProductsPurchased')
+    DailySalesRollup = apps.get_model('crm', 'DailySalesRollup')
+    alias = schema_editor.connection.alias
+    rows = ProductsPurchased.objects.using(alias).values(
+        'date_of_sale', 'product_id', segment=Coalesce('customer__industry', Value('')),
+    ).annotate(
+        units=Sum('number_of_products_purchased'), revenue=Sum('amount_spent'), purchases=Count('id'),
+    ).order_by()
+    DailySalesRollup.objects.using(alias).bulk_create(
+        (DailySalesRollup(
+            date=row['date_of_sale'], product_id=row['product_id'], segment=row['segment'],
+            units=row['units'], revenue=row['revenue'], purchases=row['purchases'],
+        ) for row in rows.iterator(chunk_size=2000)),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_modification_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('segment', models.CharField(blank=True, default='', max_length=100)),
+                ('units', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('purchases', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='crm.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'date'], name='crm_rollup_product_date')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product', 'segment'), name='crm_rollup_date_product_segment')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_transitions(apps, schema_editor):
+    # Existing leads start their history in their current stage, as of their creation
+    CustomerLead = apps.get_model('crm', 'CustomerLead')
+    LeadStageTransition = apps.get_model('crm', 'LeadStageTransition')
+    alias = schema_editor.connection.alias
+    now = timezone.now()
+    leads = CustomerLead.objects.using(alias).values_list('pk', 'lead_stage', 'created_at')
+    LeadStageTransition.objects.using(alias).bulk_create(
+        (LeadStageTransition(lead_id=pk, to_stage=stage, changed_at=created_at or now)
+         for pk, stage, created_at in leads.iterator(chunk_size=2000)),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_daily_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadStageTransition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_stage', models.CharField(blank=True, default='', max_length=50)),
+                ('to_stage', models.CharField(choices=[('Initial Contact', 'Initial Contact'), ('Qualified', 'Qualified'), ('Negotiation', 'Negotiation'), ('Won', 'Won'), ('Lost', 'Lost')], max_length=50)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lead', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stage_transitions', to='crm.customerlead')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['lead', 'changed_at'], name='crm_transition_lead_time')],
+            },
+        ),
+        migrations.RunPython(backfill_transitions, migrations.RunPython.noop),
+    ]
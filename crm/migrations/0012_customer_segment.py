@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0011_job_checkpoint_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment', models.CharField(choices=[('Champions', 'Champions'), ('Loyal', 'Loyal'), ('New', 'New'), ('Promising', 'Promising'), ("Can't Lose", "Can't Lose"), ('At Risk', 'At Risk'), ('Hibernating', 'Hibernating'), ('Lost', 'Lost'), ('No Purchases', 'No Purchases')], max_length=20)),
+                ('recency_score', models.PositiveSmallIntegerField(default=0)),
+                ('frequency_score', models.PositiveSmallIntegerField(default=0)),
+                ('monetary_score', models.PositiveSmallIntegerField(default=0)),
+                ('last_purchase', models.DateField(blank=True, null=True)),
+                ('purchases', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rfm', to='crm.customerinformation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['segment', 'customer'], name='crm_segment_customer')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:10
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0012_customer_segment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerinformation',
+            index=models.Index(django.db.models.functions.text.Upper('name'), models.F('id'), name='crm_customer_name_upper'),
+        ),
+        migrations.AddIndex(
+            model_name='customerinformation',
+            index=models.Index(django.db.models.functions.text.Upper('email'), models.F('id'), name='crm_customer_email_upper'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0013_customer_search_order'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerinformation',
+            index=models.Index(fields=['updated_at'], name='crm_customer_updated'),
+        ),
+    ]
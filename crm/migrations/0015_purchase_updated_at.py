@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0014_customer_updated_index'),
+    ]
+
+    operations = [
+        # Existing rows are stamped with the migration time
+        migrations.AddField(
+            model_name='productspurchased',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='productspurchased',
+            index=models.Index(fields=['updated_at'], name='crm_purchase_updated'),
+        ),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+import re
+from decimal import Decimal
+
+from django.db import models, transaction
 from django.utils import timezone
-from django.db.models import Sum, Avg
+from django.db.models import Sum, Avg, Count, Case, When, Value, F
+from django.db.models.functions import Upper
 from django.contrib.auth.models import AbstractUser
 
 # --- Custom User Model ---
@@ -32,29 +36,103 @@ class User(AbstractUser):
 
 
 # --- Customer Models ---
+def normalize_phone(value):
+    """Strips a phone number down to its digits so formatting does not affect search."""
+    return re.sub(r'\D', '', value or '')
+
+
 class CustomerInformation(models.Model):
     name = models.CharField(max_length=255)
     email = models.EmailField(unique=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
+    phone_digits = models.CharField(max_length=20, blank=True, default='', editable=False)
     industry = models.CharField(max_length=100, blank=True, null=True)
     company = models.CharField(max_length=255, blank=True, null=True)
     education = models.CharField(max_length=100, blank=True, null=True)
     income = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     created_at = models.DateField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Exact and prefix search tiers read the first matches in this order (crm.search)
+            models.Index(Upper('name'), F('id'), name='crm_customer_name_upper'),
+            models.Index(Upper('email'), F('id'), name='crm_customer_email_upper'),
+            # Autocomplete index syncs read the customers changed since their last sync (crm.autocomplete)
+            models.Index(fields=['updated_at'], name='crm_customer_updated'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.phone_digits = normalize_phone(self.phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+            if 'phone' in update_fields:
+                kwargs['update_fields'].add('phone_digits')
+        # Keeps the KPI counter updates made by the save signals in the same transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
     def likelihood_to_churn(self):
         """Calculates likelihood to churn based on engagement and internal churn rate."""
-        engagements = self.engagement_set.all()
+        avg_engagement = self.engagement_set.aggregate(
+            avg_engagement=Avg(Engagement.level_score())
+        )['avg_engagement']
+        if avg_engagement is None:
+            return 0
         churn_rate = InternalServices.get_internal_churn_rate()
-        if engagements.exists():
-            avg_engagement = engagements.aggregate(
-                avg_engagement=Avg('level_of_engagement')
-            )['avg_engagement']
-            return churn_rate * (1 - avg_engagement)
-        return "No engagement for customer"
+        return float(churn_rate) * (1 - avg_engagement)
+
+
+class CustomerChurnScore(models.Model):
+    """Churn risk per customer, written in bulk by ``crm.churn.score_customers``."""
+    customer = models.OneToOneField(CustomerInformation, on_delete=models.CASCADE, related_name='churn_score')
+    score = models.FloatField(db_index=True)
+    engagement_count = models.PositiveIntegerField(default=0)
+    average_engagement = models.FloatField(blank=True, null=True)
+    last_engagement = models.DateTimeField(blank=True, null=True)
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Churn score for {self.customer.name}: {self.score:.2f}"
+
+
+class CustomerSegment(models.Model):
+    """RFM scores and segment per customer, written in bulk by ``crm.rfm.segment_customers``."""
+    SEGMENTS = [
+        ('Champions', 'Champions'),
+        ('Loyal', 'Loyal'),
+        ('New', 'New'),
+        ('Promising', 'Promising'),
+        ("Can't Lose", "Can't Lose"),
+        ('At Risk', 'At Risk'),
+        ('Hibernating', 'Hibernating'),
+        ('Lost', 'Lost'),
+        ('No Purchases', 'No Purchases'),
+    ]
+
+    customer = models.OneToOneField(CustomerInformation, on_delete=models.CASCADE, related_name='rfm')
+    segment = models.CharField(max_length=20, choices=SEGMENTS)
+    # Quintile scores, 5 best; 0 for customers without purchases
+    recency_score = models.PositiveSmallIntegerField(default=0)
+    frequency_score = models.PositiveSmallIntegerField(default=0)
+    monetary_score = models.PositiveSmallIntegerField(default=0)
+    last_purchase = models.DateField(blank=True, null=True)
+    purchases = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Customer list and dashboard segment filters read the customer ids of one segment from the index
+            models.Index(fields=['segment', 'customer'], name='crm_segment_customer'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id}: {self.segment} (R{self.recency_score} F{self.frequency_score} M{self.monetary_score})"
 
 
 class CustomDescriptionField(models.Model):
@@ -70,25 +148,87 @@ class Product(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
     def total_revenue(self):
-        """Calculates total revenue from product sales."""
-        return self.productspurchased_set.aggregate(total=Sum('amount_spent'))['total']
+        """Total revenue from product sales, read from the maintained sales summary."""
+        return ProductSalesSummary.objects.filter(product=self).values_list('revenue', flat=True).first()
 
 
 class ProductsPurchased(models.Model):
-    customer = models.ForeignKey(CustomerInformation, on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # The composite indexes below lead with these columns, so separate FK indexes would be redundant
+    customer = models.ForeignKey(CustomerInformation, on_delete=models.CASCADE, db_index=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
     number_of_products_purchased = models.PositiveIntegerField()
     date_of_sale = models.DateField(default=timezone.now)
     amount_spent = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Customer detail revenue and lifetime value aggregates; Postgres answers them from the index alone
+            models.Index(fields=['customer', 'date_of_sale'], include=['amount_spent'], name='crm_purchase_customer_date'),
+            # Sales summary first/last sale lookups and per-product grouping
+            models.Index(fields=['product', 'date_of_sale'], name='crm_purchase_product_date'),
+            # Purchase list, newest first
+            models.Index(fields=['date_of_sale', 'id'], name='crm_purchase_recent'),
+            # Incremental batch jobs read the purchases changed since their last run
+            models.Index(fields=['updated_at'], name='crm_purchase_updated'),
+        ]
 
     def __str__(self):
         return f"{self.customer.name} purchased {self.product.name}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+        # Keeps the purchase and the summary and KPI counter updates made by its signals in one transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+class ProductSalesSummary(models.Model):
+    """Running sales totals per product, kept in step with ProductsPurchased by ``crm.sales``."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='sales_summary')
+    units_sold = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    first_sale_date = models.DateField(blank=True, null=True)
+    last_sale_date = models.DateField(blank=True, null=True)
+    distinct_buyers = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Sales summary for {self.product.name}"
+
+
+class DailySalesRollup(models.Model):
+    """
+    Units and revenue per day, product and customer segment (the customer's
+    industry), kept in step with ProductsPurchased by ``crm.rollups``.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+    segment = models.CharField(max_length=100, blank=True, default='')
+    units = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    purchases = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also serves date range scans for the reports
+            models.UniqueConstraint(fields=['date', 'product', 'segment'], name='crm_rollup_date_product_segment'),
+        ]
+        indexes = [
+            # Per-product reports; also serves the product FK
+            models.Index(fields=['product', 'date'], name='crm_rollup_product_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.product_id} {self.segment or 'unsegmented'}: {self.revenue}"
+
 
 # --- Lead Models ---
 class CustomerLead(models.Model):
@@ -111,13 +251,44 @@ class CustomerLead(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Pipeline views and the lost-customer count filter on stage, then status
+            models.Index(fields=['lead_stage', 'status'], name='crm_lead_stage_status'),
+            # Leads not yet linked to a customer, newest first; a small slice of the table
+            models.Index(fields=['created_at'], condition=models.Q(customer__isnull=True), name='crm_lead_unassigned'),
+        ]
+
     def __str__(self):
         if self.customer:
             return f"Lead for {self.customer.name} - {self.lead_stage}"
         return f"Lead: {self.name or 'Unnamed'} - {self.lead_stage}"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        # Keeps the KPI counter updates made by the save signals in the same transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+class LeadStageTransition(models.Model):
+    """
+    Append-only history of lead stages: one row each time a lead enters a
+    stage, written by ``crm.funnel``. ``from_stage`` is '' for the stage a
+    lead was created in.
+    """
+    lead = models.ForeignKey(CustomerLead, on_delete=models.CASCADE, related_name='stage_transitions', db_index=False)
+    from_stage = models.CharField(max_length=50, blank=True, default='')
+    to_stage = models.CharField(max_length=50, choices=CustomerLead.LEAD_STAGES)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # A lead's history in order, and the next transition after each one; also serves the lead FK
+            models.Index(fields=['lead', 'changed_at'], name='crm_transition_lead_time'),
+        ]
+
+    def __str__(self):
+        return f"Lead {self.lead_id}: {self.from_stage or 'new'} -> {self.to_stage} at {self.changed_at}"
 
 
 # --- Engagement Models ---
@@ -129,14 +300,34 @@ class Engagement(models.Model):
         ('Website Visit', 'Website Visit'),
     ]
 
-    customer = models.ForeignKey(CustomerInformation, on_delete=models.CASCADE)
+    # Numeric weight of each engagement level, used when averaging engagement
+    LEVEL_SCORES = {'Low': 0.25, 'Medium': 0.5, 'High': 0.75}
+
+    customer = models.ForeignKey(CustomerInformation, on_delete=models.CASCADE, db_index=False)
     level_of_engagement = models.CharField(max_length=10, choices=[('Low', 'Low'), ('Medium', 'Medium'), ('High', 'High')])
     type_of_engagement = models.CharField(max_length=20, choices=ENGAGEMENT_TYPE)
     engagement_date = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Per-customer engagement history and churn scoring; also serves the customer FK
+            models.Index(fields=['customer', 'engagement_date'], name='crm_engagement_customer_date'),
+            # Engagement list, newest first
+            models.Index(fields=['engagement_date', 'id'], name='crm_engagement_recent'),
+        ]
 
     def __str__(self):
         return f"Engagement with {self.customer.name} - {self.type_of_engagement}"
 
+    @classmethod
+    def level_score(cls, prefix=''):
+        """Expression mapping ``level_of_engagement`` to its numeric score."""
+        return Case(
+            *[When(**{f'{prefix}level_of_engagement': level, 'then': Value(score)}) for level, score in cls.LEVEL_SCORES.items()],
+            output_field=models.FloatField(),
+        )
+
 
 # --- Lifetime Value Models ---
 class LifetimeValue(models.Model):
@@ -148,16 +339,21 @@ class LifetimeValue(models.Model):
     def __str__(self):
         return f"Lifetime Value for {self.customer.name}"
 
+    def save(self, *args, **kwargs):
+        # Keeps the KPI counter updates made by the save signals in the same transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
     def calculate_lifetime_value(self):
         """Calculates lifetime value based on revenue, purchase frequency, and length of customer."""
-        purchases = ProductsPurchased.objects.filter(customer=self.customer)
-        if purchases.exists():
-            avg_purchase_value = purchases.aggregate(avg_value=Avg('amount_spent'))['avg_value']
-            purchase_frequency = purchases.count()
+        purchases = ProductsPurchased.objects.filter(customer=self.customer).aggregate(
+            avg_value=Avg('amount_spent'), purchase_frequency=Count('id')
+        )
+        if purchases['purchase_frequency']:
             customer_length = InternalServices.get_average_customer_length(self.customer)
-            self.lifetime_value = avg_purchase_value * purchase_frequency * customer_length
+            self.lifetime_value = purchases['avg_value'] * purchases['purchase_frequency'] * customer_length
             return self.lifetime_value
-        return 0
+        return self.lifetime_value or 0
 
     def calculate_worth_acquisition(self):
         """Calculates worth acquisition cost as lifetime value - cost to acquire."""
@@ -184,13 +380,81 @@ class InternalServices(models.Model):
     def __str__(self):
         return "Internal Services Data"
 
+    # KPIs derived from transactional data through MetricCounter rather than typed in
+    DERIVED_FIELDS = (
+        'current_revenue', 'total_customers', 'internal_churn_rate',
+        'average_revenue_per_customer', 'average_lifetime_value',
+    )
+
     @staticmethod
     def get_internal_churn_rate():
-        """Calculates internal churn rate: (lost customers / total customers)."""
-        return InternalServices.objects.aggregate(churn_rate=Avg('internal_churn_rate'))['churn_rate'] or 0
+        """Internal churn rate (lost customers / total customers) as of the last KPI reconciliation."""
+        churn_rate = InternalServices.objects.exclude(internal_churn_rate=None).values_list(
+            'internal_churn_rate', flat=True
+        ).first()
+        return churn_rate or 0
+
+    @staticmethod
+    def get_average_customer_length(customer=None):
+        """Expected customer lifespan in years, from the recorded average length of a customer (1 if unset)."""
+        average_length = InternalServices.objects.exclude(average_length_of_customer=None).values_list(
+            'average_length_of_customer', flat=True
+        ).first()
+        return average_length if average_length is not None else Decimal(1)
 
     @staticmethod
     def calculate_average_lifetime_value():
-        """Calculates the average lifetime value for all customers."""
-        lifetime_values = LifetimeValue.objects.aggregate(avg_lifetime_value=Avg('lifetime_value'))
-        return lifetime_values['avg_lifetime_value'] or 0
+        """Average lifetime value for all customers, from the running counters."""
+        return MetricCounter.kpis()['average_lifetime_value']
+
+
+class MetricCounter(models.Model):
+    """Running total behind the derived KPIs, kept current by ``crm.metrics``."""
+    CUSTOMERS = 'customers'
+    REVENUE = 'revenue'
+    LOST_CUSTOMERS = 'lost_customers'
+    LIFETIME_VALUE_TOTAL = 'lifetime_value_total'
+    LIFETIME_VALUE_COUNT = 'lifetime_value_count'
+    NAMES = (CUSTOMERS, REVENUE, LOST_CUSTOMERS, LIFETIME_VALUE_TOTAL, LIFETIME_VALUE_COUNT)
+
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def kpis(cls):
+        """Derives the InternalServices KPIs from the counters in a single query."""
+        counters = dict(cls.objects.values_list('name', 'value'))
+        customers = counters.get(cls.CUSTOMERS, Decimal(0))
+        revenue = counters.get(cls.REVENUE, Decimal(0))
+        lifetime_value_count = counters.get(cls.LIFETIME_VALUE_COUNT, Decimal(0))
+        cents = Decimal('0.01')
+        return {
+            'current_revenue': revenue,
+            'total_customers': int(customers),
+            'internal_churn_rate': (
+                (counters.get(cls.LOST_CUSTOMERS, Decimal(0)) * 100 / customers).quantize(cents)
+                if customers else Decimal(0)
+            ),
+            'average_revenue_per_customer': (revenue / customers).quantize(cents) if customers else Decimal(0),
+            'average_lifetime_value': (
+                (counters.get(cls.LIFETIME_VALUE_TOTAL, Decimal(0)) / lifetime_value_count).quantize(cents)
+                if lifetime_value_count else Decimal(0)
+            ),
+        }
+
+
+# --- Batch Job Models ---
+class JobCheckpoint(models.Model):
+    """High-water mark left by an incremental batch job for its next run."""
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    last_run_at = models.DateTimeField(blank=True, null=True)
+    # Anything else a job carries between runs, such as a trained model
+    state = models.JSONField(default=dict, blank=True)
+
+    def __str__(self):
+        return f"{self.name} (last id {self.last_id})"
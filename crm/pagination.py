@@ -0,0 +1,232 @@
+"""
+Keyset (cursor) pagination.
+
+``CursorPaginator`` pages through a queryset by seeking past the last row
+seen on its ordering columns instead of using ``OFFSET``, so page 5,000
+costs the same as page 1 and no ``COUNT(*)`` is issued. Page tokens are
+opaque strings carried in the usual ``page`` query parameter, and
+``CursorPage`` mirrors the parts of Django's ``Page`` the templates use, so
+the existing Previous/Next controls work unchanged.
+
+The ordering is taken from the queryset, with ``pk`` appended as a
+tie-breaker. Ordering columns must be model fields or annotations on the
+queryset itself. A nullable column must be ordered with
+``F(name).asc(nulls_last=True)`` or ``.desc(nulls_last=True)``, so the seek
+predicate knows where its NULLs sort.
+"""
+import base64
+import datetime
+import json
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, OrderBy, Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keeps full microsecond precision, which the seek comparison needs."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(direction, values, number):
+    payload = json.dumps({'d': direction, 'v': values, 'n': number}, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction, values, number = payload['d'], payload['v'], int(payload['n'])
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        raise InvalidCursor(token)
+    return direction, values, number
+
+
+def estimated_count(queryset):
+    """Returns the planner's row estimate for an unfiltered queryset on Postgres, else None."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples is -1 for tables that have never been analyzed
+    return max(row[0], 0) if row else None
+
+
+def cursor_pagination_enabled(view):
+    enabled = getattr(view, 'cursor_pagination', None)
+    return settings.CRM_CURSOR_PAGINATION if enabled is None else enabled
+
+
+class CursorPaginator:
+    """Paginates ``queryset`` with ``(sort_key, pk)`` seek predicates."""
+
+    def __init__(self, queryset, per_page):
+        self.per_page = int(per_page)
+        self.ordering = self._get_ordering(queryset)
+        self.queryset = queryset.order_by(*[
+            OrderBy(F(name), descending=descending, nulls_last=True) if nulls_last else ('-' if descending else '') + name
+            for name, descending, nulls_last in self.ordering
+        ])
+        self.num_pages = None
+
+    @property
+    def count(self):
+        """Planner estimate of the total row count, or None when it is not available."""
+        if not hasattr(self, '_count'):
+            self._count = estimated_count(self.queryset)
+        return self._count
+
+    def get_page(self, token=None):
+        """Returns the page for ``token``, falling back to the first page for bad tokens."""
+        try:
+            return self.page(token)
+        except InvalidCursor:
+            return self.page(None)
+
+    def page(self, token=None):
+        if not token:
+            return self.build_page(list(self.queryset[:self.per_page + 1]))
+
+        direction, values, number = decode_cursor(token)
+        if len(values) != len(self.ordering):
+            raise InvalidCursor(token)
+        forward = direction == 'next'
+        queryset = self.queryset.filter(self._seek(values, forward))
+        if not forward:
+            queryset = queryset.reverse()
+        rows = list(queryset[:self.per_page + 1])
+        if not rows:
+            # The rows this cursor pointed past are gone; start over
+            return self.page(None)
+        if not forward:
+            rows.reverse()
+        return self.build_page(rows, direction, number)
+
+    def build_page(self, rows, direction=None, number=1):
+        """Builds a page from up to ``per_page + 1`` rows fetched in page order."""
+        overflow = len(rows) > self.per_page
+        if direction == 'prev':
+            # Rows were fetched backwards, so the extra row is the first one
+            object_list = rows[1:] if overflow else rows
+            has_previous, has_next = overflow, True
+            number = number if overflow else 1
+        else:
+            object_list = rows[:self.per_page]
+            has_previous, has_next = direction == 'next', overflow
+        return CursorPage(object_list, number, self, has_previous, has_next)
+
+    def key_for(self, obj):
+        return [self._value(obj, name) for name, _, _ in self.ordering]
+
+    def _get_ordering(self, queryset):
+        query = queryset.query
+        names = list(query.order_by or (query.get_meta().ordering if query.default_ordering else ()))
+        ordering = []
+        for name in names:
+            if isinstance(name, OrderBy) and isinstance(name.expression, F) and name.nulls_last:
+                ordering.append((name.expression.name, name.descending, True))
+                continue
+            if not isinstance(name, str) or '__' in name or name == '?':
+                raise ValueError(f"Cursor pagination cannot order by {name!r}")
+            ordering.append((name.lstrip('-'), name.startswith('-'), False))
+        if not any(name in ('pk', 'id') for name, _, _ in ordering):
+            ordering.append(('pk', ordering[-1][1] if ordering else False, False))
+        return ordering
+
+    def _value(self, obj, name):
+        if name == 'pk':
+            return obj.pk
+        try:
+            return getattr(obj, obj._meta.get_field(name).attname)
+        except FieldDoesNotExist:
+            # Annotation
+            return getattr(obj, name)
+
+    def _seek(self, values, forward):
+        """Builds the lexicographic "row comes after/before ``values``" predicate."""
+        condition = Q()
+        for position, (name, descending, nulls_last) in enumerate(self.ordering):
+            term = self._beyond(name, values[position], descending, nulls_last, forward)
+            for previous, (previous_name, _, _) in enumerate(self.ordering[:position]):
+                value = values[previous]
+                term &= Q(**{f'{previous_name}__isnull': True}) if value is None else Q(**{previous_name: value})
+            condition |= term
+        return condition
+
+    def _beyond(self, name, value, descending, nulls_last, forward):
+        """Rows whose ``name`` sorts strictly after (``forward``) or before ``value``."""
+        if value is None:
+            # NULLs sort last: nothing comes after them, every non-NULL value before
+            return Q(pk__in=[]) if forward else Q(**{f'{name}__isnull': False})
+        lookup = 'lt' if descending == forward else 'gt'
+        term = Q(**{f'{name}__{lookup}': value})
+        if nulls_last and forward:
+            term |= Q(**{f'{name}__isnull': True})
+        return term
+
+
+class CursorPage(Sequence):
+    """A page of a ``CursorPaginator``; page "numbers" are cursor tokens."""
+
+    def __init__(self, object_list, number, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return f'<Cursor page {self.number}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    def next_page_number(self):
+        return encode_cursor('next', self.paginator.key_for(self.object_list[-1]), self.number + 1)
+
+    def previous_page_number(self):
+        return encode_cursor('prev', self.paginator.key_for(self.object_list[0]), self.number - 1)
+
+
+class CursorPaginationMixin:
+    """
+    ListView mixin that switches to keyset pagination when enabled, either
+    per view through ``cursor_pagination`` or globally through
+    ``CRM_CURSOR_PAGINATION``.
+    """
+    cursor_pagination = None
+
+    def paginate_queryset(self, queryset, page_size):
+        if not cursor_pagination_enabled(self):
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size)
+        page = paginator.get_page(self.request.GET.get(self.page_kwarg))
+        return (paginator, page, page.object_list, page.has_other_pages())
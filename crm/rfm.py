@@ -0,0 +1,125 @@
+"""
+RFM customer segmentation.
+
+Recency (days since the last purchase), frequency (number of purchases)
+and monetary value (total spent) for every customer come from one grouped
+query over ``ProductsPurchased``. Each measure is scored 1-5 against the
+quintiles of all purchasing customers, computed with NumPy over the whole
+population at once, and the score combination is mapped to a segment
+label. Results are upserted into ``CustomerSegment``, whose
+(segment, customer) index serves the segment filters of the customer list
+and the dashboard.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from . import versions
+from .models import CustomerInformation, CustomerSegment
+
+SEGMENT_FIELDS = [
+    'segment', 'recency_score', 'frequency_score', 'monetary_score',
+    'last_purchase', 'purchases', 'revenue', 'computed_at',
+]
+
+NO_PURCHASES = 'No Purchases'
+
+# Checked in order; the first matching rule names the segment, otherwise Lost.
+# ``fm`` is the rounded mean of the frequency and monetary scores.
+SEGMENT_RULES = [
+    ('Champions', lambda r, fm: (r >= 4) & (fm >= 4)),
+    ('Loyal', lambda r, fm: (r >= 3) & (fm >= 3)),
+    ('New', lambda r, fm: (r >= 4) & (fm <= 2)),
+    ('Promising', lambda r, fm: r >= 3),
+    ("Can't Lose", lambda r, fm: fm >= 4),
+    ('At Risk', lambda r, fm: fm >= 3),
+    ('Hibernating', lambda r, fm: r == 2),
+]
+
+
+def quantile_scores(values, bins=5):
+    """
+    Scores ``values`` 1 to ``bins`` by the quantile they fall in, higher
+    values scoring higher. Ties share a score, so a heavily repeated value
+    (e.g. one purchase) can leave some scores unused.
+    """
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return np.zeros(0, dtype=int)
+    edges = np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1])
+    return np.searchsorted(edges, values, side='left') + 1
+
+
+def label_segments(recency_scores, frequency_scores, monetary_scores):
+    """Maps arrays of R, F and M scores to segment labels."""
+    r = np.asarray(recency_scores)
+    fm = np.floor((np.asarray(frequency_scores) + np.asarray(monetary_scores)) / 2 + 0.5)
+    return np.select(
+        [rule(r, fm) for _, rule in SEGMENT_RULES],
+        [name for name, _ in SEGMENT_RULES],
+        default='Lost',
+    )
+
+
+def segment_customers(batch_size=5000, today=None):
+    """Segments every customer and stores the results. Returns the number of customers per segment."""
+    today = today or timezone.localdate()
+    computed_at = timezone.now()
+    aggregates = (
+        CustomerInformation.objects
+        .annotate(
+            last_purchase=Max('productspurchased__date_of_sale'),
+            purchases=Count('productspurchased'),
+            revenue=Sum('productspurchased__amount_spent'),
+        )
+        .order_by()
+        .values_list('id', 'last_purchase', 'purchases', 'revenue')
+    )
+    rows = list(aggregates.iterator(chunk_size=batch_size))
+    if not rows:
+        return {}
+
+    # Quintiles are taken over all purchasing customers, so every row is scored before any is written
+    customer_ids, last_dates, counts, revenues = zip(*rows)
+    purchased = np.array([last_purchase is not None for last_purchase in last_dates])
+    recency = np.array([(today - last_purchase).days if last_purchase else 0 for last_purchase in last_dates], dtype=float)
+    frequency = np.array(counts, dtype=float)
+    monetary = np.array([float(revenue or 0) for revenue in revenues])
+
+    r_scores = np.zeros(len(rows), dtype=int)
+    f_scores = np.zeros(len(rows), dtype=int)
+    m_scores = np.zeros(len(rows), dtype=int)
+    # Fewer days since the last purchase is better, so recency is scored on the negated value
+    r_scores[purchased] = quantile_scores(-recency[purchased])
+    f_scores[purchased] = quantile_scores(frequency[purchased])
+    m_scores[purchased] = quantile_scores(monetary[purchased])
+    segments = np.where(purchased, label_segments(r_scores, f_scores, m_scores), NO_PURCHASES)
+
+    objects = [
+        CustomerSegment(
+            customer_id=customer_id,
+            segment=str(segment),
+            recency_score=int(r),
+            frequency_score=int(f),
+            monetary_score=int(m),
+            last_purchase=last_purchase,
+            purchases=count,
+            revenue=revenue or 0,
+            computed_at=computed_at,
+        )
+        for customer_id, segment, r, f, m, last_purchase, count, revenue
+        in zip(customer_ids, segments, r_scores, f_scores, m_scores, last_dates, counts, revenues)
+    ]
+    with transaction.atomic():
+        CustomerSegment.objects.bulk_create(
+            objects,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['customer'],
+            update_fields=SEGMENT_FIELDS,
+        )
+    transaction.on_commit(lambda: versions.bump(CustomerSegment))
+
+    labels, totals = np.unique(segments, return_counts=True)
+    return {str(label): int(total) for label, total in zip(labels, totals)}
@@ -0,0 +1,254 @@
+"""
+Daily sales rollup and time-bucketed revenue reports.
+
+``DailySalesRollup`` holds units, revenue and the purchase count per day,
+product and customer segment (the customer's industry, '' when unset). The
+receivers in ``crm.signals`` apply every purchase insert, edit, delete and
+bulk write to it inside the purchase's own transaction, and move a
+customer's totals between segments when their industry changes.
+``rebuild_rollups`` recomputes any date range from the purchase table, for
+backfills and drift repair.
+
+Changes are applied per batch: the rows they touch are created if missing,
+locked in key order, summed in Python and written back with one
+``bulk_update``, so concurrent writers neither lose each other's deltas nor
+deadlock.
+
+``revenue_report`` rolls the daily rows up to weeks, months or quarters, so
+a two-year chart aggregates at most one row per day, product and segment
+instead of every purchase.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth, TruncQuarter, TruncWeek
+
+from . import sales, versions
+from .models import CustomerInformation, DailySalesRollup, ProductsPurchased
+
+PERIODS = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth, 'quarter': TruncQuarter}
+
+# Columns each report grouping adds to the period
+GROUPS = {
+    'total': [],
+    'product': ['product_id', 'product__name'],
+    'segment': ['segment'],
+}
+
+
+def _segment(industry):
+    return industry or ''
+
+
+# --- Maintenance ---
+def record_purchase_change(previous=None, current=None):
+    """
+    Moves the rollup from the stored ``previous`` version of a purchase to
+    ``current``. Either may be None for inserts and deletes.
+    """
+    segments = _segments([purchase for purchase in (previous, current) if purchase is not None])
+    changes = {}
+    if previous is not None:
+        _add(changes, previous, segments, -1)
+    if current is not None:
+        _add(changes, current, segments, 1)
+    apply_changes(changes)
+
+
+def record_bulk_changes(objects, previous=()):
+    """Applies a batch of inserted or updated purchases, and the stored rows the updates replaced."""
+    segments = _segments([*objects, *previous])
+    changes = {}
+    for purchase in previous:
+        _add(changes, purchase, segments, -1)
+    for purchase in objects:
+        _add(changes, purchase, segments, 1)
+    apply_changes(changes)
+
+
+def move_customer(customer_id, old_industry, new_industry):
+    """Moves a customer's purchases from their old segment to the new one."""
+    move_customers({customer_id: (old_industry, new_industry)})
+
+
+def move_customers(moves):
+    """Applies ``{customer_id: (old_industry, new_industry)}`` with one query and one batch of changes."""
+    segments = {
+        customer_id: (_segment(old_industry), _segment(new_industry))
+        for customer_id, (old_industry, new_industry) in moves.items()
+        if _segment(old_industry) != _segment(new_industry)
+    }
+    if not segments:
+        return
+    changes = {}
+    totals = ProductsPurchased.objects.filter(customer_id__in=segments).values(
+        'customer_id', 'date_of_sale', 'product_id',
+    ).annotate(
+        units=Sum('number_of_products_purchased'), revenue=Sum('amount_spent'), purchases=Count('id'),
+    ).order_by()
+    for row in totals:
+        old, new = segments[row['customer_id']]
+        for segment, sign in ((old, -1), (new, 1)):
+            _accumulate(changes, (row['date_of_sale'], row['product_id'], segment), sign, row['units'], row['revenue'], row['purchases'])
+    apply_changes(changes)
+
+
+def _segments(purchases):
+    """Maps the customers of ``purchases`` to their segments, querying only those not already loaded."""
+    segments = {}
+    for purchase in purchases:
+        # Form and API saves carry the customer; stored rows share its segment unless the purchase moved
+        if ProductsPurchased.customer.is_cached(purchase):
+            segments[purchase.customer_id] = _segment(purchase.customer.industry)
+    missing = {purchase.customer_id for purchase in purchases} - set(segments)
+    if missing:
+        segments.update(
+            (customer_id, _segment(industry))
+            for customer_id, industry in CustomerInformation.objects.filter(pk__in=missing).values_list('pk', 'industry')
+        )
+    return segments
+
+
+def _add(changes, purchase, segments, sign):
+    snapshot = sales.purchase_snapshot(purchase)
+    key = (snapshot['date'], snapshot['product_id'], segments.get(snapshot['customer_id'], ''))
+    _accumulate(changes, key, sign, snapshot['units'], snapshot['amount'], 1)
+
+
+def _accumulate(changes, key, sign, units, revenue, purchases):
+    total = changes.setdefault(key, [0, 0, 0])
+    total[0] += sign * units
+    total[1] += sign * revenue
+    total[2] += sign * purchases
+
+
+def apply_changes(changes):
+    """
+    Adds ``{(date, product_id, segment): [units, revenue, purchases]}`` to the
+    rollup rows and drops rows left without purchases.
+
+    Rows are created and locked in key order, so two writers with
+    overlapping changes wait for each other instead of deadlocking.
+    """
+    keys = sorted(key for key, delta in changes.items() if any(delta))
+    if not keys:
+        return
+    # Only the changed keys are locked, not every combination of their dates, products and segments
+    exact_keys = Q()
+    for date, product_id, segment in keys:
+        exact_keys |= Q(date=date, product_id=product_id, segment=segment)
+    # Part of the caller's transaction when there is one; a failure rolls the write back with it
+    with transaction.atomic(savepoint=False):
+        DailySalesRollup.objects.bulk_create(
+            [DailySalesRollup(date=date, product_id=product_id, segment=segment) for date, product_id, segment in keys],
+            ignore_conflicts=True,
+        )
+        rows = DailySalesRollup.objects.select_for_update().filter(exact_keys).order_by('date', 'product_id', 'segment')
+        changed, emptied = [], []
+        for row in rows:
+            delta = changes[(row.date, row.product_id, row.segment)]
+            row.units += delta[0]
+            row.revenue += delta[1]
+            row.purchases += delta[2]
+            (changed if row.purchases > 0 else emptied).append(row)
+        DailySalesRollup.objects.bulk_update(changed, ['units', 'revenue', 'purchases'])
+        if emptied:
+            DailySalesRollup.objects.filter(pk__in=[row.pk for row in emptied]).delete()
+    transaction.on_commit(lambda: versions.bump(DailySalesRollup))
+
+
+def rebuild_rollups(start=None, end=None, dates=None, batch_size=2000):
+    """
+    Recomputes the rollup for the days from ``start`` to ``end`` (inclusive,
+    open-ended when None) or for the given ``dates``. Returns the number of
+    rows written.
+
+    The existing rows of those days are locked in key order before the
+    purchases are aggregated, so writers applying deltas to them wait for
+    the rebuild instead of being overwritten by it. A purchase whose day,
+    product and segment has no row yet is not covered by the locks; this is
+    meant for backfills and drift repair while bulk writers are paused.
+    """
+    purchases = ProductsPurchased.objects.all()
+    rollups = DailySalesRollup.objects.all()
+    if start is not None:
+        purchases, rollups = purchases.filter(date_of_sale__gte=start), rollups.filter(date__gte=start)
+    if end is not None:
+        purchases, rollups = purchases.filter(date_of_sale__lte=end), rollups.filter(date__lte=end)
+    if dates is not None:
+        purchases, rollups = purchases.filter(date_of_sale__in=dates), rollups.filter(date__in=dates)
+
+    totals = purchases.values('date_of_sale', 'product_id', segment=Coalesce('customer__industry', Value(''))).annotate(
+        units=Sum('number_of_products_purchased'), revenue=Sum('amount_spent'), purchases=Count('id'),
+    ).order_by()
+    with transaction.atomic():
+        list(rollups.select_for_update().order_by('date', 'product_id', 'segment').values_list('pk', flat=True))
+        rows = [
+            DailySalesRollup(
+                date=total['date_of_sale'], product_id=total['product_id'], segment=total['segment'],
+                units=total['units'], revenue=total['revenue'], purchases=total['purchases'],
+            )
+            for total in totals.iterator(chunk_size=batch_size)
+        ]
+        rollups.delete()
+        DailySalesRollup.objects.bulk_create(rows, batch_size=batch_size)
+    transaction.on_commit(lambda: versions.bump(DailySalesRollup))
+    return len(rows)
+
+
+def rebuild_for_customers(customer_ids):
+    """Recomputes the days on which ``customer_ids`` bought anything, e.g. after a bulk upsert of customers."""
+    dates = set(
+        ProductsPurchased.objects.filter(customer_id__in=customer_ids).values_list('date_of_sale', flat=True).distinct()
+    )
+    if dates:
+        rebuild_rollups(dates=dates)
+
+
+# --- Reports ---
+def parse_report_params(data):
+    """
+    Reads ``period``, ``group``, ``start``, ``end``, ``product`` (repeatable)
+    and ``segment`` from a query dict. Raises ValueError for invalid values.
+    """
+    period = data.get('period') or 'month'
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}.")
+    group = data.get('group') or 'total'
+    if group not in GROUPS:
+        raise ValueError(f"group must be one of {', '.join(GROUPS)}.")
+    params = {'period': period, 'group': group}
+    for name in ('start', 'end'):
+        value = data.get(name)
+        try:
+            params[name] = datetime.date.fromisoformat(value) if value else None
+        except ValueError:
+            raise ValueError(f"{name} must be a date (YYYY-MM-DD).")
+    if params['start'] and params['end'] and params['start'] > params['end']:
+        raise ValueError("start must not be after end.")
+    try:
+        params['product_ids'] = [int(value) for value in data.getlist('product') if value] or None
+    except ValueError:
+        raise ValueError("product must be an id.")
+    params['segment'] = data.get('segment') or None
+    return params
+
+
+def revenue_report(period='month', group='total', start=None, end=None, product_ids=None, segment=None):
+    """Returns units, revenue and purchases per ``period`` (and per product or segment), oldest first."""
+    rows = DailySalesRollup.objects.all()
+    if start is not None:
+        rows = rows.filter(date__gte=start)
+    if end is not None:
+        rows = rows.filter(date__lte=end)
+    if product_ids:
+        rows = rows.filter(product_id__in=product_ids)
+    if segment is not None:
+        rows = rows.filter(segment=segment)
+    fields = ['period', *GROUPS[group]]
+    return list(
+        rows.annotate(period=PERIODS[period]('date')).values(*fields).annotate(
+            units=Sum('units'), revenue=Sum('revenue'), purchases=Sum('purchases'),
+        ).order_by(*fields)
+    )
@@ -0,0 +1,134 @@
+"""
+Primary/replica database routing.
+
+Writes always go to the primary (``default``). Reads go to the ``replica``
+alias only while ``ReplicaRoutingMiddleware`` handles a GET or HEAD request
+for a view marked with ``replica_reads`` (lists, detail pages, reports,
+exports). Management commands, signal receivers, background jobs and form
+views keep reading from the primary, so nothing is validated or recomputed
+from lagging data.
+
+A request that writes sets a cookie, and for ``CRM_REPLICA_STICKY_SECONDS``
+after it that user's reads stay on the primary, so they see their own
+changes despite replication lag. Reads inside a transaction on the primary
+stay there as well.
+
+Sessions and the database cache table are read from the primary
+regardless: a session created at login and the version counters in
+``crm.versions`` must never be read stale.
+
+Cached results are keyed by those primary versions, so whatever fills a
+cache reads inside ``primary_reads()``; an entry computed from a lagging
+replica would otherwise be served as current until the next write. What
+cannot be pinned, such as template fragments rendered from the rows a
+view already read, is not stored while ``reading_replica()`` is true.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY = DEFAULT_DB_ALIAS
+REPLICA = 'replica'
+STICKY_COOKIE = 'crm_primary'
+
+# Apps whose tables are always read from the primary, and whose writes do not make a user sticky
+PRIMARY_ONLY_APPS = ('sessions', 'django_cache')
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class RoutingState:
+    """Routing for the request being handled."""
+
+    def __init__(self, replica=False):
+        self.replica = replica
+        self.wrote = False
+
+
+_current_state = ContextVar('crm_routing_state', default=None)
+_force_primary = ContextVar('crm_force_primary', default=False)
+
+
+def replica_reads(view):
+    """Marks a view as read-only, so its GET and HEAD requests may read from the replica."""
+    view.replica_reads = True
+    return view
+
+
+@contextmanager
+def primary_reads():
+    """Sends the reads inside the block to the primary, e.g. to fill a cache keyed by ``crm.versions``."""
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+
+def reading_replica():
+    """True while reads go to the replica, so what is rendered from them must not be cached."""
+    state = _current_state.get()
+    return state is not None and state.replica and not _force_primary.get()
+
+
+def begin_request():
+    """Starts routing a request; returns the token for ``end_request``."""
+    state = RoutingState()
+    return state, _current_state.set(state)
+
+
+def end_request(token):
+    _current_state.reset(token)
+
+
+def route_view(request, view_func):
+    """Sends the request's reads to the replica if the view allows it and the user is not sticky."""
+    state = _current_state.get()
+    if state is not None:
+        state.replica = (
+            request.method in SAFE_METHODS
+            and getattr(view_func, 'replica_reads', False)
+            and STICKY_COOKIE not in request.COOKIES
+        )
+
+
+def with_state(iterator, state):
+    """Iterates a streamed response body under ``state``, after the middleware has returned."""
+    iterator = iter(iterator)
+    while True:
+        token = _current_state.set(state)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _current_state.reset(token)
+        yield chunk
+
+
+class PrimaryReplicaRouter:
+    """Routes reads to the replica for marked views, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if (
+            reading_replica()
+            and model._meta.app_label not in PRIMARY_ONLY_APPS
+            and not connections[PRIMARY].in_atomic_block
+        ):
+            return REPLICA
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _current_state.get()
+        if state is not None and model._meta.app_label not in PRIMARY_ONLY_APPS:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica gets the schema through replication
+        return db != REPLICA
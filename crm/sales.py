@@ -0,0 +1,153 @@
+"""
+Per-product sales summary maintenance.
+
+``ProductSalesSummary`` holds units sold, revenue, first/last sale date and
+distinct buyers for every product. The purchase signal receivers in
+``crm.signals`` apply each insert, edit or delete to it as an ``F()``
+delta inside the purchase's own transaction, so product pages read totals
+from one row instead of aggregating the purchase table. ``rebuild_summaries``
+recomputes the rows from scratch for backfills and drift checks.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from . import versions
+from .models import Product, ProductsPurchased, ProductSalesSummary
+
+
+def purchase_snapshot(purchase):
+    """Returns the fields of ``purchase`` that feed the summary, as the database will store them."""
+    field = ProductsPurchased._meta.get_field
+    return {
+        'product_id': purchase.product_id,
+        'customer_id': purchase.customer_id,
+        'units': field('number_of_products_purchased').to_python(purchase.number_of_products_purchased),
+        'amount': field('amount_spent').to_python(purchase.amount_spent),
+        # The field default is timezone.now, a datetime, until the row is reloaded
+        'date': field('date_of_sale').to_python(purchase.date_of_sale),
+    }
+
+
+def record_purchase_change(purchase_id, previous=None, current=None):
+    """
+    Moves the summaries from ``previous`` to ``current`` for one purchase.
+    Either side may be None for inserts and deletes.
+    """
+    if previous == current:
+        return
+    if previous is not None:
+        _apply(purchase_id, previous, -1)
+    if current is not None:
+        _apply(purchase_id, current, 1)
+
+
+def _apply(purchase_id, snapshot, sign):
+    product_id = snapshot['product_id']
+    others = ProductsPurchased.objects.filter(product_id=product_id).exclude(pk=purchase_id)
+    updates = {
+        'units_sold': F('units_sold') + sign * snapshot['units'],
+        'revenue': F('revenue') + sign * snapshot['amount'],
+    }
+    if sign > 0:
+        if not others.filter(customer_id=snapshot['customer_id']).exists():
+            updates['distinct_buyers'] = F('distinct_buyers') + 1
+        date = Value(snapshot['date'])
+        updates['first_sale_date'] = Least(Coalesce('first_sale_date', date), date)
+        updates['last_sale_date'] = Greatest(Coalesce('last_sale_date', date), date)
+    else:
+        # Removing a sale can move the buyer count and either date bound. They are re-read from
+        # the product's other purchases rather than applied as deltas, which stays correct when a
+        # cascade deletes several rows before their post_delete signals run.
+        buyers = others.order_by().values('product_id').annotate(buyers=Count('customer_id', distinct=True))
+        updates['distinct_buyers'] = Coalesce(Subquery(buyers.values('buyers')), 0)
+        updates['first_sale_date'] = Subquery(others.order_by('date_of_sale').values('date_of_sale')[:1])
+        updates['last_sale_date'] = Subquery(others.order_by('-date_of_sale').values('date_of_sale')[:1])
+
+    summary = ProductSalesSummary.objects.filter(product_id=product_id)
+    if not summary.update(**updates) and sign > 0:
+        # First sale of the product; a concurrent writer may be creating the row too
+        ProductSalesSummary.objects.bulk_create([ProductSalesSummary(product_id=product_id)], ignore_conflicts=True)
+        summary.update(**updates)
+
+
+def record_bulk_inserts(purchases):
+    """
+    Applies a batch of newly inserted purchases, e.g. from ``bulk_create`` or
+    ``COPY``, with one update per product.
+    """
+    totals = {}
+    for purchase in purchases:
+        snapshot = purchase_snapshot(purchase)
+        total = totals.setdefault(snapshot['product_id'], {'units': 0, 'amount': 0, 'dates': [], 'buyers': {}})
+        total['units'] += snapshot['units']
+        total['amount'] += snapshot['amount']
+        total['dates'].append(snapshot['date'])
+        buyers = total['buyers']
+        buyers[snapshot['customer_id']] = buyers.get(snapshot['customer_id'], 0) + 1
+    if not totals:
+        return
+
+    # A buyer is new to a product when all of their purchases of it are in this batch
+    customer_ids = {customer_id for total in totals.values() for customer_id in total['buyers']}
+    stored = ProductsPurchased.objects.filter(product_id__in=totals, customer_id__in=customer_ids).values(
+        'product_id', 'customer_id'
+    ).annotate(purchases=Count('id')).order_by()
+    new_buyers = dict.fromkeys(totals, 0)
+    for row in stored:
+        batch_count = totals[row['product_id']]['buyers'].get(row['customer_id'])
+        if batch_count is not None and row['purchases'] == batch_count:
+            new_buyers[row['product_id']] += 1
+
+    ProductSalesSummary.objects.bulk_create(
+        [ProductSalesSummary(product_id=product_id) for product_id in totals], ignore_conflicts=True
+    )
+    for product_id, total in totals.items():
+        first, last = Value(min(total['dates'])), Value(max(total['dates']))
+        ProductSalesSummary.objects.filter(product_id=product_id).update(
+            units_sold=F('units_sold') + total['units'],
+            revenue=F('revenue') + total['amount'],
+            distinct_buyers=F('distinct_buyers') + new_buyers[product_id],
+            first_sale_date=Least(Coalesce('first_sale_date', first), first),
+            last_sale_date=Greatest(Coalesce('last_sale_date', last), last),
+        )
+
+
+def rebuild_summaries(product_ids=None, batch_size=2000):
+    """Recomputes summaries from ``ProductsPurchased``. Returns the number of rows written."""
+    products = Product.objects.all()
+    purchases = ProductsPurchased.objects.all()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+        purchases = purchases.filter(product_id__in=product_ids)
+
+    totals = {
+        row['product_id']: row
+        for row in purchases.values('product_id').annotate(
+            units_sold=Sum('number_of_products_purchased'),
+            revenue=Sum('amount_spent'),
+            first_sale_date=Min('date_of_sale'),
+            last_sale_date=Max('date_of_sale'),
+            distinct_buyers=Count('customer_id', distinct=True),
+        ).order_by()
+    }
+    summaries = []
+    for product_id in products.values_list('id', flat=True).iterator(chunk_size=batch_size):
+        total = totals.get(product_id, {})
+        summaries.append(ProductSalesSummary(
+            product_id=product_id,
+            units_sold=total.get('units_sold') or 0,
+            revenue=total.get('revenue') or 0,
+            first_sale_date=total.get('first_sale_date'),
+            last_sale_date=total.get('last_sale_date'),
+            distinct_buyers=total.get('distinct_buyers') or 0,
+        ))
+    ProductSalesSummary.objects.bulk_create(
+        summaries,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['units_sold', 'revenue', 'first_sale_date', 'last_sale_date', 'distinct_buyers'],
+    )
+    transaction.on_commit(lambda: versions.bump(ProductSalesSummary))
+    return len(summaries)
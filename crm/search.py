@@ -0,0 +1,144 @@
+"""
+Customer search backend.
+
+Substring search over name and email uses ``icontains``, which Postgres
+renders as ``UPPER(column::text) LIKE UPPER(%term%)``. Migration 0002 adds
+trigram GIN indexes on exactly those expressions, plus one on the normalized
+phone digits, so the same queries are index-backed on Postgres and fall back
+to plain scans on SQLite. Results are ranked exact, then prefix, then
+substring matches, with trigram similarity ordering the substring matches on
+Postgres.
+
+Ranking every match before slicing makes a short term sort its whole match
+set. Fetching the first rows (``search[:n]``, as paginators do for the first
+page) therefore runs one ``LIMIT`` query per tier instead: exact and prefix
+matches come in ``UPPER(name)``/``UPPER(email)`` order straight from the
+btree indexes added in migration 0013, and the similarity-ordered substring
+query only fills what is left. Any other slice, or a queryset re-ordered by
+the caller, runs the single ranked query.
+"""
+from django.db import connections
+from django.db.models import Q, Case, When, Value, IntegerField, FloatField, QuerySet
+from django.db.models.functions import Upper
+
+from .models import CustomerInformation, normalize_phone
+
+# Shorter digit runs match too many phone numbers to be useful
+MIN_PHONE_DIGITS = 3
+
+
+def customer_search_filter(term):
+    """Returns the ``Q`` object matching customers against ``term``."""
+    condition = Q(name__icontains=term) | Q(email__icontains=term)
+    digits = normalize_phone(term)
+    if len(digits) >= MIN_PHONE_DIGITS:
+        condition |= Q(phone_digits__contains=digits)
+    return condition
+
+
+class CustomerSearchQuerySet(QuerySet):
+    """Ranked search results whose first rows are fetched tier by tier."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.search_term = None
+        self.search_ordering = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone.search_term = self.search_term
+        clone.search_ordering = self.search_ordering
+        return clone
+
+    def __getitem__(self, k):
+        if (
+            isinstance(k, slice) and not k.start and k.stop is not None and k.step is None
+            and self._result_cache is None and self.search_term
+            and tuple(self.query.order_by) == self.search_ordering and not self.query.is_sliced
+        ):
+            return self._first_rows(k.stop)
+        return super().__getitem__(k)
+
+    def _first_rows(self, limit):
+        term = self.search_term
+        exact = Q(name__iexact=term) | Q(email__iexact=term)
+        name_prefix = Q(name__istartswith=term)
+        tiers = [
+            _exact_lookup(self, term).order_by(Upper('name'), 'pk'),
+            _prefix_range(self.filter(name_prefix).exclude(exact), 'name', term).order_by(Upper('name'), 'pk'),
+            _prefix_range(
+                self.filter(email__istartswith=term).exclude(exact | name_prefix), 'email', term
+            ).order_by(Upper('email'), 'pk'),
+            self.filter(search_rank=3).order_by(*self.search_ordering),
+        ]
+        rows = []
+        for tier in tiers:
+            if len(rows) >= limit:
+                break
+            rows += QuerySet.__getitem__(tier, slice(0, limit - len(rows)))
+        return rows
+
+
+def _exact_lookup(queryset, term):
+    """Exact matches on name or email, as equality on the ``UPPER()`` indexes where possible."""
+    if not term.isascii():
+        # Python and the database may uppercase other characters differently
+        return queryset.filter(Q(name__iexact=term) | Q(email__iexact=term))
+    upper = term.upper()
+    return queryset.alias(name_upper=Upper('name'), email_upper=Upper('email')).filter(
+        Q(name_upper=upper) | Q(email_upper=upper)
+    )
+
+
+def _prefix_range(queryset, field, term):
+    """
+    Bounds a prefix match to its range of ``UPPER(field)``, so an ordered
+    index scan starts at the first match and stops after the last one.
+    """
+    upper = term.upper()
+    if not upper.isascii():
+        return queryset
+    queryset = queryset.alias(**{f'{field}_upper': Upper(field)}).filter(**{f'{field}_upper__gte': upper})
+    # The bound increments the last letter or digit that has a successor of the same kind ('ABZ' -> 'AC');
+    # punctuation may sort out of code point order under linguistic collations
+    stem = upper.rstrip('Z9')
+    if stem and (stem[-1].isascii() and stem[-1].isalnum()):
+        queryset = queryset.filter(**{f'{field}_upper__lt': stem[:-1] + chr(ord(stem[-1]) + 1)})
+    return queryset
+
+
+def search_customers(term, queryset=None):
+    """Returns customers matching ``term``, best matches first."""
+    if queryset is None:
+        queryset = CustomerInformation.objects.all()
+    term = term.strip()
+    if not term:
+        return queryset.order_by('pk')
+
+    search = CustomerSearchQuerySet(model=queryset.model, query=queryset.query.chain(), using=queryset._db)
+    search = search.filter(customer_search_filter(term)).annotate(
+        search_rank=Case(
+            When(Q(name__iexact=term) | Q(email__iexact=term), then=Value(0)),
+            When(name__istartswith=term, then=Value(1)),
+            When(email__istartswith=term, then=Value(2)),
+            default=Value(3),
+            output_field=IntegerField(),
+        ),
+        # Exact and name prefix matches are listed by name, email prefix matches by email
+        search_key=Case(When(search_rank=2, then=Upper('email')), default=Upper('name')),
+    )
+    ordering = ['search_rank']
+
+    if connections[search.db].vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        # Only substring matches are ordered by similarity
+        search = search.annotate(search_similarity=Case(
+            When(search_rank=3, then=TrigramSimilarity('name', term)), default=Value(0.0), output_field=FloatField(),
+        ))
+        ordering.append('-search_similarity')
+
+    search = search.order_by(*ordering, 'search_key', 'pk')
+    search.search_term = term
+    search.search_ordering = tuple(search.query.order_by)
+    return search
@@ -0,0 +1,324 @@
+"""
+Synthetic CRM dataset generator.
+
+Generates customers, products, purchases, engagements and leads with the
+skew seen in real stores:
+- purchase counts per customer follow a power law, so a few customers
+  account for most orders;
+- product popularity is Zipf-like;
+- sale dates peak around the holidays and in summer, are busier at
+  weekends and grow year on year;
+- engagement levels rise with purchase activity;
+- leads are spread over a stage funnel.
+
+Customers are generated in fixed-size shards, each with its own seeded
+random stream, so the same ``seed`` produces the same rows whatever the
+number of workers. Shards are spread over a process pool and inserted with
+``COPY`` where available (see ``crm.importer``) or ``bulk_create``.
+
+Generated rows are tagged with an email domain (and products with a name
+prefix) so that ``clear`` can remove them again. Derived data (sales
+summaries, KPI counters, caches) is rebuilt once at the end rather than per
+row.
+"""
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.db import connections, transaction
+
+from . import dashboard, funnel, versions
+from .autocomplete import customer_index
+from .importer import copy_available, copy_insert
+from .metrics import reconcile
+from .models import CustomerInformation, Product, ProductsPurchased, Engagement, CustomerLead
+from .rollups import rebuild_rollups
+from .sales import rebuild_summaries
+
+DEFAULT_DOMAIN = 'seed.invalid'
+
+FIRST_NAMES = ['Ava', 'Liam', 'Mia', 'Noah', 'Zoe', 'Ethan', 'Ivy', 'Lucas', 'Nora', 'Owen',
+               'Amara', 'Kenji', 'Sofia', 'Mateo', 'Priya', 'Jonas', 'Leila', 'Diego', 'Hana', 'Felix']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Patel', 'Okafor', 'Novak', 'Rossi', 'Kim', 'Silva', 'Berg',
+              'Nguyen', 'Müller', 'Haddad', 'Kowalski', 'Tanaka', 'Moreau', 'Ivanova', 'Reyes', 'Dubois', 'Olsen']
+INDUSTRIES = ['Retail', 'Finance', 'Healthcare', 'Education', 'Manufacturing', 'Hospitality', 'Technology', None]
+EDUCATION = ['High School', 'Bachelor', 'Master', 'Doctorate', None]
+PRODUCT_ADJECTIVES = ['Classic', 'Deluxe', 'Eco', 'Smart', 'Compact', 'Pro', 'Ultra', 'Travel']
+PRODUCT_NOUNS = ['Kettle', 'Backpack', 'Lamp', 'Headphones', 'Blender', 'Jacket', 'Notebook', 'Speaker', 'Mug', 'Chair']
+
+# Share of leads at each stage of the funnel
+LEAD_FUNNEL = (('Initial Contact', 0.38), ('Qualified', 0.24), ('Negotiation', 0.14), ('Won', 0.14), ('Lost', 0.10))
+ENGAGEMENT_TYPES = ['Call', 'Email', 'Meeting', 'Website Visit']
+ENGAGEMENT_TYPE_SHARES = [0.2, 0.45, 0.1, 0.25]
+
+# Pareto shape for per-customer activity; lower means heavier skew
+ACTIVITY_SHAPE = 1.5
+ACTIVITY_MEAN = ACTIVITY_SHAPE / (ACTIVITY_SHAPE - 1)
+# No single customer gets more than this multiple of the average
+ACTIVITY_CAP = 200
+
+
+def product_prefix(domain):
+    return f"[{domain}] "
+
+
+def seed_dataset(customers, products=500, purchases=None, engagements=None, leads=None, seed=42, years=3,
+                 workers=1, shard_size=20000, batch_size=5000, domain=DEFAULT_DOMAIN, use_copy=None, progress=None):
+    """
+    Generates the dataset and returns the number of rows inserted per model.
+    ``purchases``, ``engagements`` and ``leads`` are totals and default to
+    20, 50 and 0.25 per customer. ``progress`` is called with each finished
+    shard's counts.
+    """
+    if CustomerInformation.objects.filter(email__endswith='@' + domain).exists():
+        raise ValueError(f"Seeded customers (@{domain}) already exist; clear them first.")
+    purchases = customers * 20 if purchases is None else purchases
+    engagements = customers * 50 if engagements is None else engagements
+    leads = customers // 4 if leads is None else leads
+    if use_copy is None:
+        use_copy = copy_available()
+    if connections['default'].vendor == 'sqlite':
+        # SQLite allows one writer at a time
+        workers = 1
+
+    rng = np.random.default_rng([seed, 0])
+    product_rows = _create_products(rng, products, domain, batch_size)
+    end = datetime.date.today()
+    config = {
+        'seed': seed,
+        'domain': domain,
+        'batch_size': batch_size,
+        'use_copy': use_copy,
+        'product_ids': np.array([product_id for product_id, _ in product_rows]),
+        'prices': np.array([float(price) for _, price in product_rows]),
+        'start': end - datetime.timedelta(days=365 * years),
+        'days': 365 * years,
+        'purchases_per_customer': purchases / customers if customers else 0,
+        'engagements_per_customer': engagements / customers if customers else 0,
+        'leads_per_customer': leads / customers if customers else 0,
+    }
+    jobs = [
+        (index, low, min(low + shard_size, customers), config)
+        for index, low in enumerate(range(0, customers, shard_size), start=1)
+    ]
+
+    totals = {'products': len(product_rows), 'customers': 0, 'purchases': 0, 'engagements': 0, 'leads': 0}
+    if workers > 1 and len(jobs) > 1:
+        # Children must open their own connections rather than share ours
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_seed_shard, jobs)
+            _collect(results, totals, progress)
+    else:
+        _collect(map(_seed_shard, jobs), totals, progress)
+
+    refresh_derived_data()
+    return totals
+
+
+def _collect(results, totals, progress):
+    for counts in results:
+        for name, count in counts.items():
+            totals[name] += count
+        if progress:
+            progress(counts)
+
+
+def refresh_derived_data():
+    """Rebuilds what the model signals would have maintained for the inserted rows."""
+    with transaction.atomic():
+        rebuild_summaries()
+        rebuild_rollups()
+        funnel.backfill_transitions()
+        reconcile(persist=False)
+    dashboard.invalidate()
+    customer_index.invalidate()
+    versions.bump()
+
+
+def clear(domain=DEFAULT_DOMAIN):
+    """Removes a generated dataset and rebuilds the derived data."""
+    # Raw deletes skip the per-row signals; refresh_derived_data catches up afterwards
+    with transaction.atomic():
+        _raw_delete_tree(CustomerLead.objects.filter(email__endswith='@' + domain))
+        _raw_delete_tree(CustomerInformation.objects.filter(email__endswith='@' + domain))
+        _raw_delete_tree(Product.objects.filter(name__startswith=product_prefix(domain)))
+    refresh_derived_data()
+
+
+def _raw_delete_tree(queryset):
+    """Deletes ``queryset`` and, first, every row that references it, without loading any of them."""
+    for relation in queryset.model._meta.related_objects:
+        # Reverse foreign keys only; many-to-many rows are not owned by either side
+        if relation.one_to_many or relation.one_to_one:
+            _raw_delete_tree(relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': queryset}))
+    queryset._raw_delete(queryset.db)
+
+
+def _create_products(rng, count, domain, batch_size):
+    prices = np.round(np.exp(rng.normal(3.4, 0.9, count)), 2).clip(1, 5000)
+    products = [
+        Product(
+            name=f"{product_prefix(domain)}{PRODUCT_ADJECTIVES[i % len(PRODUCT_ADJECTIVES)]} "
+                 f"{PRODUCT_NOUNS[(i // len(PRODUCT_ADJECTIVES)) % len(PRODUCT_NOUNS)]} {i}",
+            price=f"{prices[i]:.2f}",
+        )
+        for i in range(count)
+    ]
+    Product.objects.bulk_create(products, batch_size=batch_size)
+    return list(
+        Product.objects.filter(name__startswith=product_prefix(domain)).order_by('id').values_list('id', 'price')
+    )
+
+
+def _day_weights(start, days):
+    """Relative likelihood of a sale on each day: holiday and summer peaks, busier weekends, yearly growth."""
+    dates = [start + datetime.timedelta(days=offset) for offset in range(days)]
+    day_of_year = np.array([date.timetuple().tm_yday for date in dates])
+    weekend = np.array([date.weekday() >= 5 for date in dates])
+    weights = (
+        1
+        + 1.2 * np.exp(-((day_of_year - 335) / 18.0) ** 2)
+        + 0.4 * np.exp(-((day_of_year - 190) / 30.0) ** 2)
+    )
+    weights *= np.where(weekend, 1.25, 1.0)
+    weights *= 1 + 0.3 * np.arange(days) / 365
+    return weights / weights.sum()
+
+
+def _insert(model, objects, config):
+    if config['use_copy']:
+        copy_insert(model, objects)
+    else:
+        model.objects.bulk_create(objects, batch_size=config['batch_size'])
+
+
+def _seed_shard(job):
+    index, low, high, config = job
+    rng = np.random.default_rng([config['seed'], index])
+    size = high - low
+    batch_size = config['batch_size']
+
+    customers = _build_customers(rng, low, high, config['domain'])
+    for start in range(0, size, batch_size):
+        # bulk_create rather than COPY: purchases and engagements need the new ids
+        CustomerInformation.objects.bulk_create(customers[start:start + batch_size])
+    customer_ids = np.array([customer.pk for customer in customers])
+
+    activity = np.minimum(rng.pareto(ACTIVITY_SHAPE, size) + 1, ACTIVITY_MEAN * ACTIVITY_CAP)
+    relative_activity = activity / ACTIVITY_MEAN
+    day_weights = _day_weights(config['start'], config['days'])
+
+    purchase_counts = rng.poisson(config['purchases_per_customer'] * relative_activity)
+    purchases = _generate_purchases(rng, customer_ids, purchase_counts, day_weights, config)
+    # Engaged customers buy more, but activity drives engagement less than it drives purchases
+    engagement_counts = rng.poisson(config['engagements_per_customer'] * (0.5 + 0.5 * relative_activity))
+    engagements = _generate_engagements(rng, customer_ids, engagement_counts, relative_activity, day_weights, config)
+    lead_count = rng.poisson(config['leads_per_customer'] * size)
+    _insert(CustomerLead, _build_leads(rng, index, lead_count, customer_ids, config['domain']), config)
+
+    return {'customers': size, 'purchases': purchases, 'engagements': engagements, 'leads': lead_count}
+
+
+def _build_customers(rng, low, high, domain):
+    size = high - low
+    first = rng.integers(len(FIRST_NAMES), size=size)
+    last = rng.integers(len(LAST_NAMES), size=size)
+    industry = rng.integers(len(INDUSTRIES), size=size)
+    education = rng.integers(len(EDUCATION), size=size)
+    company = rng.zipf(1.6, size=size)
+    income = np.round(np.exp(rng.normal(10.9, 0.5, size)), -2).clip(0, 99999999)
+    phones = rng.integers(10 ** 9, 10 ** 10, size=size)
+    customers = []
+    for offset, number in enumerate(range(low, high)):
+        first_name, last_name = FIRST_NAMES[first[offset]], LAST_NAMES[last[offset]]
+        phone = str(phones[offset])
+        customers.append(CustomerInformation(
+            name=f"{first_name} {last_name}",
+            email=f"{first_name}.{last_name}.{number}@{domain}".lower(),
+            phone=f"{phone[:3]}-{phone[3:6]}-{phone[6:]}",
+            phone_digits=phone,
+            industry=INDUSTRIES[industry[offset]],
+            company=f"Company {company[offset]}" if company[offset] < 5000 else None,
+            education=EDUCATION[education[offset]],
+            income=f"{income[offset]:.2f}",
+        ))
+    return customers
+
+
+def _generate_purchases(rng, customer_ids, counts, day_weights, config):
+    total = int(counts.sum())
+    batch_size = config['batch_size']
+    owners = np.repeat(customer_ids, counts)
+    rank = np.arange(1, len(config['product_ids']) + 1)
+    popularity = 1 / rank ** 1.1
+    popularity /= popularity.sum()
+
+    for start in range(0, total, batch_size):
+        size = min(batch_size, total - start)
+        products = rng.choice(len(popularity), size=size, p=popularity)
+        days = rng.choice(len(day_weights), size=size, p=day_weights)
+        units = rng.geometric(0.6, size=size)
+        discount = rng.choice([0, 0.05, 0.1, 0.2], size=size, p=[0.7, 0.15, 0.1, 0.05])
+        amounts = np.round(config['prices'][products] * units * (1 - discount), 2)
+        _insert(ProductsPurchased, [
+            ProductsPurchased(
+                customer_id=int(owners[start + offset]),
+                product_id=int(config['product_ids'][products[offset]]),
+                number_of_products_purchased=int(units[offset]),
+                date_of_sale=config['start'] + datetime.timedelta(days=int(days[offset])),
+                amount_spent=f"{amounts[offset]:.2f}",
+            )
+            for offset in range(size)
+        ], config)
+    return total
+
+
+def _generate_engagements(rng, customer_ids, counts, relative_activity, day_weights, config):
+    total = int(counts.sum())
+    batch_size = config['batch_size']
+    owners = np.repeat(np.arange(len(customer_ids)), counts)
+    midnight = datetime.datetime.combine(config['start'], datetime.time.min, tzinfo=datetime.timezone.utc)
+    # Chance that an engagement is High rises with the customer's activity
+    high_share = np.clip(0.15 + 0.1 * np.log(relative_activity), 0.05, 0.6)
+
+    for start in range(0, total, batch_size):
+        size = min(batch_size, total - start)
+        batch_owners = owners[start:start + size]
+        days = rng.choice(len(day_weights), size=size, p=day_weights)
+        seconds = rng.integers(8 * 3600, 20 * 3600, size=size)
+        draw = rng.random(size)
+        high = high_share[batch_owners]
+        levels = np.where(draw < high, 'High', np.where(draw < high + 0.4, 'Medium', 'Low'))
+        types = rng.choice(len(ENGAGEMENT_TYPES), size=size, p=ENGAGEMENT_TYPE_SHARES)
+        _insert(Engagement, [
+            Engagement(
+                customer_id=int(customer_ids[batch_owners[offset]]),
+                level_of_engagement=str(levels[offset]),
+                type_of_engagement=ENGAGEMENT_TYPES[types[offset]],
+                engagement_date=midnight + datetime.timedelta(days=int(days[offset]), seconds=int(seconds[offset])),
+            )
+            for offset in range(size)
+        ], config)
+    return total
+
+
+def _build_leads(rng, shard, count, customer_ids, domain):
+    stages = [stage for stage, _ in LEAD_FUNNEL]
+    stage_index = rng.choice(len(stages), size=count, p=[share for _, share in LEAD_FUNNEL])
+    linked = rng.random(count) < 0.85
+    owners = rng.integers(len(customer_ids), size=count) if len(customer_ids) else np.zeros(count, dtype=int)
+    likelihood = np.clip(rng.normal(15 + 20 * stage_index, 10), 0, 100)
+    leads = []
+    for offset in range(count):
+        stage = stages[stage_index[offset]]
+        is_linked = linked[offset] and len(customer_ids)
+        leads.append(CustomerLead(
+            customer_id=int(customer_ids[owners[offset]]) if is_linked else None,
+            name=None if is_linked else f"Prospect {shard}-{offset}",
+            email=None if is_linked else f"prospect.{shard}.{offset}@{domain}",
+            status='Closed' if stage in ('Won', 'Lost') else 'Open',
+            likelihood_to_convert=f"{100 if stage == 'Won' else 0 if stage == 'Lost' else likelihood[offset]:.2f}",
+            lead_stage=stage,
+        ))
+    return leads
@@ -0,0 +1,221 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import Signal
+
+from . import dashboard, detail_cache, funnel, metrics, rollups, sales, versions
+from .autocomplete import customer_index
+from .models import CustomerInformation, ProductsPurchased, CustomerLead, Engagement, LifetimeValue
+
+# Sent by bulk writers (bulk_create, bulk_update, COPY) that bypass the model
+# signals, once per batch with ``sender`` the model, ``objects`` the written
+# instances and ``created`` True when every object was a fresh insert.
+# Writers that know the stored rows they overwrote pass them as ``previous``.
+bulk_saved = Signal()
+
+
+# --- Dashboard Snapshot ---
+def invalidate_dashboard(sender, **kwargs):
+    """Drops the dashboard sections rendered from ``sender`` once the write commits."""
+    sections = dashboard.SECTION_DEPENDENCIES[sender]
+    transaction.on_commit(lambda: dashboard.invalidate(*sections))
+
+
+for model in dashboard.SECTION_DEPENDENCIES:
+    post_save.connect(invalidate_dashboard, sender=model, dispatch_uid=f'dashboard_save_{model.__name__}')
+    post_delete.connect(invalidate_dashboard, sender=model, dispatch_uid=f'dashboard_delete_{model.__name__}')
+    bulk_saved.connect(invalidate_dashboard, sender=model, dispatch_uid=f'dashboard_bulk_{model.__name__}')
+
+
+# --- Fragment Cache Versions ---
+def bump_model_version(sender, **kwargs):
+    """Moves cached fragments rendered from ``sender`` to fresh keys once the write commits."""
+    transaction.on_commit(lambda: versions.bump(sender))
+
+
+for model in versions.TRACKED_MODELS:
+    post_save.connect(bump_model_version, sender=model, dispatch_uid=f'version_save_{model.__name__}')
+    post_delete.connect(bump_model_version, sender=model, dispatch_uid=f'version_delete_{model.__name__}')
+    bulk_saved.connect(bump_model_version, sender=model, dispatch_uid=f'version_bulk_{model.__name__}')
+
+
+# --- Customer Autocomplete Index ---
+def update_autocomplete_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: customer_index.update(instance))
+
+
+def remove_from_autocomplete_index(sender, instance, **kwargs):
+    customer_id = instance.pk
+    transaction.on_commit(lambda: customer_index.remove(customer_id))
+
+
+def invalidate_autocomplete_index(sender, **kwargs):
+    transaction.on_commit(customer_index.invalidate)
+
+
+post_save.connect(update_autocomplete_index, sender=CustomerInformation, dispatch_uid='autocomplete_save')
+post_delete.connect(remove_from_autocomplete_index, sender=CustomerInformation, dispatch_uid='autocomplete_delete')
+bulk_saved.connect(invalidate_autocomplete_index, sender=CustomerInformation, dispatch_uid='autocomplete_bulk')
+
+
+# --- Stored Rows ---
+def remember_stored_row(sender, instance, raw=False, **kwargs):
+    """Keeps the stored version of an edited row so post_save receivers can apply the difference."""
+    instance._stored_row = None
+    if not raw and instance.pk is not None:
+        instance._stored_row = sender.objects.filter(pk=instance.pk).first()
+
+
+for model in (CustomerInformation, ProductsPurchased, CustomerLead, Engagement, LifetimeValue):
+    pre_save.connect(remember_stored_row, sender=model, dispatch_uid=f'stored_row_{model.__name__}')
+
+
+# --- Customer Detail Aggregates ---
+def invalidate_customer_aggregates(sender, instance, **kwargs):
+    customer_ids = {instance.customer_id}
+    stored = getattr(instance, '_stored_row', None)
+    if stored is not None:
+        # A row moved to another customer changes both
+        customer_ids.add(stored.customer_id)
+    transaction.on_commit(lambda: detail_cache.invalidate_customers(customer_ids))
+
+
+def invalidate_customer_aggregates_bulk(sender, objects, previous=(), **kwargs):
+    customer_ids = {obj.customer_id for obj in [*objects, *previous]}
+    transaction.on_commit(lambda: detail_cache.invalidate_customers(customer_ids))
+
+
+for model in detail_cache.CUSTOMER_DEPENDENCIES:
+    post_save.connect(invalidate_customer_aggregates, sender=model, dispatch_uid=f'detail_save_{model.__name__}')
+    post_delete.connect(invalidate_customer_aggregates, sender=model, dispatch_uid=f'detail_delete_{model.__name__}')
+    bulk_saved.connect(invalidate_customer_aggregates_bulk, sender=model, dispatch_uid=f'detail_bulk_{model.__name__}')
+
+
+# --- Product Sales Summary ---
+def apply_purchase_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    stored = getattr(instance, '_stored_row', None)
+    previous = sales.purchase_snapshot(stored) if stored is not None else None
+    sales.record_purchase_change(instance.pk, previous, sales.purchase_snapshot(instance))
+
+
+def apply_purchase_delete(sender, instance, **kwargs):
+    sales.record_purchase_change(instance.pk, sales.purchase_snapshot(instance), None)
+
+
+def apply_purchase_bulk_save(sender, objects, created=False, previous=(), **kwargs):
+    if created:
+        sales.record_bulk_inserts(objects)
+    else:
+        sales.rebuild_summaries({purchase.product_id for purchase in [*objects, *previous]})
+
+
+post_save.connect(apply_purchase_save, sender=ProductsPurchased, dispatch_uid='sales_summary_save')
+post_delete.connect(apply_purchase_delete, sender=ProductsPurchased, dispatch_uid='sales_summary_delete')
+bulk_saved.connect(apply_purchase_bulk_save, sender=ProductsPurchased, dispatch_uid='sales_summary_bulk')
+
+
+# --- Daily Sales Rollup ---
+def apply_rollup_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rollups.record_purchase_change(getattr(instance, '_stored_row', None), instance)
+
+
+def apply_rollup_delete(sender, instance, **kwargs):
+    rollups.record_purchase_change(previous=instance)
+
+
+def apply_rollup_bulk_save(sender, objects, created=False, previous=(), **kwargs):
+    if created or previous:
+        rollups.record_bulk_changes(objects, previous)
+    else:
+        # Without the stored rows only the days the purchases are on now can be recomputed
+        rollups.rebuild_rollups(dates={sales.purchase_snapshot(purchase)['date'] for purchase in objects})
+
+
+def move_customer_rollups(sender, instance, raw=False, **kwargs):
+    stored = getattr(instance, '_stored_row', None)
+    if not raw and stored is not None:
+        rollups.move_customer(instance.pk, stored.industry, instance.industry)
+
+
+def move_customer_rollups_bulk(sender, objects, created=False, previous=(), **kwargs):
+    # New customers have no purchases yet
+    if created:
+        return
+    if previous:
+        stored_industries = {customer.pk: customer.industry for customer in previous}
+        rollups.move_customers({
+            customer.pk: (stored_industries[customer.pk], customer.industry)
+            for customer in objects if customer.pk in stored_industries
+        })
+    else:
+        # Without the stored rows the old segments are unknown
+        rollups.rebuild_for_customers([customer.pk for customer in objects])
+
+
+post_save.connect(apply_rollup_save, sender=ProductsPurchased, dispatch_uid='rollup_save')
+post_delete.connect(apply_rollup_delete, sender=ProductsPurchased, dispatch_uid='rollup_delete')
+bulk_saved.connect(apply_rollup_bulk_save, sender=ProductsPurchased, dispatch_uid='rollup_bulk')
+post_save.connect(move_customer_rollups, sender=CustomerInformation, dispatch_uid='rollup_customer_save')
+bulk_saved.connect(move_customer_rollups_bulk, sender=CustomerInformation, dispatch_uid='rollup_customer_bulk')
+
+
+# --- Lead Stage History ---
+def record_lead_stage(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    stored = getattr(instance, '_stored_row', None)
+    funnel.record_stage_changes([instance], {} if stored is None else {stored.pk: stored.lead_stage})
+
+
+def record_lead_stages_bulk(sender, objects, created=False, previous=(), **kwargs):
+    if created:
+        stored_stages = {}
+    elif previous:
+        stored_stages = {lead.pk: lead.lead_stage for lead in previous}
+    else:
+        # Upserts carry no stored rows; compare with the recorded history instead
+        stored_stages = None
+    funnel.record_stage_changes(objects, stored_stages)
+
+
+def invalidate_funnel(sender, **kwargs):
+    # The lead's history is deleted with it, without signals of its own
+    transaction.on_commit(funnel.invalidate)
+
+
+post_save.connect(record_lead_stage, sender=CustomerLead, dispatch_uid='stage_history_save')
+bulk_saved.connect(record_lead_stages_bulk, sender=CustomerLead, dispatch_uid='stage_history_bulk')
+post_delete.connect(invalidate_funnel, sender=CustomerLead, dispatch_uid='stage_history_delete')
+
+
+# --- KPI Counters ---
+def apply_counter_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if sender is CustomerInformation:
+        previous = None if created else instance
+    else:
+        previous = getattr(instance, '_stored_row', None)
+    metrics.record_change(sender, previous, instance)
+
+
+def apply_counter_delete(sender, instance, **kwargs):
+    metrics.record_change(sender, instance, None)
+
+
+def apply_counter_bulk_save(sender, objects, created=False, previous=(), **kwargs):
+    if created:
+        metrics.record_bulk_inserts(sender, objects)
+    elif previous:
+        metrics.record_bulk_changes(sender, objects, previous)
+    else:
+        # Without the stored rows there is nothing to subtract
+        metrics.reconcile(metrics.COUNTERS_BY_MODEL[sender], persist=False)
+
+
+for model in metrics.CONTRIBUTIONS:
+    post_save.connect(apply_counter_save, sender=model, dispatch_uid=f'kpi_counters_save_{model.__name__}')
+    post_delete.connect(apply_counter_delete, sender=model, dispatch_uid=f'kpi_counters_delete_{model.__name__}')
+    bulk_saved.connect(apply_counter_bulk_save, sender=model, dispatch_uid=f'kpi_counters_bulk_{model.__name__}')
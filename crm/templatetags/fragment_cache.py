@@ -0,0 +1,19 @@
+# crm/templatetags/fragment_cache.py
+from django import template
+from django.apps import apps
+
+from crm import versions
+
+register = template.Library()
+
+
+@register.simple_tag
+def model_version(*labels):
+    """Combined version of the named models, for {% cache %} keys: {% model_version 'crm.Product' as version %}"""
+    return versions.version_key(*[apps.get_model(label) for label in labels])
+
+
+@register.filter(name='page_key')
+def page_key(rows):
+    """Identifies a page by the primary keys of its rows, in order."""
+    return ','.join(str(row.pk) for row in rows)
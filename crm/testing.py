@@ -0,0 +1,50 @@
+"""
+Test helpers for keeping query counts in check.
+
+``query_budget`` fails when the wrapped block runs more queries than it is
+allowed, listing the SQL so the offending loop is easy to spot. It works as
+a context manager or as a decorator:
+
+    with query_budget(5):
+        client.get(url)
+
+    @query_budget(3)
+    def test_something(self):
+        ...
+"""
+from contextlib import ContextDecorator
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class query_budget(ContextDecorator):
+    """Fails when the wrapped block runs more than ``limit`` queries."""
+
+    def __init__(self, limit, using='default', label=None):
+        self.limit = limit
+        self.using = using
+        self.label = label
+
+    def __enter__(self):
+        self.context = CaptureQueriesContext(connections[self.using])
+        self.context.__enter__()
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        executed = len(self.context)
+        if executed > self.limit:
+            queries = '\n'.join(
+                f'{number}. {query["sql"]}' for number, query in enumerate(self.context.captured_queries, start=1)
+            )
+            raise QueryBudgetExceeded(
+                f"{self.label or 'Block'} ran {executed} queries, budget is {self.limit}:\n{queries}"
+            )
+        return False
@@ -1,8 +1,49 @@
-from django.test import TestCase
-from django.urls import reverse
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+from inspect import iscoroutine
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connections, transaction
+from django.http import Http404
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse, URLPattern
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from . import dashboard
+from .search import search_customers
+from .autocomplete import VERSION_CHECK_INTERVAL, customer_index
+from .pagination import CursorPaginator
+from .testing import query_budget
+from .churn import score_customers
+from .lifetime_value import WATERMARK_OVERLAP, recompute_lifetime_values
+from .lead_scoring import WATERMARK_OVERLAP as LEAD_WATERMARK_OVERLAP, score_leads
+from .rfm import label_segments, quantile_scores, segment_customers
+from .importer import CustomerImporter
+from .rollups import rebuild_rollups, revenue_report
+from .sales import rebuild_summaries
+from .metrics import increment, reconcile
+from . import detail_cache, funnel, ingest, seed, versions
+from .conditional import row_state
+from .routers import PrimaryReplicaRouter, STICKY_COOKIE, begin_request, end_request
+from .signals import bulk_saved
+from .views import (
+    AsyncCustomerDetailView, AsyncDashboardView, CustomerDetailView, DashboardView, customer_autocomplete_async
+)
+from . import urls as crm_urls
 from .models import (
-    CustomerInformation, Product, ProductsPurchased, CustomerLead, Engagement, LifetimeValue, InternalServices
+    User, CustomerInformation, CustomerChurnScore, CustomDescriptionField, Product, ProductsPurchased, ProductSalesSummary, CustomerLead, Engagement, LifetimeValue, InternalServices,
+    MetricCounter, DailySalesRollup, LeadStageTransition, CustomerSegment, JobCheckpoint
 )
 
 class CustomerInformationTestCase(TestCase):
@@ -192,3 +233,1703 @@ class InternalServicesTestCase(TestCase):
 
     def test_projected_revenue(self):
         self.assertEqual(self.internal_services.projected_revenue, 600000.00)
+
+
+class DashboardSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username="rep", password="password"))
+        self.customer = CustomerInformation.objects.create(
+            name="Dashboard Customer",
+            email="dashboard@example.com",
+            phone="5551234567",
+        )
+        self.product = Product.objects.create(name="Dashboard Product", price=10.00)
+
+    def test_default_dashboard_served_from_snapshot(self):
+        self.client.get(reverse('dashboard'))
+        # Only the session and user lookups remain once the snapshot is warm
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, "Dashboard Customer")
+        self.assertContains(response, "Dashboard Product")
+
+    def test_write_invalidates_only_touched_sections(self):
+        dashboard.get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="New Product", price=5.00)
+        cached = cache.get_many([dashboard.CACHE_PREFIX + section for section in dashboard.SECTIONS])
+        self.assertNotIn(dashboard.CACHE_PREFIX + 'products', cached)
+        self.assertIn(dashboard.CACHE_PREFIX + 'customers', cached)
+        self.assertIn(dashboard.CACHE_PREFIX + 'kpis', cached)
+
+    def test_snapshot_reflects_committed_writes(self):
+        self.client.get(reverse('dashboard'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.name = "Renamed Customer"
+            self.customer.save()
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, "Renamed Customer")
+
+    def test_search_bypasses_snapshot(self):
+        CustomerInformation.objects.create(name="Other Person", email="other@example.com")
+        response = self.client.get(reverse('dashboard'), {'customer_search': 'Other'})
+        self.assertContains(response, "Other Person")
+        self.assertNotContains(response, "Dashboard Customer")
+
+
+class CustomerSearchTestCase(TestCase):
+
+    def setUp(self):
+        self.exact = CustomerInformation.objects.create(name="Ann", email="ann@example.com", phone="(555) 010-2000")
+        self.prefix = CustomerInformation.objects.create(name="Annabel Lee", email="lee@example.com")
+        self.substring = CustomerInformation.objects.create(name="Joanne Roe", email="roe@example.com")
+        CustomerInformation.objects.create(name="Unrelated", email="other@example.com", phone="555 999 1234")
+
+    def test_phone_digits_normalized_on_save(self):
+        self.assertEqual(self.exact.phone_digits, "5550102000")
+
+    def test_results_ranked_exact_prefix_substring(self):
+        self.assertEqual(list(search_customers("ann")), [self.exact, self.prefix, self.substring])
+
+    def test_phone_search_ignores_formatting(self):
+        self.assertEqual(list(search_customers("555-010-2000")), [self.exact])
+
+    def test_blank_search_returns_all(self):
+        self.assertEqual(search_customers("  ").count(), 4)
+
+    def test_first_rows_are_fetched_per_tier_in_ranked_order(self):
+        more = [CustomerInformation.objects.create(name=f"Ann {i}", email=f"ann{i}@example.com") for i in range(3)]
+        ranked = list(search_customers("ann"))
+        self.assertEqual(ranked[:5], [self.exact, more[0], more[1], more[2], self.prefix])
+        # Exact and name prefix tiers fill the first rows; the substring query is never run
+        with self.assertNumQueries(2):
+            self.assertEqual(search_customers("ann")[:5], ranked[:5])
+        self.assertEqual(search_customers("ann")[:10], ranked)
+        # A caller's own ordering runs the single query
+        with self.assertNumQueries(1):
+            list(search_customers("ann").order_by('-pk')[:2])
+
+
+class CustomerAutocompleteTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        customer_index.clear()
+        self.jordan = CustomerInformation.objects.create(name="Jordan Price", email="jp@example.com", company="Acme")
+        self.ajo = CustomerInformation.objects.create(name="Ajo Banks", email="ajo@example.com")
+
+    def search(self, term):
+        response = self.client.get(reverse('customer_autocomplete'), {'term': term})
+        return [customer['id'] for customer in response.json()]
+
+    def test_prefix_matches_rank_before_substring(self):
+        self.assertEqual(self.search("jo"), [self.jordan.pk, self.ajo.pk])
+
+    def test_matches_name_words_email_and_company(self):
+        self.assertEqual(self.search("price"), [self.jordan.pk])
+        self.assertEqual(self.search("ajo@"), [self.ajo.pk])
+        self.assertEqual(self.search("acme"), [self.jordan.pk])
+
+    def test_lookups_do_not_query_database_once_built(self):
+        self.search("jo")
+        with self.assertNumQueries(0):
+            customer_index.search("banks")
+
+    def test_index_follows_saves_and_deletes(self):
+        self.search("jo")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jordan.name = "Morgan Price"
+            self.jordan.save()
+            self.ajo.delete()
+        self.assertEqual(self.search("jo"), [])
+        self.assertEqual(self.search("morgan"), [self.jordan.pk])
+        # The writer's own version bumps need no re-read once the check interval passes
+        customer_index._checked_at -= VERSION_CHECK_INTERVAL
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(self.search("morgan"), [self.jordan.pk])
+        self.assertFalse([query for query in queries if 'crm_customerinformation' in query['sql']])
+
+    def test_writes_by_other_processes_are_synced_after_the_check_interval(self):
+        self.search("jo")
+        # Another process renames one customer and adds one without this process's signals seeing it
+        CustomerInformation.objects.filter(pk=self.ajo.pk).update(name="Zed Banks", updated_at=timezone.now())
+        added, = CustomerInformation.objects.bulk_create([CustomerInformation(name="Zelda", email="zelda@example.com")])
+        # Its delete's on_commit callbacks never run here, as if it happened elsewhere
+        self.jordan.delete()
+        cache.set(versions.CACHE_PREFIX + 'crm.customerinformation', time.time_ns(), timeout=None)
+        self.assertEqual(self.search("ze"), [])
+        customer_index._checked_at -= VERSION_CHECK_INTERVAL
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(self.search("ze"), [self.ajo.pk, added.pk])
+            self.assertEqual(self.search("jordan"), [])
+        # Applied as a delta: only customers changed since the last sync were read
+        self.assertTrue(any('"updated_at" >=' in query['sql'] for query in queries))
+
+class CursorPaginationTestCase(TestCase):
+
+    def setUp(self):
+        self.customer = CustomerInformation.objects.create(name="Cursor Customer", email="cursor@example.com")
+        day = timezone.now()
+        # Pairs of engagements share a timestamp so the pk tie-breaker matters
+        self.engagements = [
+            Engagement.objects.create(
+                customer=self.customer,
+                level_of_engagement="Low",
+                type_of_engagement="Call",
+                engagement_date=day - timezone.timedelta(days=i // 2),
+            )
+            for i in range(25)
+        ]
+        self.expected = sorted(self.engagements, key=lambda e: (e.engagement_date, e.pk), reverse=True)
+
+    def test_walks_forward_and_back_without_gaps(self):
+        paginator = CursorPaginator(Engagement.objects.order_by('-engagement_date'), 10)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_page_number()))
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        self.assertEqual([e for page in pages for e in page], self.expected)
+
+        previous = paginator.page(pages[-1].previous_page_number())
+        self.assertEqual(list(previous), list(pages[1]))
+        self.assertEqual(previous.number, 2)
+        self.assertTrue(previous.has_previous())
+
+    def test_deep_pages_do_not_count(self):
+        paginator = CursorPaginator(Engagement.objects.order_by('-engagement_date'), 10)
+        token = paginator.page().next_page_number()
+        with self.assertNumQueries(1):
+            page = paginator.page(token)
+            list(page)
+
+    def test_invalid_token_falls_back_to_first_page(self):
+        paginator = CursorPaginator(Engagement.objects.order_by('-engagement_date'), 10)
+        self.assertEqual(paginator.get_page("not-a-cursor").number, 1)
+
+    @override_settings(CRM_CURSOR_PAGINATION=True)
+    def test_list_view_next_link_uses_cursor(self):
+        self.client.force_login(User.objects.create_user(username="rep", password="password"))
+        response = self.client.get(reverse('engagement_list'))
+        page_obj = response.context['page_obj']
+        self.assertTrue(page_obj.has_next())
+        response = self.client.get(reverse('engagement_list'), {'page': page_obj.next_page_number()})
+        self.assertEqual(list(response.context['engagements']), self.expected[10:20])
+
+
+# Allowed queries per GET of each crm route, the same at 10 and at 1,000 rows.
+# Pages that render the sidebar include the session and user lookups (2).
+URL_QUERY_BUDGETS = {
+    'index': 0,
+    'internal': 4,
+    'internal_services_edit': 3,
+    'dashboard': 12,
+    'customer_list': 4,
+    'customer_add': 2,
+    'customer_detail': 9,
+    'customer_edit': 4,
+    'customer_delete': 3,
+    'customer_autocomplete': 1,
+    'product_list': 6,
+    'product_add': 2,
+    'product_detail': 4,
+    'product_edit': 3,
+    'product_delete': 3,
+    'lead_list': 4,
+    'lead_add': 2,
+    'lead_detail': 5,
+    'lead_edit': 3,
+    'lead_delete': 3,
+    'engagement_list': 4,
+    'engagement_add': 3,
+    'engagement_detail': 4,
+    'engagement_edit': 4,
+    'engagement_delete': 3,
+    'products_purchased_add': 4,
+    'products_purchased_edit': 5,
+    'products_purchased_delete': 3,
+    'products_purchased_detail': 3,
+    'export': 3,
+    'api_records': 3,
+    'revenue_report': 3,
+    'funnel_report': 3,
+    'revenue_report_api': 3,
+    'engagement_ingest': 2,
+    'login': 0,
+    'logout': 4,
+    'signup': 0,
+    'view_account': 2,
+    'edit_account': 4,
+}
+
+
+class QueryBudgetTestCase(TestCase):
+    """Fails when a route's query count grows with the number of rows (N+1)."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="budget", password="password")
+        InternalServices.objects.create(current_revenue=1000, internal_churn_rate=2)
+        self.rows = 0
+
+    def populate(self, rows):
+        """Tops every table up to ``rows`` rows, all linked to each other."""
+        new = range(self.rows, rows)
+        customers = CustomerInformation.objects.bulk_create(
+            CustomerInformation(name=f"Customer {i}", email=f"customer{i}@example.com") for i in new
+        )
+        products = Product.objects.bulk_create(Product(name=f"Product {i}", price=Decimal("9.99")) for i in new)
+        CustomerLead.objects.bulk_create(
+            CustomerLead(customer=customer, status="Open", likelihood_to_convert=50, lead_stage="Qualified")
+            for customer in customers
+        )
+        Engagement.objects.bulk_create(
+            Engagement(customer=customer, level_of_engagement="High", type_of_engagement="Call")
+            for customer in customers
+        )
+        ProductsPurchased.objects.bulk_create(
+            ProductsPurchased(customer=customer, product=product, number_of_products_purchased=1, amount_spent=Decimal("9.99"))
+            for customer, product in zip(customers, products)
+        )
+        for customer in customers:
+            customer.customdescriptionfield_set.create(description="Notes")
+        LifetimeValue.objects.bulk_create(LifetimeValue(customer=customer, lifetime_value=100) for customer in customers)
+        rebuild_summaries()
+        self.rows = rows
+
+    def route_kwargs(self, pattern):
+        objects = {
+            'customer': CustomerInformation, 'product': Product, 'lead': CustomerLead,
+            'engagement': Engagement, 'products_purchased': ProductsPurchased,
+        }
+        kwargs = {}
+        if 'pk' in pattern.pattern.converters:
+            model = objects[pattern.name.rsplit('_', 1)[0]]
+            kwargs['pk'] = model.objects.order_by('pk').values_list('pk', flat=True).last()
+        if 'metric' in pattern.pattern.converters:
+            kwargs['metric'] = 'projected_revenue'
+        if 'dataset' in pattern.pattern.converters:
+            kwargs['dataset'] = 'purchases'
+        if 'resource' in pattern.pattern.converters:
+            kwargs['resource'] = 'purchases'
+        return kwargs
+
+    def test_routes_stay_within_query_budget(self):
+        patterns = [pattern for pattern in crm_urls.urlpatterns if isinstance(pattern, URLPattern)]
+        self.assertEqual({pattern.name for pattern in patterns}, set(URL_QUERY_BUDGETS))
+
+        for rows in (10, 1000):
+            self.populate(rows)
+            for pattern in patterns:
+                with self.subTest(route=pattern.name, rows=rows):
+                    cache.clear()
+                    customer_index.clear()
+                    self.client.force_login(self.user)
+                    url = reverse(pattern.name, kwargs=self.route_kwargs(pattern))
+                    with query_budget(URL_QUERY_BUDGETS[pattern.name], label=f"GET {url} at {rows} rows"):
+                        response = self.client.get(url, {'term': 'Customer'})
+                        if response.streaming:
+                            # Streaming views run their queries as the body is read
+                            b''.join(response.streaming_content)
+                    self.assertLess(response.status_code, 400)
+
+
+class ChurnScoringTestCase(TestCase):
+
+    def setUp(self):
+        InternalServices.objects.create(internal_churn_rate=10.00)
+        self.engaged = CustomerInformation.objects.create(name="Engaged", email="engaged@example.com")
+        self.drifting = CustomerInformation.objects.create(name="Drifting", email="drifting@example.com")
+        self.silent = CustomerInformation.objects.create(name="Silent", email="silent@example.com")
+        for level in ("High", "Medium"):
+            Engagement.objects.create(customer=self.engaged, level_of_engagement=level, type_of_engagement="Call")
+        Engagement.objects.create(customer=self.drifting, level_of_engagement="Low", type_of_engagement="Email")
+
+    def test_batch_scores_match_per_customer_calculation(self):
+        self.assertEqual(score_customers(batch_size=2), 3)
+        for customer in (self.engaged, self.drifting, self.silent):
+            stored = CustomerChurnScore.objects.get(customer=customer)
+            self.assertAlmostEqual(stored.score, customer.likelihood_to_churn())
+        self.assertEqual(CustomerChurnScore.objects.get(customer=self.engaged).engagement_count, 2)
+
+    def test_rescoring_updates_existing_rows(self):
+        score_customers()
+        Engagement.objects.create(customer=self.drifting, level_of_engagement="High", type_of_engagement="Meeting")
+        score_customers()
+        self.assertEqual(CustomerChurnScore.objects.count(), 3)
+        self.assertAlmostEqual(CustomerChurnScore.objects.get(customer=self.drifting).score, 5.0)
+
+    def test_customer_list_sorts_by_churn_risk(self):
+        score_customers()
+        self.client.force_login(User.objects.create_user(username="rep", password="password"))
+        response = self.client.get(reverse('customer_list'), {'sort': 'churn'})
+        self.assertEqual(list(response.context['customers']), [self.drifting, self.engaged, self.silent])
+
+    def test_churn_sort_lists_unscored_customers_last_and_keeps_search(self):
+        score_customers()
+        unscored = CustomerInformation.objects.create(name="Drifting New", email="new@example.com")
+        self.client.force_login(User.objects.create_user(username="rep", password="password"))
+        response = self.client.get(reverse('customer_list'), {'sort': 'churn', 'customer_search': 'drifting'})
+        self.assertEqual(list(response.context['customers']), [self.drifting, unscored])
+        self.assertContains(response, 'href="?sort=churn&customer_search=drifting"')
+
+    @override_settings(CRM_CURSOR_PAGINATION=True)
+    def test_churn_sort_pages_with_cursor(self):
+        score_customers()
+        unscored = [CustomerInformation.objects.create(name=f"New {i}", email=f"new{i}@example.com") for i in range(10)]
+        self.client.force_login(User.objects.create_user(username="rep", password="password"))
+        response = self.client.get(reverse('customer_list'), {'sort': 'churn'})
+        self.assertEqual(list(response.context['customers']), [self.drifting, self.engaged, self.silent, *unscored[:7]])
+        token = response.context['page_obj'].next_page_number()
+        response = self.client.get(reverse('customer_list'), {'sort': 'churn', 'page': token})
+        self.assertEqual(list(response.context['customers']), unscored[7:])
+        token = response.context['page_obj'].previous_page_number()
+        response = self.client.get(reverse('customer_list'), {'sort': 'churn', 'page': token})
+        self.assertEqual(len(response.context['customers']), 10)
+
+
+class LifetimeValuePipelineTestCase(TestCase):
+
+    def setUp(self):
+        InternalServices.objects.create(average_length_of_customer=2.00, average_cost_to_acquire=50.00)
+        self.product = Product.objects.create(name="Pipeline Product", price=10.00)
+        self.buyer = CustomerInformation.objects.create(name="Buyer", email="buyer@example.com")
+        self.browser = CustomerInformation.objects.create(name="Browser", email="browser@example.com")
+        self.existing = LifetimeValue.objects.create(customer=self.buyer, cost_to_acquire=100.00)
+        for amount in (Decimal("20.00"), Decimal("40.00")):
+            ProductsPurchased.objects.create(
+                customer=self.buyer, product=self.product, number_of_products_purchased=1, amount_spent=amount
+            )
+
+    def test_full_run_matches_per_customer_formula(self):
+        self.assertEqual(recompute_lifetime_values(shard_size=1), 2)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.lifetime_value, Decimal("120.00"))
+        self.assertEqual(self.existing.lifetime_value, LifetimeValue(customer=self.buyer).calculate_lifetime_value())
+        self.assertEqual(self.existing.worth_acquisition_cost, Decimal("20.00"))
+
+        created = LifetimeValue.objects.get(customer=self.browser)
+        self.assertEqual(created.lifetime_value, Decimal("0.00"))
+        self.assertEqual(created.cost_to_acquire, Decimal("50.00"))
+
+    def test_incremental_run_only_touches_new_purchasers(self):
+        ProductsPurchased.objects.update(updated_at=timezone.now() - 2 * WATERMARK_OVERLAP)
+        recompute_lifetime_values()
+        ProductsPurchased.objects.create(
+            customer=self.browser, product=self.product, number_of_products_purchased=1, amount_spent=Decimal("5.00")
+        )
+        self.assertEqual(recompute_lifetime_values(incremental=True), 1)
+        self.assertEqual(LifetimeValue.objects.get(customer=self.browser).lifetime_value, Decimal("10.00"))
+        # Once the overlap window has passed the purchase is not revisited
+        ProductsPurchased.objects.update(updated_at=timezone.now() - 2 * WATERMARK_OVERLAP)
+        self.assertEqual(recompute_lifetime_values(incremental=True), 0)
+
+    def test_incremental_run_sees_late_commits_and_edits(self):
+        recompute_lifetime_values()
+        checkpoint = JobCheckpoint.objects.get(name='lifetime_value')
+        ProductsPurchased.objects.update(updated_at=checkpoint.last_run_at - 2 * WATERMARK_OVERLAP)
+        # Stamped before the last run started, but only committed after it
+        late = ProductsPurchased.objects.create(
+            customer=self.browser, product=self.product, number_of_products_purchased=1, amount_spent=Decimal("5.00")
+        )
+        ProductsPurchased.objects.filter(pk=late.pk).update(updated_at=checkpoint.last_run_at - WATERMARK_OVERLAP / 2)
+        edited = ProductsPurchased.objects.filter(customer=self.buyer).first()
+        edited.amount_spent = Decimal("80.00")
+        edited.save()
+
+        self.assertEqual(recompute_lifetime_values(incremental=True), 2)
+        self.assertEqual(LifetimeValue.objects.get(customer=self.browser).lifetime_value, Decimal("10.00"))
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.lifetime_value, LifetimeValue(customer=self.buyer).calculate_lifetime_value())
+
+
+class ProductSalesSummaryTestCase(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Summary Product", price=10.00)
+        self.other_product = Product.objects.create(name="Other Product", price=5.00)
+        self.alice = CustomerInformation.objects.create(name="Alice", email="alice@example.com")
+        self.bob = CustomerInformation.objects.create(name="Bob", email="bob@example.com")
+
+    def purchase(self, customer, units, amount, date, product=None):
+        return ProductsPurchased.objects.create(
+            customer=customer, product=product or self.product,
+            number_of_products_purchased=units, amount_spent=Decimal(amount), date_of_sale=date
+        )
+
+    def assertMatchesRebuild(self):
+        fields = ('product_id', 'units_sold', 'revenue', 'first_sale_date', 'last_sale_date', 'distinct_buyers')
+        maintained = list(ProductSalesSummary.objects.order_by('product_id').values_list(*fields))
+        rebuild_summaries([row[0] for row in maintained])
+        self.assertEqual(maintained, list(ProductSalesSummary.objects.order_by('product_id').values_list(*fields)))
+
+    def test_inserts_accumulate_totals(self):
+        self.purchase(self.alice, 2, "20.00", "2024-03-01")
+        self.purchase(self.alice, 1, "10.00", "2024-01-15")
+        self.purchase(self.bob, 3, "30.00", "2024-05-10")
+        summary = ProductSalesSummary.objects.get(product=self.product)
+        self.assertEqual(summary.units_sold, 6)
+        self.assertEqual(summary.revenue, Decimal("60.00"))
+        self.assertEqual(str(summary.first_sale_date), "2024-01-15")
+        self.assertEqual(str(summary.last_sale_date), "2024-05-10")
+        self.assertEqual(summary.distinct_buyers, 2)
+        self.assertEqual(self.product.total_revenue(), Decimal("60.00"))
+        self.assertMatchesRebuild()
+
+    def test_updates_and_deletes_apply_deltas(self):
+        first = self.purchase(self.alice, 2, "20.00", "2024-03-01")
+        latest = self.purchase(self.bob, 1, "10.00", "2024-06-01")
+        first.number_of_products_purchased = 5
+        first.amount_spent = Decimal("50.00")
+        first.save()
+        latest.delete()
+        summary = ProductSalesSummary.objects.get(product=self.product)
+        self.assertEqual((summary.units_sold, summary.revenue, summary.distinct_buyers), (5, Decimal("50.00"), 1))
+        self.assertEqual(str(summary.last_sale_date), "2024-03-01")
+        self.assertMatchesRebuild()
+
+    def test_moving_a_purchase_between_products(self):
+        purchase = self.purchase(self.alice, 2, "20.00", "2024-03-01")
+        purchase.product = self.other_product
+        purchase.save()
+        moved_from = ProductSalesSummary.objects.get(product=self.product)
+        self.assertEqual((moved_from.units_sold, moved_from.distinct_buyers, moved_from.first_sale_date), (0, 0, None))
+        self.assertEqual(ProductSalesSummary.objects.get(product=self.other_product).units_sold, 2)
+        self.assertMatchesRebuild()
+
+    def test_cascade_delete_recounts_buyers(self):
+        self.purchase(self.alice, 1, "10.00", "2024-03-01")
+        self.purchase(self.alice, 1, "10.00", "2024-04-01")
+        self.purchase(self.bob, 1, "10.00", "2024-05-01")
+        self.alice.delete()
+        summary = ProductSalesSummary.objects.get(product=self.product)
+        self.assertEqual((summary.units_sold, summary.distinct_buyers), (1, 1))
+        self.assertMatchesRebuild()
+
+    def test_rebuild_repairs_drift(self):
+        self.purchase(self.alice, 2, "20.00", "2024-03-01")
+        ProductSalesSummary.objects.filter(product=self.product).update(units_sold=99, revenue=0)
+        self.assertEqual(rebuild_summaries([self.product.pk]), 1)
+        summary = ProductSalesSummary.objects.get(product=self.product)
+        self.assertEqual((summary.units_sold, summary.revenue), (2, Decimal("20.00")))
+
+
+class MetricCounterTestCase(TestCase):
+
+    def setUp(self):
+        InternalServices.objects.create(projected_revenue=5000, internal_churn_rate=99)
+        self.product = Product.objects.create(name="KPI Product", price=10.00)
+        self.customers = [
+            CustomerInformation.objects.create(name=f"KPI {i}", email=f"kpi{i}@example.com") for i in range(4)
+        ]
+        for customer in self.customers[:2]:
+            ProductsPurchased.objects.create(
+                customer=customer, product=self.product, number_of_products_purchased=1, amount_spent=Decimal("30.00")
+            )
+        self.lead = CustomerLead.objects.create(
+            customer=self.customers[0], status="Closed", likelihood_to_convert=0, lead_stage="Lost"
+        )
+        LifetimeValue.objects.create(customer=self.customers[0], lifetime_value=Decimal("100.00"))
+        LifetimeValue.objects.create(customer=self.customers[1], lifetime_value=Decimal("50.00"))
+
+    def assertMatchesReconcile(self):
+        live = MetricCounter.kpis()
+        self.assertEqual(live, reconcile(persist=False))
+        return live
+
+    def test_counters_follow_writes(self):
+        kpis = self.assertMatchesReconcile()
+        self.assertEqual(kpis['current_revenue'], Decimal("60.00"))
+        self.assertEqual(kpis['total_customers'], 4)
+        self.assertEqual(kpis['internal_churn_rate'], Decimal("25.00"))
+        self.assertEqual(kpis['average_revenue_per_customer'], Decimal("15.00"))
+        self.assertEqual(kpis['average_lifetime_value'], Decimal("75.00"))
+
+        self.lead.lead_stage = "Won"
+        self.lead.save()
+        self.customers[1].delete()
+        kpis = self.assertMatchesReconcile()
+        self.assertEqual(kpis['current_revenue'], Decimal("30.00"))
+        self.assertEqual(kpis['internal_churn_rate'], Decimal("0.00"))
+        self.assertEqual(InternalServices.calculate_average_lifetime_value(), Decimal("100.00"))
+
+    def test_reconcile_repairs_drift_and_persists(self):
+        MetricCounter.objects.filter(name=MetricCounter.CUSTOMERS).update(value=1)
+        reconcile()
+        internal_services = InternalServices.objects.get()
+        self.assertEqual(internal_services.total_customers, 4)
+        self.assertEqual(internal_services.current_revenue, Decimal("60.00"))
+        self.assertEqual(InternalServices.get_internal_churn_rate(), Decimal("25.00"))
+        self.assertEqual(internal_services.projected_revenue, Decimal("5000.00"))
+
+    def test_counters_are_locked_in_name_order(self):
+        deltas = {MetricCounter.REVENUE: 1, MetricCounter.CUSTOMERS: 1, MetricCounter.LOST_CUSTOMERS: 1}
+        with CaptureQueriesContext(connections['default']) as queries:
+            increment(deltas)
+            reconcile(persist=False)
+        updated = [
+            name for query in queries.captured_queries if query['sql'].startswith('UPDATE "crm_metriccounter"')
+            for name in deltas if f"'{name}'" in query['sql']
+        ]
+        self.assertEqual(updated, sorted(deltas))
+        locking = [query['sql'] for query in queries.captured_queries if '"name" IN' in query['sql']]
+        self.assertTrue(locking[0].endswith('ORDER BY "crm_metriccounter"."name" ASC'))
+
+    def test_internal_view_reads_counters(self):
+        self.client.force_login(User.objects.create_user(username="ops", password="password"))
+        response = self.client.get(reverse('internal'))
+        self.assertEqual(response.context['total_customers'], 4)
+        self.assertEqual(response.context['internal_churn_rate'], Decimal("25.00"))
+        self.assertEqual(response.context['projected_revenue'], Decimal("5000.00"))
+        edit = self.client.get(reverse('internal_services_edit', args=['total_customers']))
+        self.assertEqual(edit.status_code, 404)
+        self.assertEqual(self.client.get('/internal/life-value/edit/').status_code, 404)
+
+
+class BulkImportTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.existing = CustomerInformation.objects.create(name="Old Name", email="known@example.com")
+        self.product = Product.objects.create(name="Widget", price=10.00)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+
+    def run_import(self, kind, path, *args):
+        out, err = StringIO(), StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('crm_import', kind, path, '--batch-size', '2', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_customers_upsert_on_email(self):
+        path = self.write_file('customers.csv', (
+            "name,email,phone,industry,income\n"
+            "New Name,known@example.com,(555) 010-2000,Retail,\n"
+            "Fresh Customer,fresh@example.com,,Finance,85000\n"
+            "Broken,not-an-email,,,\n"
+        ))
+        out, err = self.run_import('customers', path)
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.phone_digits), ("New Name", "5550102000"))
+        self.assertEqual(CustomerInformation.objects.get(email="fresh@example.com").income, Decimal("85000.00"))
+        self.assertEqual(CustomerInformation.objects.count(), 2)
+        self.assertIn("Batch 2: 0/1 rows written, 1 errors", out)
+        self.assertIn("line 4", err)
+        self.assertEqual(MetricCounter.kpis()['total_customers'], 2)
+        self.assertEqual(customer_index.search("fresh")[0]['email'], "fresh@example.com")
+
+    def test_customer_upserts_apply_counter_deltas(self):
+        # A drifted counter shows the batch was applied as a delta rather than recounted
+        MetricCounter.objects.filter(name=MetricCounter.CUSTOMERS).update(value=10)
+        path = self.write_file('customers.csv', (
+            "name,email\n"
+            "Known Again,known@example.com\n"
+            "Brand New,new@example.com\n"
+        ))
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.run_import('customers', path)
+        self.assertEqual(MetricCounter.kpis()['total_customers'], 11)
+        self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql']])
+
+    def test_purchases_resolve_lookups_and_refresh_summaries(self):
+        CustomerInformation.objects.create(name="Second", email="second@example.com")
+        path = self.write_file('purchases.jsonl', (
+            '{"customer_email": "known@example.com", "product": "Widget", "number_of_products_purchased": 2, '
+            '"amount_spent": "20.00", "date_of_sale": "2024-02-01"}\n'
+            f'{{"customer_email": "second@example.com", "product": {self.product.pk}, '
+            '"number_of_products_purchased": 1, "amount_spent": "10.00", "date_of_sale": "2024-03-01"}\n'
+            '{"customer_email": "known@example.com", "product": "Widget", "number_of_products_purchased": 1, '
+            '"amount_spent": "10.00", "date_of_sale": "2024-01-01"}\n'
+            '{"customer_email": "nobody@example.com", "product": "Widget", "number_of_products_purchased": 1, '
+            '"amount_spent": "10.00"}\n'
+            'not json\n'
+        ))
+        out, err = self.run_import('purchases', path)
+        self.assertEqual(ProductsPurchased.objects.count(), 3)
+        self.assertIn("Unknown customer email 'nobody@example.com'", err)
+        self.assertIn("invalid JSON", err)
+        summary = ProductSalesSummary.objects.get(product=self.product)
+        self.assertEqual((summary.units_sold, summary.revenue, summary.distinct_buyers), (4, Decimal("40.00"), 2))
+        self.assertEqual((str(summary.first_sale_date), str(summary.last_sale_date)), ("2024-01-01", "2024-03-01"))
+        self.assertEqual(MetricCounter.kpis()['current_revenue'], Decimal("40.00"))
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username="exporter", password="password"))
+        customer = CustomerInformation.objects.create(name="Exported", email="exported@example.com")
+        product = Product.objects.create(name="Export Product", price=10.00)
+        self.purchases = [
+            ProductsPurchased.objects.create(
+                customer=customer, product=product, number_of_products_purchased=1,
+                amount_spent=Decimal("10.00"), date_of_sale=f"2024-0{month}-15"
+            )
+            for month in (1, 2, 3)
+        ]
+
+    def export(self, **params):
+        response = self.client.get(reverse('export', args=['purchases']), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_export_filters_by_date_and_cursor(self):
+        lines = self.export(since="2024-02-01").decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'customer_email', 'product'])
+        self.assertEqual(len(lines), 3)
+        self.assertIn('exported@example.com', lines[1])
+
+        lines = self.export(until="2024-02-15", after_id=self.purchases[0].pk).decode().splitlines()
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], [str(self.purchases[1].pk)])
+
+    def test_gzipped_jsonl_export(self):
+        body = gzip.decompress(self.export(format='jsonl', gzip='1'))
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [purchase.pk for purchase in self.purchases])
+        self.assertEqual(rows[0]['amount_spent'], "10.00")
+
+    def test_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get(reverse('export', args=['purchases']), {'since': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export', args=['secrets'])).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('export', args=['purchases'])).status_code, 302)
+
+
+class SeedTestCase(TestCase):
+
+    def seed(self, **kwargs):
+        return seed.seed_dataset(60, products=20, shard_size=25, batch_size=50, seed=7, use_copy=False, **kwargs)
+
+    def seeded_purchases(self):
+        return list(
+            ProductsPurchased.objects.filter(customer__email__endswith='@' + seed.DEFAULT_DOMAIN).order_by('id').values_list(
+                'customer__email', 'product__name', 'number_of_products_purchased', 'date_of_sale', 'amount_spent'
+            )
+        )
+
+    def test_seeds_requested_volumes_and_derived_data(self):
+        totals = self.seed()
+        self.assertEqual(totals['customers'], 60)
+        self.assertEqual(CustomerInformation.objects.count(), 60)
+        self.assertEqual(ProductsPurchased.objects.count(), totals['purchases'])
+        self.assertEqual(Engagement.objects.count(), totals['engagements'])
+        self.assertEqual(CustomerLead.objects.count(), totals['leads'])
+        self.assertGreater(totals['purchases'], 0)
+        # Derived tables are rebuilt even though signals did not fire
+        self.assertEqual(MetricCounter.kpis()['total_customers'], 60)
+        self.assertEqual(
+            sum(ProductSalesSummary.objects.values_list('units_sold', flat=True)),
+            sum(ProductsPurchased.objects.values_list('number_of_products_purchased', flat=True)),
+        )
+        with self.assertRaises(ValueError):
+            self.seed()
+
+    def test_same_seed_generates_same_rows(self):
+        self.seed()
+        first = self.seeded_purchases()
+        seed.clear()
+        self.seed()
+        self.assertEqual(self.seeded_purchases(), first)
+
+    def test_clear_removes_seeded_rows_only(self):
+        customer = CustomerInformation.objects.create(name="Kept", email="kept@example.com")
+        self.seed()
+        LifetimeValue.objects.create(
+            customer=CustomerInformation.objects.filter(email__endswith='@' + seed.DEFAULT_DOMAIN).first(),
+            lifetime_value=Decimal("10.00")
+        )
+        seed.clear()
+        self.assertEqual(list(CustomerInformation.objects.all()), [customer])
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(ProductsPurchased.objects.exists())
+        self.assertFalse(LifetimeValue.objects.exists())
+        self.assertEqual(MetricCounter.kpis()['total_customers'], 1)
+
+
+@override_settings(CRM_PROFILING=True, CRM_PROFILING_SAMPLE_RATE=1)
+class ProfilingMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username="profiled", password="password"))
+        CustomerInformation.objects.create(name="Profiled", email="profiled@example.com")
+
+    def test_sampled_request_reports_timings(self):
+        with self.assertLogs('crm.profiling', level='INFO') as logs:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        header = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'app;dur=', 'total;dur='):
+            self.assertIn(metric, header)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'dashboard')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertIn(f'desc="{record["queries"]} queries"', header)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertLessEqual(record['db_ms'] + record['template_ms'], record['total_ms'])
+
+    @override_settings(CRM_PROFILING_SAMPLE_RATE=0)
+    def test_unsampled_request_is_untouched(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(CRM_PROFILING=False)
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class FragmentCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username="fragments", password="password"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer = CustomerInformation.objects.create(name="Cached Name", email="cached@example.com")
+
+    def test_rows_are_served_from_cache_until_the_model_changes(self):
+        self.assertContains(self.client.get(reverse('customer_list')), "Cached Name")
+        # A write that skips the signals keeps the cached row
+        CustomerInformation.objects.filter(pk=self.customer.pk).update(name="Silent Name")
+        self.assertContains(self.client.get(reverse('customer_list')), "Cached Name")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.name = "Saved Name"
+            self.customer.save()
+        response = self.client.get(reverse('customer_list'))
+        self.assertContains(response, "Saved Name")
+        self.assertNotContains(response, "Cached Name")
+
+    def test_bulk_writes_and_dependent_models_bump_versions(self):
+        customer_version, lead_version = versions.get_versions(CustomerInformation, CustomerLead)
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_saved.send(sender=CustomerInformation, objects=[self.customer], created=False, using='default')
+        new_customer_version, new_lead_version = versions.get_versions(CustomerInformation, CustomerLead)
+        self.assertNotEqual(new_customer_version, customer_version)
+        self.assertEqual(new_lead_version, lead_version)
+
+        # Leads show the customer's name, so their fragments follow both versions
+        self.assertEqual(
+            versions.version_key(CustomerLead, CustomerInformation), f"{lead_version}.{new_customer_version}"
+        )
+
+    def test_evicted_version_does_not_restart_from_an_old_number(self):
+        version = versions.get_versions(Product)[0]
+        cache.delete(versions.CACHE_PREFIX + 'crm.product')
+        self.assertGreater(versions.get_versions(Product)[0], version)
+
+    @override_settings(CRM_FRAGMENT_CACHE_TIMEOUT=0)
+    def test_zero_timeout_disables_fragments(self):
+        self.client.get(reverse('customer_list'))
+        CustomerInformation.objects.filter(pk=self.customer.pk).update(name="Silent Name")
+        self.assertContains(self.client.get(reverse('customer_list')), "Silent Name")
+
+
+class CustomerDetailCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username="details", password="password"))
+        self.customer = CustomerInformation.objects.create(name="Detailed", email="detailed@example.com")
+        self.product = Product.objects.create(name="Detail Product", price=Decimal("10.00"))
+        self.url = reverse('customer_detail', args=[self.customer.pk])
+
+    def purchase(self, amount):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductsPurchased.objects.create(
+                customer=self.customer, product=self.product, number_of_products_purchased=1, amount_spent=Decimal(amount)
+            )
+
+    def test_aggregates_are_cached_until_a_related_row_changes(self):
+        self.purchase("10.00")
+        self.assertEqual(self.client.get(self.url).context['total_revenue'], Decimal("10.00"))
+        with self.assertNumQueries(0):
+            aggregates = detail_cache.customer_aggregates(self.customer)
+        self.assertEqual(aggregates['total_revenue'], Decimal("10.00"))
+
+        purchase = self.purchase("5.00")
+        self.assertEqual(self.client.get(self.url).context['total_revenue'], Decimal("15.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            purchase.delete()
+        self.assertEqual(self.client.get(self.url).context['total_revenue'], Decimal("10.00"))
+
+    def test_moving_a_row_invalidates_both_customers(self):
+        other = CustomerInformation.objects.create(name="Other", email="other@example.com")
+        purchase = self.purchase("10.00")
+        detail_cache.customer_aggregates(self.customer)
+        detail_cache.customer_aggregates(other)
+        with self.captureOnCommitCallbacks(execute=True):
+            purchase.customer = other
+            purchase.save()
+        self.assertEqual(detail_cache.customer_aggregates(self.customer)['total_revenue'], 0)
+        self.assertEqual(detail_cache.customer_aggregates(other)['total_revenue'], Decimal("10.00"))
+
+    def test_bulk_jobs_invalidate_aggregates(self):
+        self.purchase("10.00")
+        self.assertEqual(detail_cache.customer_aggregates(self.customer)['lifetime_value'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            recompute_lifetime_values()
+        self.assertGreater(detail_cache.customer_aggregates(self.customer)['lifetime_value'], 0)
+
+
+@override_settings(CRM_API_TOKENS=['secret-token'])
+class BatchApiTestCase(TestCase):
+
+    def setUp(self):
+        self.customer = CustomerInformation.objects.create(name="Api Customer", email="api@example.com")
+        self.products = [Product.objects.create(name=f"Api Product {i}", price=Decimal("5.00")) for i in range(2)]
+        self.url = reverse('api_records', args=['purchases'])
+
+    def post(self, records, url=None, token='secret-token'):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url or self.url, json.dumps(records), content_type='application/json', headers=headers)
+
+    def purchase(self, product=0, amount="5.00"):
+        return {
+            'customer': self.customer.pk, 'product': self.products[product].pk, 'number_of_products_purchased': 1,
+            'date_of_sale': '2024-05-01', 'amount_spent': amount,
+        }
+
+    def test_batch_create_is_bulk_and_updates_derived_data(self):
+        with query_budget(12):
+            response = self.post([self.purchase() for _ in range(50)])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['created'], 50)
+        self.assertEqual([result['status'] for result in body['results']], ['created'] * 50)
+        self.assertEqual(
+            sorted(result['id'] for result in body['results']), sorted(ProductsPurchased.objects.values_list('id', flat=True))
+        )
+        self.assertEqual(self.products[0].sales_summary.units_sold, 50)
+        self.assertEqual(MetricCounter.kpis()['current_revenue'], Decimal("250.00"))
+
+    def test_invalid_record_rejects_the_whole_batch(self):
+        response = self.post([self.purchase(), {**self.purchase(), 'product': 999999}, {'customer': self.customer.pk}])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['not_written', 'invalid', 'invalid'])
+        self.assertIn('product', results[1]['errors'])
+        self.assertIn('amount_spent', results[2]['errors'])
+        self.assertFalse(ProductsPurchased.objects.exists())
+
+    def test_partial_update_moves_purchase_between_products(self):
+        created = self.post([self.purchase(amount="7.00")]).json()['results'][0]['id']
+        response = self.post([{'id': created, 'product': self.products[1].pk}])
+        self.assertEqual(response.json()['updated'], 1)
+        purchase = ProductsPurchased.objects.get(pk=created)
+        self.assertEqual((purchase.product, purchase.amount_spent), (self.products[1], Decimal("7.00")))
+        summaries = dict(ProductSalesSummary.objects.values_list('product_id', 'units_sold'))
+        self.assertEqual(summaries, {self.products[0].pk: 0, self.products[1].pk: 1})
+
+        response = self.post([{'id': 999999, 'amount_spent': '1.00'}])
+        self.assertEqual(response.json()['results'][0]['status'], 'invalid')
+
+    def test_lead_updates_touch_updated_at_and_lost_counter(self):
+        lead = CustomerLead.objects.create(customer=self.customer, status="Open", likelihood_to_convert=10, lead_stage="Qualified")
+        stamp = lead.updated_at
+        response = self.post([{'id': lead.pk, 'lead_stage': 'Lost'}], url=reverse('api_records', args=['leads']))
+        self.assertEqual(response.status_code, 200, response.content)
+        lead.refresh_from_db()
+        self.assertEqual(lead.lead_stage, 'Lost')
+        self.assertGreater(lead.updated_at, stamp)
+        self.assertEqual(MetricCounter.objects.get(name=MetricCounter.LOST_CUSTOMERS).value, 1)
+        self.assertEqual(
+            list(lead.stage_transitions.order_by('id').values_list('from_stage', 'to_stage')),
+            [('', 'Qualified'), ('Qualified', 'Lost')],
+        )
+
+    def test_list_pages_by_id(self):
+        ids = [result['id'] for result in self.post([self.purchase() for _ in range(3)]).json()['results']]
+        headers = {'Authorization': 'Bearer secret-token'}
+        page = self.client.get(self.url, {'limit': 2}, headers=headers).json()
+        self.assertEqual([record['id'] for record in page['results']], ids[:2])
+        page = self.client.get(self.url, {'limit': 2, 'after': page['next_after']}, headers=headers).json()
+        self.assertEqual([record['id'] for record in page['results']], ids[2:])
+        self.assertIsNone(page['next_after'])
+
+    def test_authentication(self):
+        self.assertEqual(self.post([self.purchase()], token=None).status_code, 401)
+        self.assertEqual(self.post([self.purchase()], token='wrong').status_code, 401)
+        self.assertEqual(self.client.get(reverse('api_records', args=['secrets']), headers={'Authorization': 'Bearer secret-token'}).status_code, 404)
+
+        user = User.objects.create_user(username="api", password="password")
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.force_login(user)
+        self.assertEqual(csrf_client.get(self.url).status_code, 200)
+        response = csrf_client.post(self.url, json.dumps([self.purchase()]), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(CRM_API_TOKENS=['secret-token'])
+class ConditionalGetTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="conditional", password="password")
+        self.client.force_login(self.user)
+        self.customer = CustomerInformation.objects.create(name="Conditional", email="conditional@example.com")
+        self.url = reverse('customer_detail', args=[self.customer.pk])
+        # The first page sets the CSRF cookie, which later ETags include
+        self.client.get(reverse('dashboard'))
+
+    def test_unchanged_detail_page_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response.headers)
+        # The page also shows purchases and scores, which do not move the customer's updated_at
+        self.assertNotIn('Last-Modified', response.headers)
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+
+        with self.assertNumQueries(3):  # session, user, updated_at
+            revalidated = self.client.get(self.url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.headers['ETag'], response.headers['ETag'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductsPurchased.objects.create(
+                customer=self.customer, product=Product.objects.create(name="Conditional Product", price=Decimal("1.00")),
+                number_of_products_purchased=1, amount_spent=Decimal("1.00"),
+            )
+        changed = self.client.get(self.url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], response.headers['ETag'])
+
+    def test_last_modified_only_for_pages_of_the_row_alone(self):
+        state = row_state(CustomerInformation, 'self')(None, pk=self.customer.pk)
+        self.assertEqual(state[1], self.customer.updated_at)
+        state = row_state(CustomerInformation, 'self', CustomerChurnScore)(None, pk=self.customer.pk)
+        self.assertIsNone(state[1])
+
+    def test_lead_detail_etag_changes_with_the_date(self):
+        lead = CustomerLead.objects.create(
+            customer=self.customer, name="Dated Lead", status="Open", likelihood_to_convert=50, lead_stage="Qualified"
+        )
+        url = reverse('lead_detail', args=[lead.pk])
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response.headers)
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(days=1)):
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_list_page_changes_etag_on_write(self):
+        url = reverse('customer_list')
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.name = "Renamed"
+            self.customer.save()
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        etag = self.client.get(self.url).headers['ETag']
+        self.client.force_login(User.objects.create_user(username="someone else", password="password"))
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_api_listing_is_conditional(self):
+        url = reverse('api_records', args=['leads'])
+        headers = {'Authorization': 'Bearer secret-token'}
+        response = Client().get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        revalidated = Client().get(url, headers={**headers, 'If-None-Match': response.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+        rejected = Client().get(url, headers={'Authorization': 'Bearer wrong', 'If-None-Match': response.headers['ETag']})
+        self.assertEqual(rejected.status_code, 401)
+        self.assertNotIn('ETag', rejected.headers)
+
+    def test_updated_at_follows_writes(self):
+        engagement = Engagement.objects.create(
+            customer=self.customer, level_of_engagement="Low", type_of_engagement="Call"
+        )
+        before = engagement.updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            response = Client().post(
+                reverse('api_records', args=['engagements']), json.dumps([{'id': engagement.pk, 'level_of_engagement': "High"}]),
+                content_type='application/json', headers={'Authorization': 'Bearer secret-token'},
+            )
+        self.assertEqual(response.status_code, 200)
+        engagement.refresh_from_db()
+        self.assertEqual(engagement.level_of_engagement, "High")
+        self.assertGreater(engagement.updated_at, before)
+
+        before = self.customer.updated_at
+        self.customer.name = "Updated"
+        self.customer.save(update_fields=['name'])
+        self.customer.refresh_from_db()
+        self.assertGreater(self.customer.updated_at, before)
+
+
+class AsyncViewsTestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        customer_index.clear()
+        self.user = User.objects.create_user(username="async", password="password")
+        self.customers = [
+            CustomerInformation.objects.create(name=f"Async Customer {i}", email=f"async{i}@example.com") for i in range(12)
+        ]
+        product = Product.objects.create(name="Async Product", price=Decimal("10.00"))
+        ProductsPurchased.objects.create(
+            customer=self.customers[0], product=product, number_of_products_purchased=2, amount_spent=Decimal("20.00")
+        )
+        CustomerLead.objects.create(
+            customer=self.customers[1], status="Open", likelihood_to_convert=Decimal("50.00"), lead_stage="Qualified"
+        )
+        Engagement.objects.create(customer=self.customers[0], level_of_engagement="High", type_of_engagement="Call")
+        CustomDescriptionField.objects.create(customer=self.customers[0], description="Prefers email")
+
+    def get(self, view, path, **kwargs):
+        request = RequestFactory().get(path)
+        request.user = self.user
+        response = view(request, **kwargs)
+        if iscoroutine(response):
+            response = async_to_sync(lambda: response)()
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_dashboard_matches_sync_view(self):
+        for path in ('/dashboard/', '/dashboard/?customer_search=Async&customers_page=2&product_search=Async'):
+            with self.subTest(path=path):
+                expected = self.get(DashboardView.as_view(), path).context_data
+                context = self.get(AsyncDashboardView.as_view(), path).context_data
+                for section in dashboard.PAGED_SECTIONS:
+                    self.assertEqual(list(context[section]), list(expected[section]))
+                    self.assertEqual(context[section].number, expected[section].number)
+                self.assertEqual(context['churn_rate'], expected['churn_rate'])
+
+    def test_customer_detail_matches_sync_view(self):
+        kwargs = {'pk': self.customers[0].pk}
+        expected = self.get(CustomerDetailView.as_view(), '/', **kwargs).context_data
+        context = self.get(AsyncCustomerDetailView.as_view(), '/', **kwargs).context_data
+        self.assertEqual(context['customer'], self.customers[0])
+        self.assertEqual(context['total_revenue'], Decimal("20.00"))
+        for key in ('total_revenue', 'likelihood_to_churn', 'lifetime_value'):
+            self.assertEqual(context[key], expected[key])
+        self.assertEqual(list(context['descriptions']), list(expected['descriptions']))
+
+        with self.assertRaises(Http404):
+            self.get(AsyncCustomerDetailView.as_view(), '/', pk=0)
+
+    def test_async_views_are_conditional(self):
+        view = AsyncCustomerDetailView.as_view()
+        response = self.get(view, '/', pk=self.customers[0].pk)
+        request = RequestFactory().get('/', headers={'If-None-Match': response.headers['ETag']})
+        request.user = self.user
+        self.assertEqual(async_to_sync(view)(request, pk=self.customers[0].pk).status_code, 304)
+
+    def test_autocomplete(self):
+        response = self.get(customer_autocomplete_async, '/?term=async customer 1')
+        self.assertEqual(
+            [customer['name'] for customer in json.loads(response.content)],
+            ["Async Customer 1", "Async Customer 10", "Async Customer 11"],
+        )
+
+
+@override_settings(CRM_READ_REPLICA=True)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username="replica", password="password"))
+        self.customer = CustomerInformation.objects.create(name="Replica Customer", email="replica@example.com")
+
+    def tables_read(self, method, url, **kwargs):
+        """Returns the crm tables queried on each alias while handling the request."""
+        with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        tables = {
+            alias: {table for table in connection.introspection.table_names() if any(f'"{table}"' in query['sql'] for query in captured)}
+            for alias, connection, captured in (('default', connections['default'], primary), ('replica', connections['replica'], replica))
+        }
+        return response, {alias: {table for table in names if table.startswith('crm_')} for alias, names in tables.items()}
+
+    def test_read_only_views_read_from_replica(self):
+        for url in (reverse('customer_list'), reverse('customer_detail', args=[self.customer.pk]), reverse('export', args=['customers'])):
+            with self.subTest(url=url):
+                response, tables = self.tables_read('get', url)
+                if response.streaming:
+                    with CaptureQueriesContext(connections['replica']) as streamed:
+                        b''.join(response.streaming_content)
+                    self.assertTrue(streamed.captured_queries)
+                else:
+                    self.assertIn('crm_customerinformation', tables['replica'])
+                self.assertNotIn('crm_customerinformation', tables['default'])
+                self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_writes_and_form_views_use_primary(self):
+        response, tables = self.tables_read('get', reverse('customer_add'))
+        self.assertFalse(tables['replica'])
+
+        response, tables = self.tables_read('post', reverse('customer_edit', args=[self.customer.pk]), data={
+            'name': "Renamed", 'email': "replica@example.com",
+            'customdescriptionfield_set-TOTAL_FORMS': 0, 'customdescriptionfield_set-INITIAL_FORMS': 0,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(tables['replica'])
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+        # Sticky to the primary while the cookie lasts
+        response, tables = self.tables_read('get', reverse('customer_list'))
+        self.assertFalse(tables['replica'])
+        self.assertIn('crm_customerinformation', tables['default'])
+
+    def test_router_defaults_to_primary(self):
+        router = PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(CustomerInformation), 'default')
+        state, token = begin_request()
+        try:
+            state.replica = True
+            self.assertEqual(router.db_for_read(CustomerInformation), 'replica')
+            self.assertEqual(router.db_for_read(Session), 'default')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(CustomerInformation), 'default')
+            self.assertEqual(router.db_for_write(CustomerInformation), 'default')
+            self.assertTrue(state.wrote)
+        finally:
+            end_request(token)
+        self.assertFalse(router.allow_migrate('replica', 'crm'))
+
+
+@override_settings(CRM_READ_REPLICA=True)
+class LaggingReplicaTestCase(TransactionTestCase):
+    """
+    Replica reads go to a separate database holding an older copy of the
+    customer, so anything cached while reading from it would keep the stale
+    data under the primary's versions.
+    """
+    databases = {'default', 'replica'}
+    lagging = 'lagging_replica'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        primary = connections['default'].settings_dict
+        connections.settings[cls.lagging] = {
+            **primary, 'TEST': {**primary['TEST'], 'NAME': os.path.join(cls.directory.name, 'lagging.sqlite3')},
+        }
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            connections.settings[cls.lagging]['TEST']['NAME'] = f"{primary['NAME']}_lagging"
+        cls.old_name = connections[cls.lagging].settings_dict['NAME']
+        connections[cls.lagging].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # Declared only now that it exists, so the test runner does not look for it in settings
+        cls.databases = {*cls.databases, cls.lagging}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.lagging].creation.destroy_test_db(cls.old_name, verbosity=0)
+        del connections[cls.lagging]
+        del connections.settings[cls.lagging]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        customer_index.clear()
+        patcher = mock.patch('crm.routers.REPLICA', self.lagging)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        user = User.objects.create_user(username="lagging", password="password")
+        self.client.force_login(user)
+        self.customer = CustomerInformation.objects.create(name="Stale Name", email="lagging@example.com")
+        self.mirror(user, self.customer)
+        # Applied to the primary only, as if not replicated yet
+        self.customer.name = "Fresh Name"
+        self.customer.save()
+        ProductsPurchased.objects.create(
+            customer=self.customer, product=Product.objects.create(name="Lag Product", price=Decimal("30.00")),
+            number_of_products_purchased=1, amount_spent=Decimal("30.00"),
+        )
+
+    def mirror(self, *objects):
+        for obj in objects:
+            fields = {field.attname: getattr(obj, field.attname) for field in obj._meta.concrete_fields}
+            obj.__class__.objects.using(self.lagging).bulk_create([obj.__class__(**fields)])
+
+    def test_caches_are_filled_from_the_primary(self):
+        state, token = begin_request()
+        state.replica = True
+        try:
+            stale = CustomerInformation.objects.select_related('churn_score').get(pk=self.customer.pk)
+            self.assertEqual(stale.name, "Stale Name")
+            self.assertEqual(dashboard.get_snapshot(('customers',))['customers']['rows'][0].name, "Fresh Name")
+            self.assertEqual(detail_cache.customer_aggregates(stale)['total_revenue'], Decimal("30.00"))
+            self.assertEqual([record['name'] for record in customer_index.search("fresh")], ["Fresh Name"])
+            self.assertEqual(funnel.funnel_report(), funnel.compute_funnel())
+        finally:
+            end_request(token)
+
+    def test_pages_rendered_from_the_replica_are_not_cached(self):
+        url = reverse('customer_list')
+        response = self.client.get(url)
+        self.assertContains(response, "Stale Name")
+        self.assertNotIn('ETag', response.headers)
+
+        # Once the replica catches up, no fragment rendered from the stale row is served
+        CustomerInformation.objects.using(self.lagging).filter(pk=self.customer.pk).update(name="Fresh Name")
+        response = self.client.get(url)
+        self.assertContains(response, "Fresh Name")
+        self.assertNotContains(response, "Stale Name")
+
+
+class DailySalesRollupTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.retail = CustomerInformation.objects.create(name="Retail", email="retail@example.com", industry="Retail")
+        self.other = CustomerInformation.objects.create(name="No Industry", email="none@example.com")
+        self.products = [Product.objects.create(name=f"Rollup Product {i}", price=Decimal("10.00")) for i in range(2)]
+
+    def purchase(self, customer, product=0, amount="10.00", units=1, date=datetime.date(2024, 1, 15)):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductsPurchased.objects.create(
+                customer=customer, product=self.products[product], number_of_products_purchased=units,
+                amount_spent=Decimal(amount), date_of_sale=date,
+            )
+
+    def rollup(self):
+        return {
+            (row.date, row.product_id, row.segment): (row.units, row.revenue, row.purchases)
+            for row in DailySalesRollup.objects.all()
+        }
+
+    def assert_matches_rebuild(self):
+        incremental = self.rollup()
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_rollups()
+        self.assertEqual(incremental, self.rollup())
+
+    def test_purchase_writes_update_the_rollup(self):
+        first = self.purchase(self.retail, units=2, amount="20.00")
+        self.purchase(self.retail, units=1, amount="10.00")
+        self.purchase(self.other, product=1)
+        day = datetime.date(2024, 1, 15)
+        self.assertEqual(self.rollup()[(day, self.products[0].pk, 'Retail')], (3, Decimal("30.00"), 2))
+        self.assertEqual(self.rollup()[(day, self.products[1].pk, '')], (1, Decimal("10.00"), 1))
+
+        # Moving a purchase to another day and product updates both rows
+        with self.captureOnCommitCallbacks(execute=True):
+            first.date_of_sale = datetime.date(2024, 3, 1)
+            first.product = self.products[1]
+            first.save()
+        self.assertEqual(self.rollup()[(day, self.products[0].pk, 'Retail')], (1, Decimal("10.00"), 1))
+        self.assertEqual(self.rollup()[(datetime.date(2024, 3, 1), self.products[1].pk, 'Retail')], (2, Decimal("20.00"), 1))
+        self.assert_matches_rebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertNotIn((datetime.date(2024, 3, 1), self.products[1].pk, 'Retail'), self.rollup())
+        self.assert_matches_rebuild()
+
+    def test_industry_change_moves_customer_between_segments(self):
+        self.purchase(self.retail)
+        self.purchase(self.retail, product=1, date=datetime.date(2024, 2, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.retail.industry = "Finance"
+            self.retail.save()
+        self.assertEqual({segment for _, _, segment in self.rollup()}, {'Finance'})
+        self.assert_matches_rebuild()
+
+    def test_customer_upserts_move_only_changed_segments(self):
+        self.purchase(self.retail)
+        self.purchase(self.other, product=1)
+        records = [
+            (2, {'name': "Retail", 'email': "retail@example.com", 'industry': "Finance"}, None),
+            (3, {'name': "Renamed", 'email': "none@example.com"}, None),
+        ]
+        with CaptureQueriesContext(connections['default']) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                list(CustomerImporter(batch_size=10).run(records))
+        self.assertEqual({segment for _, _, segment in self.rollup()}, {'Finance', ''})
+        # Only the customer whose industry changed has their purchases read
+        purchase_reads = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'crm_productspurchased' in query['sql']
+        ]
+        self.assertEqual(len(purchase_reads), 1)
+        self.assertIn(f'IN ({self.retail.pk})', purchase_reads[0])
+        self.assert_matches_rebuild()
+
+    def test_bulk_inserts_and_rebuild_by_range(self):
+        purchases = ProductsPurchased.objects.bulk_create([
+            ProductsPurchased(
+                customer=customer, product=self.products[0], number_of_products_purchased=1,
+                amount_spent=Decimal("5.00"), date_of_sale=datetime.date(2024, 1, day),
+            )
+            for customer in (self.retail, self.other) for day in (1, 2, 2)
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_saved.send(sender=ProductsPurchased, objects=purchases, created=True, using='default')
+        self.assertEqual(self.rollup()[(datetime.date(2024, 1, 2), self.products[0].pk, '')], (2, Decimal("10.00"), 2))
+        self.assert_matches_rebuild()
+
+        DailySalesRollup.objects.update(revenue=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuilt = rebuild_rollups(start=datetime.date(2024, 1, 2), end=datetime.date(2024, 1, 2))
+        self.assertEqual(rebuilt, 2)
+        self.assertEqual(DailySalesRollup.objects.get(date=datetime.date(2024, 1, 1), segment='').revenue, 0)
+        self.assertEqual(DailySalesRollup.objects.get(date=datetime.date(2024, 1, 2), segment='').revenue, Decimal("10.00"))
+
+    @override_settings(CRM_API_TOKENS=['secret-token'])
+    def test_report_rolls_up_to_periods(self):
+        for month, day in ((1, 5), (1, 20), (2, 3), (4, 10)):
+            self.purchase(self.retail, date=datetime.date(2024, month, day))
+        self.purchase(self.other, product=1, amount="7.50", date=datetime.date(2024, 2, 10))
+
+        months = revenue_report('month')
+        self.assertEqual(
+            [(row['period'], row['revenue']) for row in months],
+            [(datetime.date(2024, 1, 1), Decimal("20.00")), (datetime.date(2024, 2, 1), Decimal("17.50")),
+             (datetime.date(2024, 4, 1), Decimal("10.00"))],
+        )
+        quarters = revenue_report('quarter', group='segment', start=datetime.date(2024, 1, 10))
+        self.assertEqual(
+            [(row['period'], row['segment'], row['purchases']) for row in quarters],
+            [(datetime.date(2024, 1, 1), '', 1), (datetime.date(2024, 1, 1), 'Retail', 2),
+             (datetime.date(2024, 4, 1), 'Retail', 1)],
+        )
+
+        response = self.client.get(
+            reverse('revenue_report_api'), {'period': 'week', 'group': 'product', 'product': self.products[1].pk},
+            headers={'Authorization': 'Bearer secret-token'},
+        )
+        self.assertEqual(response.status_code, 200)
+        [row] = response.json()['results']
+        self.assertEqual(Decimal(row.pop('revenue')), Decimal("7.50"))
+        self.assertEqual(row, {
+            'period': '2024-02-05', 'product_id': self.products[1].pk, 'product__name': "Rollup Product 1",
+            'units': 1, 'purchases': 1,
+        })
+        bad = self.client.get(reverse('revenue_report_api'), {'period': 'year'}, headers={'Authorization': 'Bearer secret-token'})
+        self.assertEqual(bad.status_code, 400)
+
+
+@override_settings(CRM_API_TOKENS=['secret-token'])
+class EngagementIngestTestCase(TransactionTestCase):
+    """The flush thread writes through its own connection, so these run outside a test transaction."""
+
+    def setUp(self):
+        self.customers = [
+            CustomerInformation.objects.create(name=f"Ingest Customer {i}", email=f"ingest{i}@example.com") for i in range(3)
+        ]
+        self.url = reverse('engagement_ingest')
+
+    def tearDown(self):
+        ingest.replace_buffer(None)
+
+    def use_buffer(self, max_size=1000, batch_size=10, flush_interval=60, **kwargs):
+        buffer = ingest.EngagementBuffer(max_size, batch_size, flush_interval, **kwargs)
+        ingest.replace_buffer(buffer)
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def post(self, events):
+        return self.client.post(
+            self.url, json.dumps(events), content_type='application/json', headers={'Authorization': 'Bearer secret-token'}
+        )
+
+    def visits(self, count, customer=None):
+        return [{'customer': (customer or self.customers[i % 3]).pk, 'level': 'Medium'} for i in range(count)]
+
+    def test_events_are_written_in_batches_and_drained_on_close(self):
+        buffer = self.use_buffer(batch_size=10)
+        response = self.post(self.visits(25) + [{'customer': 999999}])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'accepted': 26})
+
+        buffer.close()
+        self.assertEqual(Engagement.objects.filter(type_of_engagement='Website Visit', level_of_engagement='Medium').count(), 25)
+        self.assertEqual(buffer.stats, {'accepted': 26, 'rejected': 0, 'written': 25, 'dropped': 1, 'failed': 0})
+        self.assertEqual(self.post(self.visits(1)).status_code, 429)
+
+    def test_partial_batch_is_written_after_the_flush_interval(self):
+        self.use_buffer(batch_size=100, flush_interval=0.05)
+        self.assertEqual(self.post(self.visits(3)).status_code, 202)
+        deadline = time.monotonic() + 5
+        while Engagement.objects.count() < 3 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(Engagement.objects.count(), 3)
+
+    def test_full_buffer_answers_429(self):
+        buffer = self.use_buffer(max_size=5, batch_size=100)
+        self.assertEqual(self.post(self.visits(4)).status_code, 202)
+        response = self.post(self.visits(2))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(len(buffer), 4)
+
+        stats = self.client.get(self.url, headers={'Authorization': 'Bearer secret-token'}).json()
+        self.assertEqual((stats['queued'], stats['accepted'], stats['rejected']), (4, 4, 2))
+
+    def failing_writes(self, failures):
+        """Makes the next ``failures`` engagement inserts raise, as if the database were down."""
+        bulk_create = Engagement.objects.bulk_create
+        remaining = [failures]
+
+        def flaky_bulk_create(objects, *args, **kwargs):
+            if remaining[0]:
+                remaining[0] -= 1
+                raise DatabaseError("database is down")
+            return bulk_create(objects, *args, **kwargs)
+        return mock.patch.object(Engagement.objects, 'bulk_create', side_effect=flaky_bulk_create)
+
+    def test_failed_batches_are_retried(self):
+        buffer = self.use_buffer(max_size=5, batch_size=10, write_attempts=3, retry_backoff=0)
+        with self.failing_writes(2), self.assertLogs('crm.ingest', 'ERROR') as logs:
+            self.assertEqual(self.post(self.visits(5)).status_code, 202)
+            buffer.close()
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(Engagement.objects.count(), 5)
+        self.assertEqual((buffer.stats['written'], buffer.stats['failed']), (5, 0))
+
+    def test_batches_are_dropped_after_repeated_failures(self):
+        buffer = self.use_buffer(batch_size=10, write_attempts=3, retry_backoff=0)
+        with self.failing_writes(3), self.assertLogs('crm.ingest', 'ERROR') as logs:
+            self.assertEqual(self.post(self.visits(5)).status_code, 202)
+            buffer.close()
+        self.assertIn("Dropping 5 buffered engagement events after 3 failed writes", logs.output[-1])
+        self.assertEqual(Engagement.objects.count(), 0)
+        self.assertEqual((buffer.stats['written'], buffer.stats['failed']), (0, 5))
+
+    def test_malformed_events_reject_the_request(self):
+        buffer = self.use_buffer()
+        response = self.post(self.visits(1) + [{'customer': 'abc'}, {'customer': 1, 'type': 'Fax'}, {'customer': 1, 'date': 'soon'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2, 3])
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.client.post(self.url, '[]', content_type='application/json').status_code, 401)
+
+
+class LeadFunnelTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="funnel", password="password")
+        self.start = timezone.now() - datetime.timedelta(days=30)
+
+    def lead(self, *stages):
+        """A lead that entered ``stages`` at the given day offsets from ``self.start``: ``(stage, day)`` pairs."""
+        lead = CustomerLead.objects.bulk_create([
+            CustomerLead(name="Funnel Lead", status="Open", likelihood_to_convert=50, lead_stage=stages[-1][0])
+        ])[0]
+        previous = ''
+        for stage, day in stages:
+            LeadStageTransition.objects.create(
+                lead=lead, from_stage=previous, to_stage=stage, changed_at=self.start + datetime.timedelta(days=day)
+            )
+            previous = stage
+        return lead
+
+    def test_stage_changes_are_recorded_once_per_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            lead = CustomerLead.objects.create(name="Tracked", status="Open", likelihood_to_convert=10, lead_stage="Initial Contact")
+            lead.likelihood_to_convert = 20
+            lead.save()
+            lead.lead_stage = "Qualified"
+            lead.save()
+        self.assertEqual(
+            list(lead.stage_transitions.order_by('id').values_list('from_stage', 'to_stage')),
+            [('', 'Initial Contact'), ('Initial Contact', 'Qualified')],
+        )
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('lead_detail', args=[lead.pk]))
+        self.assertEqual([transition.to_stage for transition in response.context['stage_history']], ['Initial Contact', 'Qualified'])
+
+    def test_funnel_counts_conversions_and_median_days_in_stage(self):
+        self.lead(('Initial Contact', 0), ('Qualified', 2), ('Won', 5))
+        self.lead(('Initial Contact', 0), ('Qualified', 4), ('Lost', 6))
+        self.lead(('Initial Contact', 0))
+
+        report = funnel.compute_funnel()
+        self.assertEqual((report['leads'], report['won'], report['win_rate']), (3, 1, 33.3))
+        stages = {row['stage']: row for row in report['stages']}
+        self.assertEqual(
+            {key: stages['Initial Contact'][key] for key in ('entered', 'current', 'advanced', 'conversion_rate', 'median_days')},
+            {'entered': 3, 'current': 1, 'advanced': 2, 'conversion_rate': 66.7, 'median_days': 3.0},
+        )
+        self.assertEqual((stages['Qualified']['advanced'], stages['Qualified']['median_days']), (1, 2.5))
+        self.assertEqual((stages['Negotiation']['entered'], stages['Negotiation']['conversion_rate']), (0, None))
+        self.assertEqual((stages['Won']['current'], stages['Lost']['current']), (1, 1))
+
+    def test_cohort_is_selected_by_creation_date(self):
+        old = self.lead(('Initial Contact', 0))
+        self.lead(('Initial Contact', 0))
+        CustomerLead.objects.filter(pk=old.pk).update(created_at=self.start - datetime.timedelta(days=60))
+        self.assertEqual(funnel.compute_funnel(start=self.start.date())['leads'], 1)
+        self.assertEqual(funnel.compute_funnel(end=self.start.date() - datetime.timedelta(days=1))['leads'], 1)
+
+    def test_report_is_cached_until_a_stage_changes(self):
+        lead = self.lead(('Initial Contact', 0))
+        with self.assertNumQueries(1):
+            funnel.funnel_report()
+        with self.assertNumQueries(0):
+            self.assertEqual(funnel.funnel_report()['stages'][1]['entered'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lead.lead_stage = 'Qualified'
+            lead.save()
+        self.assertEqual(funnel.funnel_report()['stages'][1]['entered'], 1)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('funnel_report'), {'start': 'soon'})
+        self.assertContains(response, "start must be a date")
+
+
+class LeadScoringTestCase(TestCase):
+
+    def setUp(self):
+        # Won leads belong to engaged, buying customers; Lost leads to customers who did neither
+        product = Product.objects.create(name="Scoring Product", price=Decimal("10.00"))
+        for i in range(6):
+            customer = self.customer(f"Won {i}", engagements=5, purchases=3, product=product)
+            self.lead(customer, "Won")
+            self.lead(self.customer(f"Lost {i}"), "Lost")
+        self.engaged = self.lead(self.customer("Engaged", engagements=4, purchases=2, product=product), "Qualified")
+        self.quiet_customer = self.customer("Quiet")
+        self.quiet = self.lead(self.quiet_customer, "Qualified")
+        self.product = product
+
+    def customer(self, name, engagements=0, purchases=0, product=None):
+        customer = CustomerInformation.objects.create(name=name, email=f"{name.replace(' ', '').lower()}@example.com")
+        for _ in range(engagements):
+            Engagement.objects.create(customer=customer, level_of_engagement="High", type_of_engagement="Meeting")
+        for _ in range(purchases):
+            ProductsPurchased.objects.create(customer=customer, product=product, number_of_products_purchased=1, amount_spent=Decimal("10.00"))
+        return customer
+
+    def lead(self, customer, stage):
+        return CustomerLead.objects.create(
+            customer=customer, name="Scored Lead", status="Open", likelihood_to_convert=50, lead_stage=stage
+        )
+
+    def test_open_leads_are_scored_from_closed_history(self):
+        result = score_leads()
+        self.assertEqual((result['scored'], result['trained_on']), (2, 12))
+        self.engaged.refresh_from_db()
+        self.quiet.refresh_from_db()
+        self.assertGreater(self.engaged.likelihood_to_convert, 50)
+        self.assertLess(self.quiet.likelihood_to_convert, 50)
+        # Closed leads keep their stored value
+        self.assertEqual(set(CustomerLead.objects.filter(lead_stage__in=['Won', 'Lost']).values_list('likelihood_to_convert', flat=True)), {50})
+
+    def age_rows(self):
+        """Moves every row out of the incremental runs' overlap window."""
+        long_ago = timezone.now() - 2 * LEAD_WATERMARK_OVERLAP
+        for model in (CustomerLead, Engagement, ProductsPurchased):
+            model.objects.update(updated_at=long_ago)
+
+    def test_incremental_run_only_rescores_changed_leads(self):
+        self.age_rows()
+        score_leads()
+        self.quiet.refresh_from_db()
+        before = self.quiet.likelihood_to_convert
+        self.assertEqual(score_leads(incremental=True)['scored'], 0)
+
+        for _ in range(4):
+            Engagement.objects.create(customer=self.quiet_customer, level_of_engagement="High", type_of_engagement="Call")
+        ProductsPurchased.objects.create(
+            customer=self.quiet_customer, product=self.product, number_of_products_purchased=1, amount_spent=Decimal("10.00")
+        )
+        result = score_leads(incremental=True)
+        self.assertEqual((result['scored'], result['updated'], result['trained_on']), (1, 1, 0))
+        self.quiet.refresh_from_db()
+        self.assertGreater(self.quiet.likelihood_to_convert, before)
+
+    def test_incremental_run_sees_edited_purchases_and_runs_in_full_periodically(self):
+        self.age_rows()
+        score_leads()
+        purchase = ProductsPurchased.objects.filter(customer=self.engaged.customer).first()
+        purchase.amount_spent = Decimal("500.00")
+        purchase.save()
+        result = score_leads(incremental=True)
+        self.assertEqual((result['scored'], result['trained_on']), (1, 0))
+
+        checkpoint = JobCheckpoint.objects.get(name='lead_scoring')
+        checkpoint.state['full_run_at'] = (timezone.now() - datetime.timedelta(days=2)).isoformat()
+        checkpoint.save()
+        result = score_leads(incremental=True)
+        self.assertEqual((result['scored'], result['trained_on']), (2, 12))
+
+    def test_training_needs_won_and_lost_leads(self):
+        CustomerLead.objects.filter(lead_stage='Lost').delete()
+        with self.assertRaises(ValueError):
+            score_leads()
+        with self.assertRaises(CommandError):
+            call_command('crm_score_leads', stdout=StringIO())
+
+
+class RfmSegmentationTestCase(TestCase):
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        product = Product.objects.create(name="RFM Product", price=10.00)
+        # Ten buyers, each buying more often, more recently and for more than the one before
+        self.buyers = []
+        for index in range(10):
+            customer = CustomerInformation.objects.create(name=f"Buyer {index}", email=f"buyer{index}@example.com")
+            for purchase in range(index + 1):
+                ProductsPurchased.objects.create(
+                    customer=customer, product=product, number_of_products_purchased=1,
+                    amount_spent=Decimal(10 * (index + 1)), date_of_sale=self.today - datetime.timedelta(days=100 - 10 * index + purchase),
+                )
+            self.buyers.append(customer)
+        self.browser = CustomerInformation.objects.create(name="Browser", email="browser@example.com")
+
+    def test_quantile_scores_and_labels(self):
+        self.assertEqual(list(quantile_scores(range(10))), [1, 1, 2, 2, 3, 3, 4, 4, 5, 5])
+        self.assertEqual(list(quantile_scores([1, 1, 1, 1])), [1, 1, 1, 1])
+        self.assertEqual(
+            list(label_segments([5, 4, 5, 3, 1, 2, 2, 1], [5, 3, 1, 1, 5, 3, 1, 1], [5, 3, 1, 1, 4, 3, 1, 2])),
+            ['Champions', 'Loyal', 'New', 'Promising', "Can't Lose", 'At Risk', 'Hibernating', 'Lost'],
+        )
+
+    def test_segments_are_stored_for_every_customer(self):
+        counts = segment_customers(batch_size=3, today=self.today)
+        self.assertEqual(sum(counts.values()), 11)
+        best = CustomerSegment.objects.get(customer=self.buyers[-1])
+        self.assertEqual((best.segment, best.recency_score, best.frequency_score, best.monetary_score), ('Champions', 5, 5, 5))
+        self.assertEqual((best.purchases, best.revenue), (10, Decimal("1000.00")))
+        self.assertEqual(CustomerSegment.objects.get(customer=self.buyers[0]).segment, 'Lost')
+        self.assertEqual(CustomerSegment.objects.get(customer=self.browser).segment, 'No Purchases')
+
+        # Rerunning updates the existing rows
+        ProductsPurchased.objects.filter(customer=self.buyers[-1]).delete()
+        segment_customers(today=self.today)
+        self.assertEqual(CustomerSegment.objects.count(), 11)
+        self.assertEqual(CustomerSegment.objects.get(customer=self.buyers[-1]).segment, 'No Purchases')
+
+    def test_customer_list_filters_by_segment(self):
+        segment_customers(today=self.today)
+        champions = set(CustomerInformation.objects.filter(rfm__segment='Champions'))
+        self.assertIn(self.buyers[-1], champions)
+        self.client.force_login(User.objects.create_user(username="rep", password="password"))
+        response = self.client.get(reverse('customer_list'), {'customer_segment': 'Champions'})
+        self.assertEqual(set(response.context['customers']), champions)
+        self.assertContains(response, 'Champions')
+        # Unknown segments are ignored rather than matching nothing
+        response = self.client.get(reverse('customer_list'), {'customer_segment': 'Nope'})
+        self.assertEqual(len(response.context['customers']), 10)
+
+    def test_dashboard_filters_customers_by_segment(self):
+        segment_customers(today=self.today)
+        self.client.force_login(User.objects.create_user(username="rep", password="password"))
+        response = self.client.get(reverse('dashboard'), {'customer_segment': 'No Purchases'})
+        self.assertEqual(list(response.context['customers']), [self.browser])
+        self.assertEqual(
+            list(dashboard.section_queryset('customers', segment='Lost')),
+            list(CustomerInformation.objects.filter(rfm__segment='Lost').order_by('pk')),
+        )
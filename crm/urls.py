@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from .views import (
     index, DashboardView, CustomerCreateView, CustomerDetailView, CustomerUpdateView, CustomerDeleteView,
@@ -6,10 +7,16 @@ from .views import (
     EngagementCreateView, EngagementDetailView, EngagementUpdateView, EngagementDeleteView,
     ProductsPurchasedCreateView, ProductsPurchasedUpdateView, ProductsPurchasedDeleteView,
     CreateUserView, InternalView, CustomerListView, LeadListView, ProductListView, EngagementListView,
-    signout_view, CustomLoginView, InternalServicesEditView, LifetimeValueEditView, customer_autocomplete,
-    ViewAccountView, EditAccountView, ProductsPurchasedDetailView
+    signout_view, CustomLoginView, InternalServicesEditView, customer_autocomplete,
+    ViewAccountView, EditAccountView, ProductsPurchasedDetailView, export_view, api_records,
+    AsyncDashboardView, AsyncCustomerDetailView, customer_autocomplete_async, RevenueReportView, revenue_report_api,
+    engagement_ingest, FunnelReportView
 )
 
+if settings.CRM_ASYNC_VIEWS:
+    DashboardView, CustomerDetailView = AsyncDashboardView, AsyncCustomerDetailView
+    customer_autocomplete = customer_autocomplete_async
+
 urlpatterns = [
     # Index page (landing page)
     path('', index, name='index'),
@@ -17,7 +24,6 @@ urlpatterns = [
     # Internal
     path('internal/', InternalView.as_view(), name='internal'),
     path('internal/edit/<str:metric>/', InternalServicesEditView.as_view(), name='internal_services_edit'),
-    path('internal/life-value/edit/', LifetimeValueEditView.as_view(), name='lifetime_value_edit'),
 
     # Dashboard
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
@@ -57,6 +63,18 @@ urlpatterns = [
     path('products-purchased/<int:pk>/delete/', ProductsPurchasedDeleteView.as_view(), name='products_purchased_delete'),
     path('products-purchased/<int:pk>/', ProductsPurchasedDetailView.as_view(), name='products_purchased_detail'),
     
+    # Exports
+    path('export/<str:dataset>/', export_view, name='export'),
+
+    # Reports
+    path('reports/revenue/', RevenueReportView.as_view(), name='revenue_report'),
+    path('reports/funnel/', FunnelReportView.as_view(), name='funnel_report'),
+
+    # JSON API
+    path('api/v1/reports/revenue/', revenue_report_api, name='revenue_report_api'),
+    path('api/v1/ingest/engagements/', engagement_ingest, name='engagement_ingest'),
+    path('api/v1/<str:resource>/', api_records, name='api_records'),
+
     # Accounts
     path('accounts/login/', CustomLoginView.as_view(), name='login'), 
     path('accounts/logout/', signout_view, name='logout'), 
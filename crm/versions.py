@@ -0,0 +1,84 @@
+"""
+Version counters for cache keys.
+
+A version is kept in the shared cache either per model or per object, the
+latter given as a ``(model, pk)`` pair. The receivers in ``crm.signals``
+bump them after every committed save, delete or bulk write. Cached entries
+put the versions of what they were computed from into their key, so a write
+makes the old entries unreachable instead of having to find and delete
+them, and stale data is never served. Old entries simply expire.
+
+A bump stores the current time in nanoseconds rather than incrementing, so
+it is a single ``set`` on every cache backend (the database and file-based
+caches implement ``incr`` as a non-atomic read and write), and a version
+that is missing, because it was never set or was evicted, cannot come back
+to a number old entries were cached under.
+"""
+import time
+
+from django.core.cache import cache
+
+from .models import (
+    CustomerInformation, CustomerChurnScore, CustomerLead, Engagement, InternalServices, Product, ProductsPurchased,
+    ProductSalesSummary
+)
+
+CACHE_PREFIX = 'crm:version:'
+
+# Models whose version every save, delete and bulk write bumps
+TRACKED_MODELS = (
+    CustomerInformation, CustomerChurnScore, CustomerLead, Engagement, InternalServices, Product, ProductsPurchased,
+    ProductSalesSummary
+)
+
+
+def _key(target):
+    if isinstance(target, tuple):
+        model, pk = target
+        return f'{CACHE_PREFIX}{model._meta.label_lower}:{pk}'
+    return CACHE_PREFIX + target._meta.label_lower
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def get_versions(*targets):
+    """Returns the current version of each model or ``(model, pk)`` pair, with one cache read."""
+    keys = [_key(target) for target in targets]
+    cached = cache.get_many(keys)
+    missing = [key for key in keys if key not in cached]
+    if missing:
+        version = _new_version()
+        for key in missing:
+            cache.add(key, version, timeout=None)
+        # Another process may have added its own first
+        cached.update({key: version for key in missing})
+        cached.update(cache.get_many(missing))
+    return [cached[key] for key in keys]
+
+
+def version_key(*targets):
+    """Joins the versions of ``targets`` into one cache key component."""
+    return '.'.join(str(version) for version in get_versions(*targets))
+
+
+def bump(*targets):
+    """
+    Gives each model or ``(model, pk)`` pair (every tracked model by default)
+    a new version, and returns it.
+    """
+    version = _new_version()
+    keys = [_key(target) for target in targets or TRACKED_MODELS]
+    cache.set_many(dict.fromkeys(keys, version), timeout=None)
+    _bumped_here.update(dict.fromkeys(keys, version))
+    return version
+
+
+# The last version this process gave each key
+_bumped_here = {}
+
+
+def bumped_here(target):
+    """The last version this process gave ``target``, or None."""
+    return _bumped_here.get(_key(target))
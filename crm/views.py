@@ -1,16 +1,32 @@
+import asyncio
+import math
+
 from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.forms import AuthenticationForm, UserChangeForm
 from django.contrib.auth.views import LoginView
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils.timezone import now
-from django.http import JsonResponse
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.core.paginator import Paginator
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
-from django.db.models import Sum, Q
+from django.db.models import Q, F
+from . import api, dashboard, detail_cache, exports, funnel, ingest, rollups
+from .autocomplete import customer_index
+from .concurrent import render_concurrently, run_query
+from .conditional import conditional, model_state, row_state
+from .routers import replica_reads
+from .pagination import CursorPaginationMixin, CursorPaginator, cursor_pagination_enabled
+from .search import search_customers
 from .models import (
-    CustomerInformation, Product, ProductsPurchased, CustomerLead, Engagement, LifetimeValue, InternalServices
+    CustomerInformation, CustomerChurnScore, CustomDescriptionField, Product, ProductsPurchased, ProductSalesSummary,
+    CustomerLead, Engagement, InternalServices, MetricCounter, DailySalesRollup, LeadStageTransition, CustomerSegment
 )
 from .forms import (
     CustomerForm, ProductForm, LeadForm, EngagementForm, CustomUserCreationForm, 
@@ -26,61 +42,70 @@ def index(request):
     return render(request, 'General/index.html')
 
 
-class DashboardView(ListView):
+DASHBOARD_STATE = model_state(CustomerInformation, CustomerLead, Product, Engagement, InternalServices, CustomerSegment)
+
+
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(DASHBOARD_STATE), name='get')
+class DashboardView(TemplateView):
     """ Main dashboard view, displays a summary of customers, leads, products, and engagements. """
-    model = CustomerInformation
     template_name = 'General/dashboard.html'
-    context_object_name = 'customers'
-    paginate_by = 10
+    paginate_by = dashboard.PAGE_SIZE
+    search_params = {
+        'customers': 'customer_search',
+        'leads': 'lead_search',
+        'products': 'product_search',
+        'engagements': 'engagement_search',
+    }
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        # Customer search
-        customer_search = self.request.GET.get('customer_search', '')
-        customers = CustomerInformation.objects.filter(
-            Q(name__icontains=customer_search) |
-            Q(email__icontains=customer_search) |
-            Q(phone__icontains=customer_search)
-        ) if customer_search else CustomerInformation.objects.all()
-        context.update(self._get_paginated_context(customers, 'customers'))
-
-        # Lead search
-        lead_search = self.request.GET.get('lead_search', '')
-        leads = CustomerLead.objects.filter(
-            Q(customer__name__icontains=lead_search) |
-            Q(status__icontains=lead_search)
-        ) if lead_search else CustomerLead.objects.all()
-        context.update(self._get_paginated_context(leads, 'leads'))
-
-        # Product search
-        product_search = self.request.GET.get('product_search', '')
-        products = Product.objects.filter(Q(name__icontains=product_search)) if product_search else Product.objects.all()
-        context.update(self._get_paginated_context(products, 'products'))
-
-        # Engagement search
-        engagement_search = self.request.GET.get('engagement_search', '')
-        engagements = Engagement.objects.filter(
-            Q(customer__name__icontains=engagement_search) |
-            Q(type_of_engagement__icontains=engagement_search)
-        ) if engagement_search else Engagement.objects.all()
-        context.update(self._get_paginated_context(engagements, 'engagements'))
+
+        # Unfiltered first pages and the KPI block come from the precomputed snapshot
+        snapshot = dashboard.get_snapshot(self._get_snapshot_sections() + ['kpis'])
+        for section in dashboard.PAGED_SECTIONS:
+            context.update(self._get_section_context(section, snapshot.get(section)))
 
         # Internal Services context
-        internal_services = InternalServices.objects.first()
-        if internal_services:
-            context['growth_rate'] = internal_services.current_growth_rate or "N/A"
-            context['projected_revenue'] = internal_services.projected_revenue or 0
-            context['churn_rate'] = internal_services.internal_churn_rate or "N/A"
+        context.update(snapshot['kpis'])
+        context['segments'] = CustomerSegment.SEGMENTS
+        return context
+
+    def _get_snapshot_sections(self):
+        return [
+            section for section in dashboard.PAGED_SECTIONS
+            if not self._get_search(section) and self.request.GET.get(f'{section}_page') in (None, '', '1')
+            and not (section == 'customers' and self._get_segment())
+        ]
+
+    def _get_section_context(self, section, snapshot_entry=None):
+        if snapshot_entry is None:
+            segment = self._get_segment() if section == 'customers' else ''
+            queryset = dashboard.section_queryset(section, self._get_search(section), segment)
+            return self._get_paginated_context(queryset, section)
+        rows, count = snapshot_entry['rows'], snapshot_entry['count']
+        if cursor_pagination_enabled(self):
+            paginator = CursorPaginator(dashboard.section_queryset(section), self.paginate_by)
+            page_obj = paginator.build_page(rows)
         else:
-            context.update({'growth_rate': "N/A", 'projected_revenue': 0, 'churn_rate': "N/A"})
+            page_obj = dashboard.SnapshotPaginator(rows, count, self.paginate_by).page(1)
+        return self._get_page_context(page_obj, section)
 
-        return context
+    def _get_search(self, section):
+        return self.request.GET.get(self.search_params[section], '')
+
+    def _get_segment(self):
+        return get_segment(self.request)
 
     def _get_paginated_context(self, queryset, context_name):
-        paginator = self.get_paginator(queryset, self.paginate_by)
+        if cursor_pagination_enabled(self):
+            paginator = CursorPaginator(queryset, self.paginate_by)
+        else:
+            paginator = Paginator(queryset, self.paginate_by)
         page = self.request.GET.get(f'{context_name}_page')
-        page_obj = paginator.get_page(page)
+        return self._get_page_context(paginator.get_page(page), context_name)
+
+    def _get_page_context(self, page_obj, context_name):
         return {
             context_name: page_obj,
             f'is_paginated_{context_name}': page_obj.has_other_pages(),
@@ -88,12 +113,41 @@ class DashboardView(ListView):
         }
 
 
+@method_decorator(conditional(DASHBOARD_STATE), name='get')
+class AsyncDashboardView(DashboardView):
+    """
+    Dashboard for ASGI deployments. The four sections and the KPI block are
+    independent, so each is loaded in its own worker thread, concurrently.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        context = super(DashboardView, self).get_context_data(**kwargs)
+        snapshot_sections = self._get_snapshot_sections()
+        *sections, snapshot = await asyncio.gather(
+            *[run_query(self._load_section, section, section in snapshot_sections) for section in dashboard.PAGED_SECTIONS],
+            run_query(dashboard.get_snapshot, ['kpis']),
+        )
+        for section_context in sections:
+            context.update(section_context)
+        context.update(snapshot['kpis'])
+        context['segments'] = CustomerSegment.SEGMENTS
+        return await render_concurrently(self.render_to_response(context))
+
+    def _load_section(self, section, from_snapshot):
+        snapshot_entry = dashboard.get_snapshot([section])[section] if from_snapshot else None
+        context = self._get_section_context(section, snapshot_entry)
+        # Fetch the rows here rather than one section after another while rendering
+        page_obj = context[section]
+        page_obj.object_list = list(page_obj.object_list)
+        return context
+
+
 # Authentication and User Management Views
 # -------------------------------------------------------
 
 class CreateUserView(CreateView):
     """ View for creating a new user (sign-up). """
-    template_name = 'accounts/signup.html'
+    template_name = 'Accounts/signup.html'
     form_class = CustomUserCreationForm
     success_url = reverse_lazy('dashboard')
 
@@ -105,7 +159,7 @@ class CreateUserView(CreateView):
 
 class CustomLoginView(LoginView):
     """ Custom login view. """
-    template_name = 'accounts/login.html'
+    template_name = 'Accounts/login.html'
     authentication_form = AuthenticationForm
 
 
@@ -119,7 +173,7 @@ class EditAccountView(LoginRequiredMixin, UpdateView):
     """ View for editing the user's account information. """
     model = User
     form_class = UserChangeForm
-    template_name = 'accounts/edit_account.html'
+    template_name = 'Accounts/edit_account.html'
     success_url = reverse_lazy('view_account')
 
     def get_object(self):
@@ -129,7 +183,7 @@ class EditAccountView(LoginRequiredMixin, UpdateView):
 
 class ViewAccountView(LoginRequiredMixin, TemplateView):
     """ View to display the current user's account information. """
-    template_name = 'accounts/view_account.html'
+    template_name = 'Accounts/view_account.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -140,7 +194,15 @@ class ViewAccountView(LoginRequiredMixin, TemplateView):
 # Customer Views
 # -------------------------------------------------------
 
-class CustomerListView(ListView):
+def get_segment(request):
+    """The RFM segment requested with ``?customer_segment=``, or '' when missing or unknown."""
+    segment = request.GET.get('customer_segment', '')
+    return segment if segment in dict(CustomerSegment.SEGMENTS) else ''
+
+
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(model_state(CustomerInformation, CustomerChurnScore, CustomerSegment)), name='get')
+class CustomerListView(CursorPaginationMixin, ListView):
     """ View to list all customers with search functionality. """
     model = CustomerInformation
     template_name = 'Customer/customer_list.html'
@@ -149,13 +211,22 @@ class CustomerListView(ListView):
 
     def get_queryset(self):
         query = self.request.GET.get('customer_search', '')
-        if query:
-            return CustomerInformation.objects.filter(
-                Q(name__icontains=query) |
-                Q(email__icontains=query) |
-                Q(phone__icontains=query)
-            )
-        return CustomerInformation.objects.all()
+        customers = search_customers(query).annotate(
+            churn_risk=F('churn_score__score'),
+            segment=F('rfm__segment'),
+        )
+        segment = get_segment(self.request)
+        if segment:
+            customers = customers.filter(rfm__segment=segment)
+        if self.request.GET.get('sort') == 'churn':
+            # Sorts on the indexed score column; customers not scored yet come last
+            customers = customers.order_by(F('churn_risk').desc(nulls_last=True), 'pk')
+        return customers
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['segments'] = CustomerSegment.SEGMENTS
+        return context
 
 
 class CustomerCreateView(CreateView):
@@ -184,22 +255,47 @@ class CustomerCreateView(CreateView):
             return self.form_invalid(form)
 
 
+CUSTOMER_DETAIL_STATE = row_state(CustomerInformation, 'self', CustomerChurnScore, InternalServices)
+
+
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(CUSTOMER_DETAIL_STATE), name='get')
 class CustomerDetailView(DetailView):
     """ View to display customer details. """
     model = CustomerInformation
     template_name = 'Customer/customer_detail.html'
     context_object_name = 'customer'
+    queryset = CustomerInformation.objects.select_related('churn_score').prefetch_related('customdescriptionfield_set')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        customer = self.object
-        context['total_revenue'] = ProductsPurchased.objects.filter(customer=customer).aggregate(total=Sum('amount_spent'))['total'] or 0
-        context['likelihood_to_churn'] = customer.likelihood_to_churn()
-        lifetime_value = LifetimeValue.objects.filter(customer=customer).first()
-        context['lifetime_value'] = lifetime_value.calculate_lifetime_value() if lifetime_value else 0
+        context['descriptions'] = self.object.customdescriptionfield_set.all()
+        # Revenue, churn and lifetime value are cached until one of their source rows changes
+        context.update(detail_cache.customer_aggregates(self.object))
         return context
 
 
+@method_decorator(conditional(CUSTOMER_DETAIL_STATE), name='get')
+class AsyncCustomerDetailView(CustomerDetailView):
+    """
+    Customer details for ASGI deployments. The customer, their descriptions
+    and the cached aggregates are loaded concurrently, each in a worker thread.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        pk = kwargs[self.pk_url_kwarg]
+        self.object, descriptions, aggregates = await asyncio.gather(
+            run_query(self.get_object, CustomerInformation.objects.select_related('churn_score')),
+            run_query(list, CustomDescriptionField.objects.filter(customer_id=pk)),
+            # Keyed by id, so this does not have to wait for the customer
+            run_query(detail_cache.customer_aggregates, CustomerInformation(pk=pk)),
+        )
+        context = super(CustomerDetailView, self).get_context_data(
+            object=self.object, descriptions=descriptions, **aggregates
+        )
+        return await render_concurrently(self.render_to_response(context))
+
+
 class CustomerUpdateView(UpdateView):
     """ View to update customer details. """
     model = CustomerInformation
@@ -226,15 +322,113 @@ class CustomerUpdateView(UpdateView):
         else:
             return self.form_invalid(form)
           
+@replica_reads
 def customer_autocomplete(request):
     """View to handle customer autocomplete search."""
     if 'term' in request.GET:
-        qs = CustomerInformation.objects.filter(name__icontains=request.GET.get('term'))[:10]
-        customers = list(qs.values('id', 'name', 'email'))
+        customers = customer_index.search(request.GET.get('term'))
         return JsonResponse(customers, safe=False)
     return JsonResponse([], safe=False)
 
 
+@replica_reads
+async def customer_autocomplete_async(request):
+    """Async customer autocomplete; the index lookup runs in a worker thread, off the event loop."""
+    if 'term' in request.GET:
+        customers = await run_query(customer_index.search, request.GET.get('term'))
+        return JsonResponse(customers, safe=False)
+    return JsonResponse([], safe=False)
+
+
+@replica_reads
+@login_required
+def export_view(request, dataset):
+    """Streams a dataset export; see ``crm.exports`` for the supported parameters."""
+    if dataset not in exports.DATASETS:
+        raise Http404(f"Unknown export {dataset}")
+    file_format = request.GET.get('format', 'csv')
+    if file_format not in exports.FORMATS:
+        return HttpResponseBadRequest(f"format must be one of {', '.join(exports.FORMATS)}")
+    try:
+        filters = exports.parse_filters(
+            request.GET.get('since'), request.GET.get('until'), request.GET.get('after_id')
+        )
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+    compress = request.GET.get('gzip') in ('1', 'true')
+
+    response = StreamingHttpResponse(
+        exports.stream_export(dataset, file_format, compress, **filters),
+        content_type='application/gzip' if compress else exports.CONTENT_TYPES[file_format],
+    )
+    filename = exports.export_filename(dataset, file_format, compress)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def api_state(request, resource):
+    if resource not in api.RESOURCES:
+        return None
+    try:
+        api.authenticate(request)
+    except api.ApiError:
+        # Left to the view to report; failed requests get no ETag
+        return None
+    return model_state(api.RESOURCES[resource].model)(request)
+
+
+@replica_reads
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+@conditional(api_state)
+def api_records(request, resource):
+    """Lists records (GET) or writes a batch of them (POST); see ``crm.api`` for the formats."""
+    if resource not in api.RESOURCES:
+        return JsonResponse({'error': f"Unknown resource {resource}."}, status=404)
+    try:
+        api.authenticate(request)
+        if request.method == 'GET':
+            return JsonResponse(api.list_records(resource, request.GET.get('after'), request.GET.get('limit')))
+        ok, results = api.save_batch(resource, api.parse_batch(request.body))
+    except api.ApiError as exc:
+        return JsonResponse({'error': str(exc)}, status=exc.status)
+    return JsonResponse({
+        'created': sum(result['status'] == 'created' for result in results),
+        'updated': sum(result['status'] == 'updated' for result in results),
+        'results': results,
+    }, status=200 if ok else 400)
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def engagement_ingest(request):
+    """Queues engagement events for buffered writing (POST) or reports the buffer's counters (GET); see ``crm.ingest``."""
+    buffer = ingest.get_buffer()
+    try:
+        api.authenticate(request)
+        if request.method == 'GET':
+            return JsonResponse({'queued': len(buffer), **buffer.stats})
+        records = api.parse_batch(request.body)
+    except api.ApiError as exc:
+        return JsonResponse({'error': str(exc)}, status=exc.status)
+
+    events, errors = [], []
+    for index, record in enumerate(records):
+        try:
+            events.append(ingest.parse_event(record))
+        except ValueError as exc:
+            errors.append({'index': index, 'error': str(exc)})
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+    try:
+        buffer.offer(events)
+    except ingest.BufferFull:
+        response = JsonResponse({'error': "The ingest buffer is full; retry later."}, status=429)
+        response['Retry-After'] = str(max(1, math.ceil(buffer.flush_interval)))
+        return response
+    return JsonResponse({'accepted': len(events)}, status=202)
+
+
 class CustomerDeleteView(DeleteView):
     """ View to delete a customer. """
     model = CustomerInformation
@@ -245,7 +439,9 @@ class CustomerDeleteView(DeleteView):
 # Lead Views
 # -------------------------------------------------------
 
-class LeadListView(ListView):
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(model_state(CustomerLead, CustomerInformation)), name='get')
+class LeadListView(CursorPaginationMixin, ListView):
     """ View to list all leads with search functionality. """
     model = CustomerLead
     template_name = 'Lead/lead_list.html'
@@ -254,13 +450,14 @@ class LeadListView(ListView):
 
     def get_queryset(self):
         query = self.request.GET.get('lead_search', '')
+        leads = CustomerLead.objects.select_related('customer').order_by('pk')
         if query:
-            return CustomerLead.objects.filter(
+            leads = leads.filter(
                 Q(customer__name__icontains=query) |
                 Q(name__icontains=query) |
                 Q(status__icontains=query)
             )
-        return CustomerLead.objects.all()
+        return leads
 
 
 class LeadCreateView(CreateView):
@@ -271,16 +468,21 @@ class LeadCreateView(CreateView):
     success_url = reverse_lazy('dashboard')
 
 
+@method_decorator(replica_reads, name='dispatch')
+# Time in pipeline counts days, so the page also changes when the date does
+@method_decorator(conditional(row_state(CustomerLead, CustomerInformation, daily=True)), name='get')
 class LeadDetailView(DetailView):
     """ View to display lead details. """
     model = CustomerLead
     template_name = 'Lead/lead_detail.html'
     context_object_name = 'lead'
+    queryset = CustomerLead.objects.select_related('customer')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         lead = self.object
         context['total_time_in_pipeline'] = (now().date() - lead.created_at.date()).days
+        context['stage_history'] = funnel.stage_history(lead)
         return context
 
 
@@ -296,13 +498,18 @@ class LeadDeleteView(DeleteView):
     """ View to delete a lead. """
     model = CustomerLead
     template_name = 'Lead/lead_confirm_delete.html'
+    context_object_name = 'lead'
     success_url = reverse_lazy('lead_list')
 
 
 # Product Views
 # -------------------------------------------------------
 
-class ProductListView(ListView):
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(model_state(
+    Product, ProductsPurchased, ProductSalesSummary, CustomerInformation
+)), name='get')
+class ProductListView(CursorPaginationMixin, ListView):
     model = Product
     template_name = 'Product/product_list.html'
     context_object_name = 'products'
@@ -310,22 +517,26 @@ class ProductListView(ListView):
 
     def get_queryset(self):
         query = self.request.GET.get('product_search', '')
-        products = Product.objects.all()
+        products = Product.objects.order_by('pk')
         if query:
             products = products.filter(name__icontains=query)
+        # Totals come from the maintained summary row, not a join over every purchase
         products = products.annotate(
-            total_purchased=Sum('productspurchased__number_of_products_purchased'),
-            total_revenue=Sum('productspurchased__amount_spent')
+            total_purchased=F('sales_summary__units_sold'),
+            total_revenue=F('sales_summary__revenue')
         )
         return products
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        products_purchased = ProductsPurchased.objects.all()
+        products_purchased = ProductsPurchased.objects.select_related('customer', 'product').order_by('-date_of_sale', '-pk')
         purchases_page = self.request.GET.get('purchases_page')
-        purchases_paginator = self.get_paginator(products_purchased, self.paginate_by)
+        if cursor_pagination_enabled(self):
+            purchases_paginator = CursorPaginator(products_purchased, self.paginate_by)
+        else:
+            purchases_paginator = self.get_paginator(products_purchased, self.paginate_by)
         context['products_purchased'] = purchases_paginator.get_page(purchases_page)
-        context['is_paginated_purchases'] = purchases_paginator.num_pages > 1
+        context['is_paginated_purchases'] = context['products_purchased'].has_other_pages()
         context['page_obj_purchases'] = context['products_purchased']
         return context
 
@@ -338,16 +549,20 @@ class ProductCreateView(CreateView):
     success_url = reverse_lazy('dashboard')
 
 
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(row_state(Product, ProductsPurchased, ProductSalesSummary)), name='get')
 class ProductDetailView(DetailView):
     """ View to display product details. """
     model = Product
     template_name = 'Product/product_detail.html'
     context_object_name = 'product'
+    queryset = Product.objects.select_related('sales_summary')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        product = self.object
-        context['total_revenue'] = ProductsPurchased.objects.filter(product=product).aggregate(total=Sum('amount_spent'))['total'] or 0
+        summary = getattr(self.object, 'sales_summary', None)
+        context['sales_summary'] = summary
+        context['total_revenue'] = summary.revenue if summary else 0
         return context
 
 
@@ -369,7 +584,9 @@ class ProductDeleteView(DeleteView):
 # Engagement Views
 # -------------------------------------------------------
 
-class EngagementListView(ListView):
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(model_state(Engagement, CustomerInformation)), name='get')
+class EngagementListView(CursorPaginationMixin, ListView):
     """ View to list all engagements with search functionality. """
     model = Engagement
     template_name = 'Engagement/engagement_list.html'
@@ -378,12 +595,13 @@ class EngagementListView(ListView):
 
     def get_queryset(self):
         query = self.request.GET.get('engagement_search', '')
+        engagements = Engagement.objects.select_related('customer').order_by('-engagement_date', '-pk')
         if query:
-            return Engagement.objects.filter(
+            engagements = engagements.filter(
                 Q(customer__name__icontains=query) |
                 Q(type_of_engagement__icontains=query)
             )
-        return Engagement.objects.all()
+        return engagements
 
 
 class EngagementCreateView(CreateView):
@@ -394,11 +612,14 @@ class EngagementCreateView(CreateView):
     success_url = reverse_lazy('dashboard')
 
 
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(row_state(Engagement, CustomerInformation)), name='get')
 class EngagementDetailView(DetailView):
     """ View to display engagement details. """
     model = Engagement
     template_name = 'Engagement/engagement_detail.html'
     context_object_name = 'engagement'
+    queryset = Engagement.objects.select_related('customer')
 
 
 class EngagementUpdateView(UpdateView):
@@ -413,12 +634,14 @@ class EngagementDeleteView(DeleteView):
     """ View to delete an engagement. """
     model = Engagement
     template_name = 'Engagement/engagement_confirm_delete.html'
+    queryset = Engagement.objects.select_related('customer')
     success_url = reverse_lazy('dashboard')
 
 
 # Internal Services Views
 # -------------------------------------------------------
 
+@method_decorator(replica_reads, name='dispatch')
 class InternalView(TemplateView):
     """ View to display internal metrics. """
     template_name = 'Internal/internal.html'
@@ -429,36 +652,28 @@ class InternalView(TemplateView):
 
         if internal_services:
             context.update({
-                'current_revenue': internal_services.current_revenue,
                 'projected_revenue': internal_services.projected_revenue,
                 'past_growth_rate': internal_services.past_growth_rate,
                 'current_growth_rate': internal_services.current_growth_rate,
                 'projected_growth': internal_services.projected_growth,
-                'total_customers': internal_services.total_customers,
                 'average_length_of_customer': internal_services.average_length_of_customer,
-                'internal_churn_rate': internal_services.internal_churn_rate,
                 'average_cost_to_acquire': internal_services.average_cost_to_acquire,
-                'average_revenue_per_customer': internal_services.average_revenue_per_customer,
                 'industry_growth_rate': internal_services.industry_growth_rate,
-                'average_lifetime_value': internal_services.average_lifetime_value,
                 'average_lifetime_value_id': internal_services.id
             })
         else:
             context.update({
-                'current_revenue': "N/A",
                 'projected_revenue': "N/A",
                 'past_growth_rate': "N/A",
                 'current_growth_rate': "N/A",
                 'projected_growth': "N/A",
-                'total_customers': "N/A",
                 'average_length_of_customer': "N/A",
-                'internal_churn_rate': "N/A",
                 'average_cost_to_acquire': "N/A",
-                'average_revenue_per_customer': "N/A",
                 'industry_growth_rate': "N/A",
-                'average_lifetime_value': "N/A",
                 'average_lifetime_value_id': None
             })
+        # Revenue, customers, churn and averages come from the running counters
+        context.update(MetricCounter.kpis())
         return context
 
 
@@ -471,12 +686,19 @@ class InternalServicesEditView(UpdateView):
     def get_object(self, queryset=None):
         return get_object_or_404(InternalServices)
 
+    def dispatch(self, request, *args, **kwargs):
+        metric = kwargs['metric']
+        field_names = {field.name for field in InternalServices._meta.concrete_fields if not field.primary_key}
+        # Derived KPIs are recomputed from the data and cannot be typed in
+        if metric not in field_names or metric in InternalServices.DERIVED_FIELDS:
+            raise Http404(f"{metric} is not an editable metric")
+        return super().dispatch(request, *args, **kwargs)
+
     def get_initial(self):
         """ Pre-fill the form with the value of the selected metric. """
         metric = self.kwargs['metric']
         initial = super().get_initial()
-        internal_services = self.get_object()
-        initial['value'] = getattr(internal_services, metric, None)
+        initial['value'] = getattr(self.object, metric, None)
         return initial
 
     def form_valid(self, form):
@@ -488,18 +710,65 @@ class InternalServicesEditView(UpdateView):
         return redirect(self.success_url)
 
 
-class LifetimeValueEditView(UpdateView):
-    """ View to edit average lifetime value. """
-    model = InternalServices
-    template_name = 'Internal/lifetime_value_edit.html'
-    fields = ['average_lifetime_value']
-    success_url = reverse_lazy('internal')
+# Report Views
+# -------------------------------------------------------
 
-    def get_object(self, queryset=None):
-        internal_services = InternalServices.objects.first()
-        if not internal_services:
-            internal_services = InternalServices.objects.create()
-        return internal_services
+def report_state(request):
+    try:
+        api.authenticate(request)
+    except api.ApiError:
+        return None
+    return model_state(DailySalesRollup)(request)
+
+
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(model_state(DailySalesRollup)), name='get')
+class RevenueReportView(TemplateView):
+    """ Revenue per week, month or quarter, rolled up from the daily sales rollup. """
+    template_name = 'Reports/revenue_report.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update({'periods': list(rollups.PERIODS), 'groups': list(rollups.GROUPS)})
+        try:
+            params = rollups.parse_report_params(self.request.GET)
+        except ValueError as exc:
+            context.update({'error': str(exc), 'params': {}})
+            return context
+        context.update({'params': params, 'rows': rollups.revenue_report(**params)})
+        return context
+
+
+@replica_reads
+@require_http_methods(['GET'])
+@conditional(report_state)
+def revenue_report_api(request):
+    """JSON version of the revenue report; takes the same parameters."""
+    try:
+        api.authenticate(request)
+        params = rollups.parse_report_params(request.GET)
+    except api.ApiError as exc:
+        return JsonResponse({'error': str(exc)}, status=exc.status)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({**params, 'results': rollups.revenue_report(**params)})
+
+
+@method_decorator(replica_reads, name='dispatch')
+@method_decorator(conditional(model_state(LeadStageTransition)), name='get')
+class FunnelReportView(TemplateView):
+    """ Per-stage counts, conversion rates and median days in stage for a cohort of leads. """
+    template_name = 'Reports/funnel_report.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        try:
+            params = funnel.parse_funnel_params(self.request.GET)
+        except ValueError as exc:
+            context.update({'error': str(exc), 'params': {}})
+            return context
+        context.update({'params': params, 'report': funnel.funnel_report(**params)})
+        return context
 
 
 # Products Purchased Views
@@ -528,8 +797,10 @@ class ProductsPurchasedDeleteView(DeleteView):
     success_url = reverse_lazy('dashboard')
     
     
+@method_decorator(replica_reads, name='dispatch')
 class ProductsPurchasedDetailView(DetailView):
     """View to display the details of a single product purchase."""
     model = ProductsPurchased
     template_name = 'Products-Purchased/product_purchased_view.html'
-    context_object_name = 'purchase'
\ No newline at end of file
+    context_object_name = 'purchase'
+    queryset = ProductsPurchased.objects.select_related('customer', 'product')
\ No newline at end of file